@@ -1,6 +1,5 @@
 # Importing necessary libraries
 import numpy as np
-import random
 from mesa import Agent
 from shapely.geometry import Point
 from shapely import contains_xy
@@ -20,21 +19,21 @@ class Households(Agent):
     In a real scenario, this would be based on actual geographical data or more complex logic.
     """
     #initialize agent attributes
-    def __init__(self, unique_id, model):
+    def __init__(self, unique_id, model, location=None):
         super().__init__(unique_id, model)
         self.is_adapted = False  # Initial adaptation status set to False
         self.is_adapted_cumulatief = False
 
         # attributes related to Adaptation Motivation which is dervied from Protection Motivation Theory
-        self.background = random.random()
-        self.threat_appraisal = random.random()
-        self.coping_appraisal = random.random()
-        self.climate_related_beliefs = random.random()
-        self.preceding_flood_engagement = random.random()
-        self.external_influence = random.random()
+        self.background = self.random.random()
+        self.threat_appraisal = self.random.random()
+        self.coping_appraisal = self.random.random()
+        self.climate_related_beliefs = self.random.random()
+        self.preceding_flood_engagement = self.random.random()
+        self.external_influence = self.random.random()
 
         # An initial budget from which the agent can spend money
-        self.budget = random.randint(1000, 7000)
+        self.budget = self.random.randint(1000, 7000)
 
         #Status for household measures with the following meaning
         #{1: Not Implemented, 2:Implementing, 3: Implemented}
@@ -47,12 +46,14 @@ class Households(Agent):
         
         self.financial_loss = 0 #cumulative sum of previous financial losses due to flood
         
-        self.savings_income = random.randint(300, 700) #Assumption: Every agent gets a standard
-        self.detached = random.choice([0, 1]) # #type of housing => 0 = not detached, 1 = detached
+        self.savings_income = self.random.randint(300, 700) #Assumption: Every agent gets a standard
+        self.detached = self.random.choice([0, 1]) # #type of housing => 0 = not detached, 1 = detached
 
         # getting flood map values
-        # Get a random location on the map
-        loc_x, loc_y = generate_random_location_within_map_domain()
+        # Get a random location on the map, unless the model already drew the location (e.g. for a spatial network)
+        if location is None:
+            location = generate_random_location_within_map_domain(self.random)
+        loc_x, loc_y = location
         self.location = Point(loc_x, loc_y)
 
         # Check whether the location is within floodplain
@@ -99,26 +100,16 @@ class Households(Agent):
                 #Agent can choose to elevate house in this timestep
                 if self.budget >= self.model.elevation_cost:
                     # agent has sufficient budget to implement elevation
-                    if random.random() >= 1 - self.model.intention_action_gap:
+                    if self.random.random() >= 1 - self.model.intention_action_gap:
                         #If the the probability is larger than or equal to the probability of an action following from an intention
                         self.elevation = 2 #Implementing elevation as a measure
                         self.budget -= self.model.elevation_cost #Reduce the costs of elevation from the agent's budget
-                        self.elevation_time_counter = 1 #this tick counts as one unit of time for implementing elevation
+                        self.schedule_completion('elevation', self.model.elevation_time) #this tick counts as one unit of time for implementing elevation
                         self.is_adapted = True #The agent is adapted
                         self.is_adapted_cumulatief = True
                 
-            elif self.elevation == 2:
-                #Agent is still implementing elevation
-                if self.elevation_time_counter >= self.model.elevation_time:
-                    self.elevation = 3
-                    
-                else:
-                    #Implementation time has not been reached, advance counter by 1
-                    self.elevation_time_counter += 1
-
-                #Check if implementation time has been reached during this step
             else:
-                # Agent has implemented elevation as a measure already. Continue
+                # Agent is implementing elevation, which is completed by the event calendar, or has implemented it already. Continue
                 pass
 
     # Checks if agent has implemented wet-proofing as a measure
@@ -127,28 +118,17 @@ class Households(Agent):
         if self.wet_proofing == 1: #if wet proofing has not been implemented yet
             #Agent can choose to implement wet_proofing in this timestep
             if self.budget >= self.model.wet_proofing_cost:
-                if random.random() >= 1 - self.model.intention_action_gap:
+                if self.random.random() >= 1 - self.model.intention_action_gap:
                     # Intention and budget are high enough for wet-proofing
                     self.wet_proofing = 2
                     self.budget -= self.model.wet_proofing_cost
-                    self.wet_proofing_time_counter = 1 #this tick counts as one unit of time for implementing elevation
+                    self.schedule_completion('wet_proofing', self.model.wet_proofing_time) #this tick counts as one unit of time for implementing wet_proofing
                     self.is_adapted = True
                     self.is_adapted_cumulatief = True
-            
-        elif self.wet_proofing == 2:
-            #Agent is implementing wet_proofing
-            #print('this agent is implementing wet_proofing', self.wet_proofing_time_counter)
-            if self.wet_proofing_time_counter >= self.model.wet_proofing_time:
-                self.wet_proofing = 3
-                
-            else:
-                #Implementation time has not been reached, advance counter by 1
-                self.wet_proofing_time_counter += 1
-            #Check if implementation time has been reached during this step
         
         else:
             pass
-            # Agent has implemented wet_proofing as a measure already
+            # Agent is implementing wet_proofing, which is completed by the event calendar, or has implemented it already
 
     #check if agent can implement dry-proofing as a measure
     def check_dry_proofing(self):
@@ -156,27 +136,27 @@ class Households(Agent):
             #Agent can choose to implement dry_proofing in this timestep
             if self.budget >= self.model.dry_proofing_cost:
 
-                if random.random() >= 1 - self.model.intention_action_gap:
+                if self.random.random() >= 1 - self.model.intention_action_gap:
                     #Intention and budget high enough for dry_proofing
                     self.dry_proofing = 2 #Update status for this measure to: Implementing
                     self.budget -= self.model.dry_proofing_cost #Adjust budget according to cost of the measure
-                    self.dry_proofing_time_counter = 1 #this tick counts as one unit of time for implementing elevation
+                    self.schedule_completion('dry_proofing', self.model.dry_proofing_time) #this tick counts as one unit of time for implementing dry_proofing
                     self.is_adapted = True
                     self.is_adapted_cumulatief = True
-            
-        elif self.dry_proofing == 2:
-            #Agent is still implementing dry_proofing
-            if self.dry_proofing_time_counter >= self.model.dry_proofing_time:
-                self.dry_proofing = 3
-            else:
-                #Implementation time has not been reached, advance counter by 1
-                self.dry_proofing_time_counter += 1
-            #Check if implementation time has been reached during this step
         
         else:
-            # Agent has implemented dry_proofing as a measure already
+            # Agent is implementing dry_proofing, which is completed by the event calendar, or has implemented it already
             #print("dry_proofing implementation complete")
             pass
+
+    def schedule_completion(self, measure, implementation_time):
+        """Schedules the completion of a measure that the agent started implementing in this step. 
+        The measure is implemented after the implementation time, but at least one step later."""
+        self.model.schedule.calendar.schedule(self.model.schedule.steps + max(implementation_time, 1), self, measure)
+
+    def complete(self, measure):
+        """Called by the event calendar when the implementation of a measure is completed."""
+        setattr(self, measure, 3)
         
     def choose_measure(self):
         # Check if AM is higher than highest threshold possible
@@ -186,7 +166,7 @@ class Households(Agent):
             # Check for all available measures in random order
             while available_measures:
                 # Make random choice of available measures
-                choice = random.choice(available_measures)
+                choice = self.random.choice(available_measures)
                 # Remove measure from available measures
                 available_measures.remove(choice)
                 
@@ -205,7 +185,7 @@ class Households(Agent):
             # Check for all available measures in random order
             while available_measures:
                 # Make random choice of available measures
-                choice = random.choice(available_measures)
+                choice = self.random.choice(available_measures)
                 # Remove measure from available measures
                 available_measures.remove(choice)
                 
@@ -226,11 +206,11 @@ class Households(Agent):
         # update threat_appraisal when flood has occurred
         if self.model.flood:
             if self.flood_depth_actual >= 6: # if the actual flood depth is higher than 6 meters
-                self.threat_appraisal = random.uniform(0.8, 1.0) #the threat appraisal is a random float between 0.8 and 1, which could be considered as high
+                self.threat_appraisal = self.random.uniform(0.8, 1.0) #the threat appraisal is a random float between 0.8 and 1, which could be considered as high
             elif 2 < self.flood_depth_actual < 6: # if the actual flood depth is lower than 6 meters but still higher than 2 meters,
-                self.threat_appraisal = random.uniform(0.4, 0.8) #the threat appraisal is a random float between 0.4 and 0.8, which could be considered as a medium threat
+                self.threat_appraisal = self.random.uniform(0.4, 0.8) #the threat appraisal is a random float between 0.4 and 0.8, which could be considered as a medium threat
             else:
-                self.threat_appraisal = random.uniform(0.2, 0.4) # the flood is lower than 2 meters, threat appraisal is a random low float
+                self.threat_appraisal = self.random.uniform(0.2, 0.4) # the flood is lower than 2 meters, threat appraisal is a random low float
         else:
             self.threat_appraisal -= 0.01 #Decay for the threat appraisal if no flood occurs
             
@@ -251,14 +231,14 @@ class Households(Agent):
     def update_preceding_flood_engagement(self):
         #preceeding floog engagement is related to the measures a household has undergone, and how recent the flood has occurred.
         # the agent has a memory of eight steps and each time it implements a measure, it adds a 1 to this list. The mean is then used to see if enough measures have been implementend
-        if np.mean(self.undergone_measures) >= random.random():
+        if np.mean(self.undergone_measures) >= self.random.random():
             if self.model.last_flood != 0: #if no flood has occurred at all
-                if self.model.flood_recency >= random.random(): # if the flood is recent
+                if self.model.flood_recency >= self.random.random(): # if the flood is recent
                     self.preceding_flood_engagement = self.preceding_flood_engagement * 1.1 #if it is very recent and measures have been taken, increase the PFE factor by 10%
             else:
                 self.preceding_flood_engagement= self.preceding_flood_engagement * 1.05 # if the flood is not recent enough, increase the PFE factor by 5%, because measures have been taken
                 
-        elif self.model.flood_recency >= random.random():
+        elif self.model.flood_recency >= self.random.random():
                 self.preceding_flood_engagement = self.preceding_flood_engagement * 1.05 #Update PFE factor by 5% if the age, but no measures have been taken
         else:
             self.preceding_flood_engagement = 0.9 * self.preceding_flood_engagement #Not enough measures taken and flood is not recent/not occurred
@@ -266,7 +246,12 @@ class Households(Agent):
     def update_external_influence(self):
         neighbors = self.model.grid.get_neighbors(self.pos) #get the agents neighbor from social network
 
-        avg_neighbor_AM = np.mean([neighbor.AM for neighbor in neighbors]) #take the average adaptation motivation from agents
+        neighbor_AM = self.model.schedule.get_neighbor_AM(neighbors) #the adaptation motivation of the neighbours, as seen in this step
+        if self.model.distance_decay is not None and neighbors:
+            #closer neighbours have more influence, so take the average weighted by the distance decay of the ties
+            avg_neighbor_AM = np.average(neighbor_AM, weights=self.model.get_neighbor_weights(self.pos, [neighbor.pos for neighbor in neighbors]))
+        else:
+            avg_neighbor_AM = np.mean(neighbor_AM) #take the average adaptation motivation from agents
 
         # Calculate the external influence based on the difference between self.AM and neighbors AM
         if self.AM < avg_neighbor_AM:
@@ -321,11 +306,11 @@ class Households(Agent):
     def income(self):
         #increase he agent's budget based on the economic circumstances. See this as savings
         if self.model.economic_status == 'growth':
-            self.budget += random.randint(500, 700)
+            self.budget += self.random.randint(500, 700)
         elif self.model.economic_status == 'recession':
-            self.budget += random.randint(0, 200)
+            self.budget += self.random.randint(0, 200)
         elif self.model.economic_status == 'neutral':
-            self.budget += random.randint(200, 500)
+            self.budget += self.random.randint(200, 500)
         
     def step(self): # agent step
         self.is_adapted = False
@@ -368,9 +353,9 @@ class Government(Agent, RBBGovernment):#inherit from RBBGovernment)
         """A government estimates the impact of a potential flood, 
         based on the damage from the previous flood"""
         if self.model.avg_flood_damage >= self.damage_threshold:
-            self.estimated_flood_impact = random.randrange(5,10)
+            self.estimated_flood_impact = self.random.randrange(5,10)
         else:
-            self.estimated_flood_impact = random.randrange(1,5)
+            self.estimated_flood_impact = self.random.randrange(1,5)
         return self.estimated_flood_impact
         
                
@@ -378,7 +363,8 @@ class Government(Agent, RBBGovernment):#inherit from RBBGovernment)
         """Government makes a decision on what kind of tool to deploy"""
 
         if self.decision_made:
-            self.decision.change_status()
+            # the completion of the decision is handled by the event calendar
+            pass
             
         else: #if no decision has been made yet
         #First, the topic needs to be on the agenda:
@@ -399,8 +385,11 @@ class Government(Agent, RBBGovernment):#inherit from RBBGovernment)
                     # if the estimated risk is low, government will prioritise cost 
                     # based on the organisation of the government, the implementation time of the option will change.
                 self.decision.impact_planning(self.structure)
-                #change the status of the measure to ' implementing'
+                #change the status of the measure to ' implementing' and schedule its completion
                 self.decision.change_status()
+                completion_step = self.decision.get_completion_step(self.model.schedule.steps)
+                if completion_step is not None:
+                    self.model.schedule.calendar.schedule(completion_step, self.decision, 'implementation')
                 
                 #print('Decision:', self.decision.name)
                 #change agenda back to False
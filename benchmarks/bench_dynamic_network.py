@@ -0,0 +1,66 @@
+"""
+Benchmark of the dynamic social network: applying batches of tie changes to a DynamicGraph (network.py)
+compared to rebuilding a networkx graph every step, as would be needed without incremental updates.
+
+Usage: python benchmarks/bench_dynamic_network.py [number_of_households] [steps]
+"""
+import os
+import sys
+import timeit
+import numpy as np
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from network import watts_strogatz_csr, DynamicGraph, rewire_by_homophily
+
+
+def record_changes(G, AM, steps, rate, seed):
+    """Returns the batches of tie changes of homophily rewiring, as (removed source, removed target, added source, added target) per step."""
+    rng = np.random.default_rng(seed)
+    dynamic = DynamicGraph.from_csr(G)
+    changes = []
+    edges = set(zip(*(side.tolist() for side in G.edges())))
+    for step in range(steps):
+        rewire_by_homophily(dynamic, AM, rate, rng)
+        new_edges = set(zip(*(side.tolist() for side in dynamic.to_csr().edges())))
+        removed, added = sorted(edges - new_edges), sorted(new_edges - edges)
+        changes.append(([u for u, v in removed], [v for u, v in removed], [u for u, v in added], [v for u, v in added]))
+        edges = new_edges
+    return changes
+
+
+def run_dynamic(G, AM, changes):
+    """Apply the batches of tie changes to a DynamicGraph in place, and take the neighbour sums that the scheduler uses."""
+    dynamic = DynamicGraph.from_csr(G)
+    for remove_source, remove_target, add_source, add_target in changes:
+        dynamic.remove_edges(remove_source, remove_target)
+        dynamic.add_edges(add_source, add_target)
+        dynamic.neighbor_sums(AM)
+    return dynamic
+
+
+def run_rebuild(G, AM, changes):
+    """Apply the same batches of tie changes to an edge list, and rebuild a networkx graph from it every step."""
+    edges = set(zip(*(side.tolist() for side in G.edges())))
+    for remove_source, remove_target, add_source, add_target in changes:
+        edges.difference_update(zip(remove_source, remove_target))
+        edges.update(zip(add_source, add_target))
+        graph = nx.Graph()
+        graph.add_nodes_from(range(G.n))
+        graph.add_edges_from(edges)
+    return graph
+
+
+def main(number_of_households=10000, steps=20, rate=0.05, seed=42):
+    G = watts_strogatz_csr(number_of_households, 5, 0.4, seed=seed)
+    AM = np.random.default_rng(seed).random(number_of_households)
+    changes = record_changes(G, AM, steps, rate, seed)
+    dynamic_time = timeit.timeit(lambda: run_dynamic(G, AM, changes), number=1)
+    rebuild_time = timeit.timeit(lambda: run_rebuild(G, AM, changes), number=1)
+    print(f'households: {number_of_households}, steps: {steps}, rewiring rate: {rate}')
+    print(f'incremental DynamicGraph: {dynamic_time:.3f} s ({dynamic_time / steps * 1000:.1f} ms per step)')
+    print(f'networkx rebuild:         {rebuild_time:.3f} s ({rebuild_time / steps * 1000:.1f} ms per step)')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,36 @@
+"""
+Benchmark of ensemble runs: R replications of a small population simulated as one vectorized simulation (ensemble.py)
+compared to the same replications as separate runs on a pool of worker processes (experiments.iter_runs).
+The model runs on small synthetic inputs (see fixtures.py), so the benchmark runs offline.
+
+Usage: python benchmarks/bench_ensemble.py [number_of_households] [replications] [max_steps] [number_processes]
+"""
+import os
+import sys
+import time
+import tempfile
+
+from fixtures import use_fixtures
+
+
+def main(number_of_households=50, replications=70, max_steps=120, number_processes=None):
+    use_fixtures(tempfile.mkdtemp(prefix='adaptation_benchmark_'))
+    from ensemble import run_ensemble
+    from experiments import iter_runs
+    parameters = {'number_of_households': number_of_households, 'flood_probability': 0.1}
+    number_processes = number_processes or os.cpu_count()
+
+    start = time.perf_counter()
+    run_ensemble(parameters, replications, max_steps)
+    ensemble_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for result in iter_runs(parameters, replications, max_steps, number_processes):
+        pass
+    runs_time = time.perf_counter() - start
+    print(f'households: {number_of_households}, replications: {replications}, steps: {max_steps + 1}')
+    print(f'ensemble:                      {ensemble_time:.3f} s ({replications / ensemble_time:.1f} replications/s)')
+    print(f'iter_runs ({number_processes} processes): {runs_time:.3f} s ({replications / runs_time:.1f} replications/s)')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:5]))
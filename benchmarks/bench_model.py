@@ -0,0 +1,198 @@
+"""
+Benchmark of the AdaptationModel: construction, a normal step, a step with a (forced) flood, the overhead of the data collector
+and the throughput of mesa.batch_run, for a range of population sizes and network types.
+Every case runs in its own process with fixed seeds, so the peak RSS is measured per case. By default the model runs on small
+synthetic inputs (see fixtures.py), so the benchmark runs offline.
+
+The results are written to a JSON file, and compared with a baseline if one is given: for every case and metric the
+ratio to the baseline is reported, and metrics that are more than the tolerance worse are marked as regressions.
+No baseline is kept in the repository, since the timings depend on the machine. Record one on the machine on which the
+benchmark is compared (e.g. on the main branch), with the same cases, and compare later runs with it.
+
+Usage:
+    python benchmarks/bench_model.py --households 100 1000 --networks watts_strogatz --output baseline.json
+    python benchmarks/bench_model.py --households 100 1000 --networks watts_strogatz --output results.json --baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import copy
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import numpy as np
+
+from fixtures import use_fixtures
+
+HOUSEHOLDS = [100, 1000, 10000, 100000]
+NETWORKS = ['erdos_renyi', 'barabasi_albert', 'watts_strogatz', 'no_network']
+# metrics for which a lower value is better, all other metrics are better when higher
+LOWER_IS_BETTER = ('init_time', 'step_time', 'step_time_min', 'flood_step_time', 'collect_time', 'collect_share', 'peak_rss')
+
+
+def get_peak_rss():
+    """Returns the peak resident set size of this process in bytes (ru_maxrss is in kilobytes on Linux, in bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_case(case):
+    """Run one benchmark case in this process. Returns a dictionary with the measured metrics."""
+    from model import AdaptationModel, options_list
+    number_of_households = case['number_of_households']
+    seed = case['seed']
+    parameters = {'number_of_households': number_of_households, 'network': case['network'],
+                  'network_backend': case['network_backend'], 'flood_probability': 0}
+
+    # construction of the model
+    start = time.perf_counter()
+    model = AdaptationModel(seed=seed, options_list=copy.deepcopy(options_list), **parameters)
+    init_time = time.perf_counter() - start
+
+    # normal steps, without floods
+    step_times = []
+    for i in range(case['steps']):
+        start = time.perf_counter()
+        model.step()
+        step_times.append(time.perf_counter() - start)
+
+    # the data collector is timed separately, to report its share of a step
+    collect_times = []
+    for i in range(case['collect_repeats']):
+        start = time.perf_counter()
+        model.datacollector.collect(model)
+        collect_times.append(time.perf_counter() - start)
+
+    # a step with a flood, forced by a flood probability of 1 (floods only occur from step 5)
+    model.flood_probability = 1
+    start = time.perf_counter()
+    model.step()
+    flood_step_time = time.perf_counter() - start
+
+    result = {'init_time': init_time,
+              'step_time': float(np.mean(step_times)),
+              'step_time_min': float(np.min(step_times)),
+              'flood_step_time': flood_step_time,
+              'collect_time': float(np.mean(collect_times)),
+              'collect_share': float(np.mean(collect_times) / np.mean(step_times))}
+
+    # throughput of mesa.batch_run, only for small populations
+    if case['batch_runs'] and number_of_households <= case['batch_max_households']:
+        from mesa import batch_run
+        start = time.perf_counter()
+        batch_run(AdaptationModel, parameters={**parameters, 'seed': seed, 'flood_probability': 0.05},
+                  iterations=case['batch_runs'], max_steps=case['batch_steps'], number_processes=1,
+                  data_collection_period=-1, display_progress=False)
+        result['runs_per_sec'] = case['batch_runs'] / (time.perf_counter() - start)
+
+    result['peak_rss'] = get_peak_rss()
+    return result
+
+
+def run_case_process(case, fixtures):
+    """Run a benchmark case in a new Python process, so its peak RSS is not affected by the other cases."""
+    command = [sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)]
+    if fixtures is not None:
+        command += ['--fixtures', fixtures]
+    output = subprocess.run(command, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"Benchmark case {case} failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline. Returns a list of (case, metric, value, baseline value, ratio, regression) for every
+    metric of every case that is in both. The ratio is value / baseline value; a regression is a metric that is more than
+    the tolerance worse than the baseline.
+    """
+    baseline_cases = {case_key(case): case for case in baseline['cases']}
+    comparison = []
+    for case in results['cases']:
+        base = baseline_cases.get(case_key(case))
+        if base is None:
+            continue
+        for metric, value in case['metrics'].items():
+            base_value = base['metrics'].get(metric)
+            if not base_value:
+                continue
+            ratio = value / base_value
+            if metric in LOWER_IS_BETTER:
+                regression = ratio > 1 + tolerance
+            else:
+                regression = ratio < 1 - tolerance
+            comparison.append((case_key(case), metric, value, base_value, ratio, regression))
+    return comparison
+
+
+def case_key(case):
+    return f"{case['network']}/{case['network_backend']}/{case['number_of_households']}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--households', type=int, nargs='+', default=HOUSEHOLDS)
+    parser.add_argument('--networks', nargs='+', default=NETWORKS)
+    parser.add_argument('--backend', default='networkx', help="network backend of the model, 'networkx' or 'csr'")
+    parser.add_argument('--steps', type=int, default=10, help='number of normal steps, at least 5 so that a flood can occur')
+    parser.add_argument('--collect-repeats', type=int, default=5)
+    parser.add_argument('--batch-runs', type=int, default=5, help='number of runs for the batch_run throughput, 0 to skip')
+    parser.add_argument('--batch-steps', type=int, default=20)
+    parser.add_argument('--batch-max-households', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--fixtures', default=None, help='directory for the synthetic inputs (default: a temporary directory)')
+    parser.add_argument('--real-inputs', action='store_true', help='use the input data of the repository instead of the fixtures')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help='JSON file with earlier results (--output of an earlier run on this machine) to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--case', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        # a single case, in a process started by run_case_process
+        if args.fixtures is not None:
+            use_fixtures(args.fixtures)
+        else:
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    if args.steps < 5:
+        parser.error('--steps has to be at least 5, since floods only occur from step 5')
+    fixtures = None
+    if not args.real_inputs:
+        fixtures = os.path.abspath(args.fixtures or tempfile.mkdtemp(prefix='adaptation_benchmark_'))
+
+    results = {'python': platform.python_version(), 'platform': platform.platform(), 'seed': args.seed,
+               'inputs': 'real' if args.real_inputs else 'synthetic', 'cases': []}
+    for network in args.networks:
+        for number_of_households in args.households:
+            case = {'number_of_households': number_of_households, 'network': network, 'network_backend': args.backend,
+                    'seed': args.seed, 'steps': args.steps, 'collect_repeats': args.collect_repeats,
+                    'batch_runs': args.batch_runs, 'batch_steps': args.batch_steps,
+                    'batch_max_households': args.batch_max_households}
+            metrics = run_case_process(case, fixtures)
+            results['cases'].append({**case, 'metrics': metrics})
+            print(f"{case_key(case):40s} init {metrics['init_time']:8.3f} s  step {metrics['step_time']:8.4f} s  "
+                  f"flood step {metrics['flood_step_time']:8.4f} s  collect {metrics['collect_share']:6.1%}  "
+                  f"runs/s {metrics.get('runs_per_sec', float('nan')):7.2f}  peak RSS {metrics['peak_rss'] / 2**20:8.1f} MiB")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f'results written to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare(results, baseline, args.tolerance)
+        for key, metric, value, base_value, ratio, regression in comparison:
+            print(f"{key:40s} {metric:16s} {value:12.4g} {base_value:12.4g} {ratio:6.2f}x{'  REGRESSION' if regression else ''}")
+        if any(regression for *_, regression in comparison):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Small synthetic input data for the benchmarks, so they run without the Houston shapefiles and flood maps.
+The model reads its inputs from paths relative to the working directory ('../input_data/...'), so the fixtures are written to
+<directory>/input_data and the benchmarks run with <directory>/model as working directory (see use_fixtures).
+"""
+import os
+import sys
+import numpy as np
+
+# size of the square synthetic model domain in meters, and the resolution of the synthetic flood maps
+DOMAIN_SIZE = 20000
+CELL_SIZE = 100
+FLOOD_MAPS = ('Harvey_depth_meters.tif', '100yr_storm_depth_meters.tif', '500yr_storm_depth_meters.tif')
+CRS = 'EPSG:26915'
+
+
+def make_fixtures(directory, seed=0):
+    """
+    Write a square model domain, a floodplain covering the western third of the domain and three flood maps in which the
+    depth decreases from west to east (with noise) to the given directory. Existing fixtures are not written again.
+    """
+    import geopandas as gpd
+    import rasterio as rs
+    from rasterio.transform import from_origin
+    from shapely.geometry import box, MultiPolygon
+
+    input_directory = os.path.join(directory, 'input_data')
+    paths = {'domain': os.path.join(input_directory, 'model_domain', 'houston_model', 'houston_model.shp'),
+             'floodplain': os.path.join(input_directory, 'floodplain', 'floodplain_area.shp')}
+    for path in paths.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.makedirs(os.path.join(input_directory, 'floodmaps'), exist_ok=True)
+    os.makedirs(os.path.join(directory, 'model'), exist_ok=True)
+
+    if not os.path.exists(paths['domain']):
+        gpd.GeoDataFrame(geometry=[box(0, 0, DOMAIN_SIZE, DOMAIN_SIZE)], crs=CRS).to_file(paths['domain'])
+    if not os.path.exists(paths['floodplain']):
+        floodplain = MultiPolygon([box(0, 0, DOMAIN_SIZE / 3, DOMAIN_SIZE)])
+        gpd.GeoDataFrame(geometry=[floodplain], crs=CRS).to_file(paths['floodplain'])
+
+    cells = DOMAIN_SIZE // CELL_SIZE
+    rng = np.random.default_rng(seed)
+    for i, name in enumerate(FLOOD_MAPS):
+        path = os.path.join(input_directory, 'floodmaps', name)
+        if os.path.exists(path):
+            continue
+        depth = np.linspace(3 + i, -1, cells)[np.newaxis, :] + rng.normal(0, 0.3, (cells, cells))
+        with rs.open(path, 'w', driver='GTiff', height=cells, width=cells, count=1, dtype='float32', crs=CRS,
+                     transform=from_origin(0, DOMAIN_SIZE, CELL_SIZE, CELL_SIZE)) as raster:
+            raster.write(depth.astype(np.float32), 1)
+    return directory
+
+
+def use_fixtures(directory):
+    """Write the fixtures (if needed) and make the model read them, by changing the working directory and the import path."""
+    make_fixtures(directory)
+    repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    if repository not in sys.path:
+        sys.path.insert(0, repository)
+    os.chdir(os.path.join(directory, 'model'))
@@ -0,0 +1,229 @@
+"""
+Memory footprint profiler of the AdaptationModel. It reports:
+- bytes per household: the Mesa agent object and its __dict__, the attribute values, the Shapely Point (Python object and the
+  GEOS geometry, which is not traced by tracemalloc and is measured from the RSS) and the list buffers (undergone_measures);
+- bytes per edge of the social network (graph and grid);
+- bytes per collected step of the data collector (model-level and agent-level data);
+- the share of the flood map raster in the RSS;
+- the allocation sites (file and line) of the memory that is allocated during construction and during the steps;
+and projects the memory of a model with a target number of households and steps from these numbers.
+By default the model runs on the synthetic inputs of fixtures.py.
+
+Usage:
+    python benchmarks/memory_profile.py --households 10000 --steps 20 --target-households 100000 --target-steps 120
+"""
+import os
+import sys
+import gc
+import json
+import copy
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+from fixtures import use_fixtures
+
+
+def get_rss():
+    """Returns the current resident set size of this process in bytes (the peak RSS if /proc is not available)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_traced():
+    return tracemalloc.get_traced_memory()[0]
+
+
+def get_native_point_size(number_of_points=100000):
+    """Estimate the memory of the GEOS geometry of a Shapely Point, which is allocated outside of the Python allocator."""
+    from shapely.geometry import Point
+    gc.collect()
+    rss, traced = get_rss(), get_traced()
+    points = [Point(i, i) for i in range(number_of_points)]
+    native = (get_rss() - rss) - (get_traced() - traced)
+    del points
+    return max(native, 0) / number_of_points
+
+
+def is_cached(value):
+    """Returns True for objects that are cached by the interpreter, and so do not take memory per household."""
+    return value is None or isinstance(value, bool) or (type(value) is int and -5 <= value <= 256)
+
+
+def get_household_sizes(households, sample=1000):
+    """
+    Returns the mean bytes per household of the agent object with its __dict__, the attribute values, the Shapely Point and
+    the list buffers, for a sample of the households. Objects that are shared by households (e.g. small integers, booleans
+    or the model) are not counted.
+    """
+    from shapely.geometry import Point
+    sample = households[:sample]
+    counts = {}
+    for household in sample:
+        for value in vars(household).values():
+            counts[id(value)] = counts.get(id(value), 0) + 1
+    sizes = {'agent': 0, 'attributes': 0, 'point': 0, 'lists': 0}
+    for household in sample:
+        sizes['agent'] += sys.getsizeof(household) + sys.getsizeof(household.__dict__)
+        for value in vars(household).values():
+            if counts[id(value)] > 1 or is_cached(value):
+                continue
+            if isinstance(value, Point):
+                sizes['point'] += sys.getsizeof(value)
+            elif isinstance(value, list):
+                sizes['lists'] += sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value if not is_cached(item))
+            else:
+                sizes['attributes'] += sys.getsizeof(value)
+    return {name: size / len(sample) for name, size in sizes.items()}
+
+
+def get_sites(snapshot, previous, group_by, top):
+    """Returns the allocation sites (file:line or file) with the largest increase of allocated memory between two snapshots."""
+    sites = []
+    for stat in snapshot.compare_to(previous, group_by)[:top]:
+        frame = stat.traceback[0]
+        site = f'{frame.filename}:{frame.lineno}' if group_by == 'lineno' else frame.filename
+        sites.append({'site': site, 'bytes': stat.size_diff, 'count': stat.count_diff})
+    return sites
+
+
+def profile_memory(parameters, steps, seed = 42, top = 15):
+    """Construct and run a model with tracemalloc, and return the memory report (see the module docstring)."""
+    from model import AdaptationModel, options_list
+    tracemalloc.start(1)
+    gc.collect()
+    rss_start = get_rss()
+    point_native = get_native_point_size()
+    before = tracemalloc.take_snapshot()
+
+    # construction
+    traced = get_traced()
+    model = AdaptationModel(seed=seed, options_list=copy.deepcopy(options_list), **parameters)
+    construction = get_traced() - traced
+    rss_constructed = get_rss()
+    constructed = tracemalloc.take_snapshot()
+    number_of_households = len(model.households)
+
+    # social network: a second copy is generated to measure the graph and the grid on their own
+    traced = get_traced()
+    G = model.initialize_network()
+    grid = type(model.grid)(G)
+    network = get_traced() - traced
+    number_of_edges = G.number_of_edges()
+    del G, grid
+
+    raster = model.band_flood_img.nbytes
+
+    # steps, of which the memory growth is mostly the collected data
+    traced = get_traced()
+    for i in range(steps):
+        model.step()
+    stepping = get_traced() - traced
+    stepped = tracemalloc.take_snapshot()
+
+    # data collector per collected step (model-level and agent-level data), from the memory allocated by mesa's datacollection.py
+    collected = sum(stat.size_diff for stat in stepped.compare_to(constructed, 'filename')
+                    if stat.traceback[0].filename.endswith('datacollection.py'))
+    collect = collected / max(steps, 1)
+    rss_end = get_rss()
+    tracemalloc.stop()
+
+    household_sizes = get_household_sizes(model.households)
+    household_sizes['point_native'] = point_native
+    households_traced = (construction - network - raster) / number_of_households
+    report = {
+        'parameters': parameters,
+        'number_of_households': number_of_households,
+        'number_of_edges': number_of_edges,
+        'steps': steps,
+        'bytes_per_household': households_traced + point_native,
+        'household_breakdown': household_sizes,
+        'bytes_per_edge': network / max(number_of_edges, 1),
+        'edges_per_household': number_of_edges / number_of_households,
+        'bytes_per_collected_step': collect,
+        'bytes_per_collected_household_step': collect / number_of_households,
+        'bytes_per_step_other': max(stepping - collected, 0) / max(steps, 1),
+        'raster_bytes': raster,
+        'raster_share_of_rss': raster / rss_end,
+        'rss_start': rss_start,
+        'rss_constructed': rss_constructed,
+        'rss_end': rss_end,
+        'construction_sites': get_sites(constructed, before, 'lineno', top),
+        'construction_files': get_sites(constructed, before, 'filename', top),
+        'step_sites': get_sites(stepped, constructed, 'lineno', top),
+    }
+    return report
+
+
+def project(report, number_of_households, steps):
+    """
+    Project the memory (in bytes) of a model with the given number of households, run for the given number of steps.
+    The households, edges and collected data scale linearly with the number of households, the raster and the interpreter
+    (the RSS at the start) are fixed.
+    """
+    households = number_of_households * report['bytes_per_household']
+    edges = number_of_households * report['edges_per_household'] * report['bytes_per_edge']
+    collected = steps * (number_of_households * report['bytes_per_collected_household_step'] + report['bytes_per_step_other'])
+    fixed = report['rss_start'] + report['raster_bytes']
+    return {'households': households, 'network': edges, 'collected_data': collected, 'fixed': fixed,
+            'total': households + edges + collected + fixed}
+
+
+def print_report(report, projection, target_households, target_steps):
+    MiB = 2**20
+    print(f"households: {report['number_of_households']}, edges: {report['number_of_edges']}, steps: {report['steps']}")
+    print(f"bytes per household:     {report['bytes_per_household']:10.0f}")
+    for name, size in report['household_breakdown'].items():
+        print(f"  {name:22s} {size:10.0f}")
+    print(f"bytes per edge:          {report['bytes_per_edge']:10.0f}")
+    print(f"bytes per collected step {report['bytes_per_collected_step']:10.0f} "
+          f"({report['bytes_per_collected_household_step']:.0f} per household)")
+    print(f"raster:                  {report['raster_bytes'] / MiB:10.1f} MiB ({report['raster_share_of_rss']:.1%} of the RSS)")
+    print(f"RSS start / constructed / end: {report['rss_start'] / MiB:.1f} / {report['rss_constructed'] / MiB:.1f} / "
+          f"{report['rss_end'] / MiB:.1f} MiB")
+    for title, key in (('construction by file', 'construction_files'), ('construction by line', 'construction_sites'),
+                       ('steps by line', 'step_sites')):
+        print(f'\n{title}:')
+        for site in report[key]:
+            print(f"  {site['bytes'] / MiB:10.2f} MiB {site['count']:10d}  {site['site']}")
+    print(f'\nprojection for {target_households} households and {target_steps} steps:')
+    for name, size in projection.items():
+        print(f'  {name:16s} {size / MiB:10.1f} MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--households', type=int, default=10000)
+    parser.add_argument('--network', default='watts_strogatz')
+    parser.add_argument('--backend', default='networkx')
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--top', type=int, default=15, help='number of allocation sites that are reported')
+    parser.add_argument('--target-households', type=int, default=100000)
+    parser.add_argument('--target-steps', type=int, default=120)
+    parser.add_argument('--fixtures', default=None, help='directory for the synthetic inputs (default: a temporary directory)')
+    parser.add_argument('--real-inputs', action='store_true', help='use the input data of the repository instead of the fixtures')
+    parser.add_argument('--output', default=None, help='JSON file to which the report is written')
+    args = parser.parse_args()
+
+    if args.real_inputs:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    else:
+        use_fixtures(os.path.abspath(args.fixtures or tempfile.mkdtemp(prefix='adaptation_memory_')))
+    parameters = {'number_of_households': args.households, 'network': args.network, 'network_backend': args.backend}
+    report = profile_memory(parameters, args.steps, seed=args.seed, top=args.top)
+    projection = project(report, args.target_households, args.target_steps)
+    print_report(report, projection, args.target_households, args.target_steps)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({**report, 'projection': {'number_of_households': args.target_households, 'steps': args.target_steps,
+                                                **projection}}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Functions that are used by AdaptationModel.save_checkpoint and AdaptationModel.load_checkpoint in model.py.
+A checkpoint is a single compressed .npz file: the attributes of the households and the social network are stored as arrays
+(one column per attribute), and the remaining (small) model state is pickled into a 'metadata' byte array.
+Static inputs like the flood maps and the model domain are not stored, but loaded again from their files.
+Only load checkpoints that you created yourself, since the metadata is unpickled.
+"""
+import pickle
+import numpy as np
+import networkx as nx
+from shapely.geometry import Point
+
+from network import CSRGraph, DynamicGraph
+
+SCALAR_TYPES = (bool, int, float, np.generic)
+
+
+def get_columns(objects, prefix, arrays, skip=()):
+    """
+    Store the attributes of a list of objects (e.g. households) as columns in the arrays dictionary.
+    Numbers are stored with their own type, so they are restored exactly (e.g. np.float32 values stay np.float32).
+
+    Returns
+    -------
+    columns: description of the stored columns, used by set_columns
+    """
+    columns = []
+    if not objects:
+        return columns
+    for name in vars(objects[0]):
+        if name in skip:
+            continue
+        values = [getattr(obj, name, None) for obj in objects]
+        key = f'{prefix}/{name}'
+        types = list(dict.fromkeys(type(value) for value in values))
+        if all(issubclass(value_type, SCALAR_TYPES) for value_type in types):
+            arrays[key] = np.array(values)
+            if len(types) > 1:
+                # mixed types (e.g. int and float), every value remembers its own type
+                codes = {value_type: code for code, value_type in enumerate(types)}
+                arrays[f'{key}/types'] = np.array([codes[type(value)] for value in values], dtype=np.int8)
+            columns.append((name, 'scalar', types))
+        elif types == [list] and len({len(value) for value in values}) == 1 and \
+                all(isinstance(item, SCALAR_TYPES) for value in values for item in value):
+            arrays[key] = np.array(values)
+            columns.append((name, 'list', None))
+        elif types == [Point]:
+            arrays[key] = np.array([(value.x, value.y) for value in values], dtype=float)
+            columns.append((name, 'point', None))
+        else:
+            # anything else is pickled with the metadata
+            columns.append((name, 'object', values))
+    return columns
+
+
+def set_columns(objects, prefix, arrays, columns):
+    """Restore the attributes of a list of objects from the columns that were stored by get_columns."""
+    for name, kind, info in columns:
+        key = f'{prefix}/{name}'
+        if kind == 'scalar':
+            if len(info) > 1:
+                values = [info[code](value) for code, value in zip(arrays[f'{key}/types'].tolist(), arrays[key].tolist())]
+            elif issubclass(info[0], np.generic):
+                values = list(arrays[key])
+            else:
+                values = arrays[key].tolist()
+        elif kind == 'list':
+            values = arrays[key].tolist()
+        elif kind == 'point':
+            values = [Point(x, y) for x, y in arrays[key].tolist()]
+        else:
+            values = info
+        for obj, value in zip(objects, values):
+            setattr(obj, name, value)
+
+
+def network_to_arrays(G, arrays):
+    """
+    Store a social network (networkx graph, CSRGraph or DynamicGraph) in the arrays dictionary.
+    The neighbours of every node are stored in the order in which the graph returns them, so the restored graph
+    gives the neighbours in the same order (which keeps the sums over neighbours bit-identical).
+
+    Returns
+    -------
+    kind: the type of the network, used by network_from_arrays
+    """
+    if isinstance(G, CSRGraph):
+        kind = 'csr'
+        arrays['network/indptr'], arrays['network/indices'] = G.indptr, G.indices
+        if G.weights is not None:
+            arrays['network/weights'] = G.weights
+        return kind
+    nodes = list(G.nodes())
+    rows = [list(G.neighbors(node)) for node in nodes]
+    arrays['network/nodes'] = np.array(nodes, dtype=np.int64)
+    arrays['network/indptr'] = np.concatenate([[0], np.cumsum([len(row) for row in rows])]).astype(np.int64)
+    arrays['network/indices'] = np.array([neighbor for row in rows for neighbor in row], dtype=np.int64)
+    if isinstance(G, DynamicGraph):
+        kind = 'dynamic'
+        if G.weights is not None:
+            arrays['network/weights'] = np.array([G.weights[min(u, v), max(u, v)] for u, row in zip(nodes, rows) for v in row])
+        # the tie slots are stored as they are, since neighbour sums are taken in slot order and cleared slots are reused
+        used = G.slots_used
+        arrays['network/slot_node'], arrays['network/slot_neighbor'] = G.slot_node[:used], G.slot_neighbor[:used]
+        arrays['network/slot_weight'], arrays['network/slot_active'] = G.slot_weight[:used], G.slot_active[:used]
+        arrays['network/free_slots'] = np.array(G.free_slots, dtype=np.int64)
+        arrays['network/weighted_degree'] = G.weighted_degree # updated with every change, so not recomputed
+    else:
+        kind = 'networkx'
+        weights = [G.edges[u, v].get('weight') for u, row in zip(nodes, rows) for v in row]
+        if weights and all(weight is not None for weight in weights):
+            arrays['network/weights'] = np.array(weights, dtype=float)
+    return kind
+
+
+def network_from_arrays(arrays, kind):
+    """Restore a social network that was stored by network_to_arrays."""
+    indptr = arrays['network/indptr']
+    indices = arrays['network/indices']
+    weights = arrays.get('network/weights')
+    if kind == 'csr':
+        return CSRGraph(len(indptr) - 1, indptr, indices, weights)
+    nodes = arrays['network/nodes'].tolist()
+    rows = [indices[indptr[i]:indptr[i + 1]].tolist() for i in range(len(nodes))]
+    row_weights = None if weights is None else [weights[indptr[i]:indptr[i + 1]].tolist() for i in range(len(nodes))]
+    if kind == 'dynamic':
+        G = DynamicGraph(len(nodes), weights=weights is not None)
+        for node, row in zip(nodes, rows):
+            G.adjacency[node].update(row)
+        G.edge_count = len(indices) // 2
+        if weights is not None:
+            for node, row, row_weight in zip(nodes, rows, row_weights):
+                for neighbor, weight in zip(row, row_weight):
+                    G.weights[min(node, neighbor), max(node, neighbor)] = weight
+        if 'network/slot_node' not in arrays:
+            # a checkpoint from before the tie slots were stored
+            G.set_slots(np.repeat(nodes, np.diff(indptr)), indices, weights)
+            return G
+        G.set_slots(arrays['network/slot_node'], arrays['network/slot_neighbor'], arrays['network/slot_weight'],
+                    arrays['network/slot_active'], arrays['network/free_slots'].tolist())
+        G.weighted_degree = arrays['network/weighted_degree'].copy()
+        return G
+    G = nx.Graph()
+    G.add_nodes_from(nodes)
+    # the adjacency is filled directly, so the neighbours of every node keep their order; both directions share one data dict
+    adjacency = G._adj
+    for i, (node, row) in enumerate(zip(nodes, rows)):
+        for j, neighbor in enumerate(row):
+            data = adjacency[neighbor].get(node)
+            if data is None:
+                data = {} if row_weights is None else {'weight': row_weights[i][j]}
+            adjacency[node][neighbor] = data
+    return G
+
+
+def write_checkpoint(path, arrays, metadata):
+    """Write the arrays and the pickled metadata to a compressed .npz file."""
+    arrays = dict(arrays)
+    arrays['metadata'] = np.frombuffer(pickle.dumps(metadata, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+def read_checkpoint(path):
+    """Read a checkpoint file. Returns the arrays and the unpickled metadata."""
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    metadata = pickle.loads(arrays.pop('metadata').tobytes())
+    return arrays, metadata
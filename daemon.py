@@ -0,0 +1,216 @@
+"""
+A long-lived local simulation server, so that notebooks and scripts do not pay the import and loading time of the model
+(the model domain and floodplain of functions.py, the flood maps and the imports of geopandas, rasterio, mesa and networkx)
+for every run. The server loads all inputs once, keeps generated social networks in a NetworkCache, and answers run and
+sweep requests over HTTP on localhost. The KPIs are streamed back as newline-delimited JSON while the model runs.
+
+Requests (POST, with a JSON body):
+    /run    {"parameters": {...}, "max_steps": 120, "seed": 42}
+            streams a line {"step": ..., <KPI>: ...} per step, followed by {"done": true, "duration": ...}
+    /sweep  {"parameters": {... lists of values are varied ...}, "iterations": 10, "max_steps": 120, "seed": 0,
+             "number_processes": null}
+            streams a line per completed run {"RunId": ..., "iteration": ..., "seed": ..., "parameters": {...},
+            "kpis": {<KPI>: [...]}}, followed by {"done": true, "duration": ...}
+    /status (GET) returns the loaded flood maps, the number of requests and the uptime
+Errors are returned as {"error": ...}, in the stream if they occur after the first line.
+In the parameters, options_list is a list of instrument names (of model.options_list) or of instrument descriptions (see
+OrganizationInstrument.to_dict).
+
+Usage (in the model directory):
+    python daemon.py --port 8765
+and in a notebook:
+    for line in request_run({'number_of_households': 500, 'flood_probability': 0.1}, max_steps=120):
+        print(line['step'], line['total_adapted_households'])
+"""
+import copy
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import multiprocessing as mp
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from model import AdaptationModel, options_list, flood_map_paths, flood_map_cache, load_flood_map
+from rbb import OrganizationInstrument
+from experiments import iter_runs
+
+DEFAULT_PORT = 8765
+
+
+def get_instruments(description):
+    """Returns the organisation instruments of a JSON description of options_list: instrument names or descriptions."""
+    instruments = {instrument.name: instrument for instrument in options_list}
+    result = []
+    for instrument in description:
+        if isinstance(instrument, str):
+            if instrument not in instruments:
+                raise ValueError(f"Unknown instrument: '{instrument}'. The instruments are: {list(instruments)}")
+            result.append(copy.deepcopy(instruments[instrument]))
+        else:
+            result.append(OrganizationInstrument.from_dict(instrument))
+    return result
+
+
+def get_parameters(parameters, network_cache = None):
+    """Returns the parameters of the AdaptationModel of a JSON request, with the instruments of options_list created."""
+    parameters = dict(parameters)
+    if parameters.get('options_list') is not None:
+        if parameters['options_list'] and isinstance(parameters['options_list'][0], list):
+            # a list of lists of instruments is varied in a sweep
+            parameters['options_list'] = [get_instruments(instruments) for instruments in parameters['options_list']]
+        else:
+            parameters['options_list'] = get_instruments(parameters['options_list'])
+    if network_cache is not None:
+        parameters.setdefault('network_cache', network_cache)
+    return parameters
+
+
+def to_json(value):
+    """Convert NumPy scalars and other values that are not JSON serializable."""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class SimulationServer(ThreadingHTTPServer):
+    """
+    HTTP server that answers run and sweep requests, see the module docstring. Runs are executed in a thread of the server
+    process (every model has its own random generator, so runs can be executed at the same time). Sweeps run on a pool of
+    worker processes that are started by a fork server (or spawned), since forking the server process, in which other
+    threads may hold locks while they run a model, could deadlock the workers. The fork server process imports the model
+    once, and the workers load the flood maps of the sweep themselves.
+    """
+    daemon_threads = True
+
+    def __init__(self, address = ('127.0.0.1', DEFAULT_PORT), network_cache = None):
+        super().__init__(address, SimulationHandler)
+        self.network_cache = network_cache
+        self.started = time.time()
+        self.requests = 0
+        self.lock = threading.Lock()
+        if 'forkserver' in mp.get_all_start_methods():
+            self.context = mp.get_context('forkserver')
+            self.context.set_forkserver_preload(['experiments'])
+        else:
+            self.context = mp.get_context('spawn')
+        for choice in flood_map_paths:
+            load_flood_map(choice)
+
+    def run(self, request, write):
+        """Run the model and write the KPIs of every step."""
+        parameters = get_parameters(request.get('parameters', {}), self.network_cache)
+        seed = request.get('seed')
+        max_steps = request.get('max_steps', 120)
+        start = time.perf_counter()
+        model = AdaptationModel(seed=seed, **parameters)
+        while model.running and model.schedule.steps <= max_steps:
+            model.step()
+            kpis = {name: values[-1] for name, values in model.datacollector.model_vars.items()}
+            write({'step': model.schedule.steps - 1, **kpis})
+        write({'done': True, 'duration': time.perf_counter() - start})
+
+    def sweep(self, request, write):
+        """Run a sweep on a pool of worker processes, and write the KPIs of every run as soon as it is completed."""
+        parameters = get_parameters(request.get('parameters', {}), self.network_cache)
+        start = time.perf_counter()
+        for result in iter_runs(parameters, request.get('iterations', 1), request.get('max_steps', 120),
+                                request.get('number_processes'), seed=request.get('seed', 0), context=self.context):
+            kpis = {name: values.tolist() for name, values in result['model'].items()}
+            write({'RunId': result['RunId'], 'iteration': result['iteration'], 'seed': result['seed'],
+                   'parameters': request['parameters'], 'kpis': kpis})
+        write({'done': True, 'duration': time.perf_counter() - start})
+
+    def status(self):
+        with self.lock:
+            requests = self.requests
+        return {'flood_maps': sorted(flood_map_cache), 'requests': requests, 'uptime': time.time() - self.started}
+
+
+class SimulationHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/status':
+            return self.send_json({'error': f'Unknown path: {self.path}'}, 404)
+        self.send_json(self.server.status())
+
+    def do_POST(self):
+        methods = {'/run': self.server.run, '/sweep': self.server.sweep}
+        if self.path not in methods:
+            return self.send_json({'error': f'Unknown path: {self.path}'}, 404)
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError as e:
+            return self.send_json({'error': f'Invalid JSON: {e}'}, 400)
+        with self.server.lock:
+            self.server.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        # the response has no length: the lines are sent as they are produced, and the connection is closed at the end
+        try:
+            methods[self.path](request, self.write_line)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # the client disconnected
+        except Exception as e:
+            self.write_line({'error': f'{type(e).__name__}: {e}'})
+
+    def write_line(self, data):
+        self.wfile.write(json.dumps(data, default=to_json).encode() + b'\n')
+        self.wfile.flush()
+
+    def send_json(self, data, code = 200):
+        body = json.dumps(data, default=to_json).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def request(path, data, address = ('127.0.0.1', DEFAULT_PORT)):
+    """Send a request to a running server, and yield the lines of the response as dictionaries."""
+    http_request = urllib.request.Request(f'http://{address[0]}:{address[1]}{path}', data=json.dumps(data).encode(),
+                                          headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(http_request) as response:
+        for line in response:
+            line = json.loads(line)
+            if 'error' in line:
+                raise RuntimeError(f"The simulation server returned an error: {line['error']}")
+            yield line
+
+
+def request_run(parameters, max_steps = 120, seed = None, address = ('127.0.0.1', DEFAULT_PORT)):
+    """Run the model on a running server, and yield the KPIs of every step (see the module docstring)."""
+    for line in request('/run', {'parameters': parameters, 'max_steps': max_steps, 'seed': seed}, address):
+        if 'done' not in line:
+            yield line
+
+
+def request_sweep(parameters, iterations = 1, max_steps = 120, seed = 0, number_processes = None,
+                  address = ('127.0.0.1', DEFAULT_PORT)):
+    """Run a sweep on a running server, and yield the KPIs of every run as soon as it is completed."""
+    for line in request('/sweep', {'parameters': parameters, 'iterations': iterations, 'max_steps': max_steps, 'seed': seed,
+                                   'number_processes': number_processes}, address):
+        if 'done' not in line:
+            yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local simulation server of the AdaptationModel (see daemon.py).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--network-cache', default=None, help='directory of a cache of the generated social networks')
+    args = parser.parse_args()
+    server = SimulationServer((args.host, args.port), args.network_cache)
+    print(f'serving on http://{args.host}:{server.server_address[1]}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Ensemble runs: many replications of the AdaptationModel with the same parameters, simulated as one vectorized simulation.
+The analyses run 70 replications of a configuration. With small populations, the time of a run is mostly Python overhead per
+household and per step, which process-level parallelism (experiments.iter_runs) divides over the cores but does not reduce.
+An Ensemble keeps the household state of all R replications in arrays of shape (R, N) (see vectorized.py), and steps all
+households of all replications at once: the flood damage, the measure transitions, the AM updates and the neighbour influence
+(over a block-diagonal social network) are computed with array operations over the replication axis. Only the model-level
+parts (the flood draw, the government and the organisation instruments) are done per replication.
+
+Every replication has its own NumPy random stream, seeded with the seed of the replication, and all random values for the
+households of a replication are drawn from that stream. So the results of a replication only depend on its own seed, and not
+on the number of replications or on the other replications in the ensemble. Like PartitionedRun (see parallel.py), the
+households are activated simultaneously, so the results differ from the (random activation) runs of the AdaptationModel.
+
+Usage:
+    kpis = run_ensemble({'number_of_households': 50, 'flood_probability': 0.1}, replications=70, max_steps=120)
+    kpis['total_adapted_households'] # array of shape (70, 121)
+"""
+import copy
+import heapq
+import numpy as np
+import pandas as pd
+
+from agents import Households
+from model import AdaptationModel
+from experiments import get_run_seed
+from vectorized import get_household_parameters, export_household_state, import_household_state, flood_households, step_households
+
+# model-level metrics of the data collector of the AdaptationModel
+KPIS = ['total_adapted_households', 'total_decisions_to_adapt', 'Infrastructure', 'Average flood damage',
+        'Average public concern', 'Average Adaptation Motivation', 'Average External Influence', 'Flood']
+
+
+class ReplicationDraws():
+    """Draws the random values for households of several replications, a block per replication from the stream of that replication."""
+    def __init__(self, generators, counts):
+        self.generators = generators
+        self.counts = counts # number of households per replication, the households are ordered by replication
+
+    def draw(self, method, size, *args):
+        size = (size,) if np.isscalar(size) else tuple(size)
+        blocks = [getattr(generator, method)(*args, size=(count,) + size[1:])
+                  for generator, count in zip(self.generators, self.counts) if count]
+        return np.concatenate(blocks) if blocks else np.zeros(size)
+
+    def random(self, size):
+        return self.draw('random', size)
+
+    def uniform(self, low, high, size):
+        return self.draw('uniform', size, low, high)
+
+    def integers(self, low, high, size):
+        return self.draw('integers', size, low, high)
+
+
+class EnsembleGenerator():
+    """
+    Random generator of an ensemble, with a NumPy random generator per replication. It is passed as rng to the functions of
+    vectorized.py, which draw the values for the households at the indices idx from at(idx).
+    """
+    def __init__(self, generators, number_of_households):
+        self.generators = generators
+        self.number_of_households = number_of_households
+
+    def random(self):
+        """Returns a random number in [0, 1) per replication."""
+        return np.array([generator.random() for generator in self.generators])
+
+    def at(self, idx):
+        """Returns a generator for values for the households at the given indices in the flattened (R * N) state, in increasing order."""
+        counts = np.bincount(idx // self.number_of_households, minlength=len(self.generators))
+        return ReplicationDraws(self.generators, counts)
+
+
+class Ensemble():
+    """
+    Replications of the AdaptationModel that are stepped as one vectorized simulation, see the module docstring.
+    Every replication is set up as an AdaptationModel with its own seed (its households, social network, government and
+    instruments), after which the household state of all replications is stacked into arrays of shape (R, N).
+    Only social networks that do not change during the run are supported.
+
+    Parameters
+    ----------
+    parameters: parameters of the AdaptationModel, the same for all replications
+    replications: number of replications
+    seed: seed of the ensemble. Like iteration r of an experiment (see experiments.make_tasks), replication r has the seed
+          experiments.get_run_seed(seed, 0, r)
+    seeds: seeds of the replications, used instead of replications and seed if given
+    """
+    def __init__(self, parameters = None, replications = 70, seed = 0, seeds = None):
+        parameters = parameters or {}
+        if parameters.get('network_dynamics') is not None:
+            raise ValueError("An ensemble does not support a dynamic social network")
+        if seeds is None:
+            seeds = [get_run_seed(seed, 0, replication) for replication in range(replications)]
+        self.seeds = list(seeds)
+        self.models = [AdaptationModel(seed=replication_seed, **copy.deepcopy(parameters)) for replication_seed in self.seeds]
+        self.replications = len(self.models)
+        self.number_of_households = n = len(self.models[0].households)
+        if any(len(model.households) != n for model in self.models):
+            raise ValueError("All replications of an ensemble must have the same number of households")
+        self.parameters = get_household_parameters(self.models[0])
+        self.rng = EnsembleGenerator([np.random.default_rng(replication_seed) for replication_seed in self.seeds], n)
+
+        # household state of all replications in arrays of shape (R, N), and flat views of shape (R * N) for vectorized.py
+        states = [export_household_state(model) for model in self.models]
+        self.state = {name: np.stack([state[name] for state in states]) for name in states[0]}
+        self.flat_state = {name: array.reshape((self.replications * n,) + array.shape[2:]) for name, array in self.state.items()}
+        # the completion of household measures is kept in the state, only the instruments remain in the event calendars
+        for model in self.models:
+            calendar = model.schedule.calendar
+            calendar.queue = [event for event in calendar.queue if not isinstance(event[2], Households)]
+            heapq.heapify(calendar.queue)
+
+        # social networks of the replications as one block-diagonal network in CSR format
+        indptr, indices, weights = [np.zeros(1, dtype=np.int64)], [], []
+        for replication, model in enumerate(self.models):
+            schedule = model.schedule
+            schedule.build_neighbor_index()
+            indptr.append(schedule.neighbor_indptr[1:] + indptr[-1][-1])
+            indices.append(schedule.neighbor_indices + replication * n)
+            weights.append(schedule.neighbor_weights)
+        self.network = (np.concatenate(indptr), np.concatenate(indices).astype(np.int64), np.concatenate(weights))
+        self.idx = np.arange(self.replications * n)
+
+    def get_model_metrics(self):
+        """Returns the model-level metrics of the current step, like the data collector of the model, as an array per metric."""
+        state = self.state
+        models = self.models
+        return {"total_adapted_households": state['is_adapted_cumulatief'].sum(axis=1),
+                "total_decisions_to_adapt": state['is_adapted'].sum(axis=1),
+                "Infrastructure": np.array([model.infrastructure for model in models]),
+                "Average flood damage": np.array([model.avg_flood_damage for model in models], dtype=float),
+                "Average public concern": np.array([model.avg_public_concern for model in models], dtype=float),
+                "Average Adaptation Motivation": state['AM'].mean(axis=1),
+                "Average External Influence": state['threat_appraisal'].mean(axis=1),
+                "Flood": np.array([model.flood for model in models])}
+
+    def step(self):
+        """Advance all replications by one step, following AdaptationModel.step. Returns the metrics of the step."""
+        state = self.state
+        models = self.models
+        n = self.number_of_households
+        step = models[0].schedule.steps
+        flood_draws = self.rng.random()
+        for replication, model in enumerate(models):
+            model.flood = False
+            if model.infrastructure and model.protected_mask is None:
+                model.get_protected_pop()
+                state['is_protected'][replication, model.protected_mask] = True
+            if step >= 5 and flood_draws[replication] <= model.flood_probability:
+                model.flood = True
+                model.last_flood = step
+
+        flood = np.array([model.flood for model in models])
+        if flood.any():
+            affected = state['in_floodplain'] & ~state['is_protected'] & flood[:, np.newaxis]
+            flood_households(self.flat_state, self.idx[np.repeat(flood, n)], self.parameters, self.rng)
+            total_damage = np.where(affected, state['flood_damage_actual'], 0).sum(axis=1)
+            number_flooded = affected.sum(axis=1)
+            for replication in np.flatnonzero(flood):
+                model = models[replication]
+                model.avg_flood_damage = total_damage[replication] / len(model.floodplain_idx) if number_flooded[replication] else 0
+
+        public_concern = state['threat_appraisal'].mean(axis=1)
+        for replication, model in enumerate(models):
+            model.avg_public_concern = float(public_concern[replication])
+            model.flood_recency = 1 - ((step - model.last_flood) / 20)
+        metrics = self.get_model_metrics()
+
+        # the households read the AM of their neighbours from the previous step
+        previous_AM = self.flat_state['AM'].copy()
+        for model in models:
+            model.schedule.calendar.process(step)
+        flood_recency = np.array([model.flood_recency for model in models])
+        last_flood = np.array([model.last_flood for model in models])
+        step_households(self.flat_state, self.idx, self.parameters, step, previous_AM, self.network, np.repeat(flood, n),
+                        np.repeat(flood_recency, n), np.repeat(last_flood, n), self.rng)
+        for model in models:
+            model.government.step()
+            model.schedule.steps += 1
+            model.schedule.time += 1
+        return metrics
+
+    def run(self, steps):
+        """Run all replications for a number of steps. Returns the KPIs (see KPIS) as arrays of shape (replications, steps)."""
+        metrics = [self.step() for i in range(steps)]
+        return {name: np.stack([step_metrics[name] for step_metrics in metrics], axis=1) for name in KPIS}
+
+    def update_models(self):
+        """Copy the household state of every replication back into the Households agents of its model."""
+        for replication, model in enumerate(self.models):
+            import_household_state(model, {name: array[replication] for name, array in self.state.items()})
+
+
+def run_ensemble(parameters = None, replications = 70, max_steps = 120, seed = 0, seeds = None):
+    """
+    Run an ensemble of replications until step max_steps, like experiments.run_task.
+
+    Returns
+    -------
+    kpis: dictionary with the KPIs (see KPIS) as arrays of shape (replications, max_steps + 1)
+    """
+    return Ensemble(parameters, replications, seed, seeds).run(max_steps + 1)
+
+
+def to_dataframe(kpis):
+    """Returns the KPIs of an ensemble as a DataFrame with a row per replication (iteration) and step."""
+    replications, steps = next(iter(kpis.values())).shape
+    index = pd.MultiIndex.from_product([range(replications), range(steps)], names=['iteration', 'Step'])
+    return pd.DataFrame({name: values.ravel() for name, values in kpis.items()}, index=index)
@@ -0,0 +1,256 @@
+"""
+Parallel experiment runner for the AdaptationModel, as a replacement of mesa.batch_run for large experiments.
+The runs are executed on a pool of worker processes. The model domain and the floodplain (read when functions.py is imported)
+and the flood maps (see model.load_flood_map) are loaded once in the parent process, and inherited by the forked workers.
+Every run gets its own seed, which only depends on the seed of the experiment, the parameter set and the iteration, so the
+results do not depend on the number of processes or the order in which the runs are executed.
+The results of every run are yielded (iter_runs) or written to disk (run_experiment) as soon as the run is completed.
+
+Usage:
+    run_experiment({'number_of_households': 100, 'flood_probability': [0.05, 0.1]}, iterations=70, max_steps=120,
+                   output='results.csv')
+    for result in iter_runs({'number_of_households': 100}, iterations=70, max_steps=120):
+        print(result['RunId'], result['model']['total_adapted_households'].iloc[-1])
+"""
+import os
+import copy
+import json
+import hashlib
+import inspect
+import time
+import queue
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+from mesa.batchrunner import _make_model_kwargs
+
+from model import AdaptationModel, load_flood_map
+
+
+def describe_parameters(kwargs):
+    """
+    Returns a serializable (JSON) description of all parameters of a run: the given parameters, completed with the defaults of
+    the AdaptationModel. The organisation instruments of options_list are described with OrganizationInstrument.to_dict.
+    """
+    description = {name: parameter.default for name, parameter in inspect.signature(AdaptationModel.__init__).parameters.items()
+                   if name not in ('self', 'seed')}
+    description.update(kwargs)
+    for name, value in description.items():
+        if name == 'options_list' and value is not None:
+            description[name] = [instrument.to_dict() for instrument in value]
+        elif not isinstance(value, (str, int, float, bool, type(None))):
+            description[name] = str(getattr(value, 'directory', value))
+    return description
+
+
+def get_parameter_set_id(description):
+    """Returns the id of a parameter set: a hash of its description (see describe_parameters)."""
+    return 'p' + hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_run_seed(seed, parameter_set, iteration):
+    """Returns the seed of a run, derived from the seed of the experiment, the index of the parameter set and the iteration."""
+    return int(np.random.SeedSequence([seed, parameter_set, iteration]).generate_state(1)[0])
+
+
+def make_tasks(parameters, iterations, seed = 0):
+    """
+    Returns the runs of an experiment as (run id, iteration, seed, parameters) tuples. Like mesa.batch_run, every parameter
+    with a list of values is varied, and every combination is run for the given number of iterations.
+    If 'seed' is one of the parameters, that seed is used for the run instead of a derived seed.
+    """
+    tasks = []
+    for parameter_set, kwargs in enumerate(_make_model_kwargs(parameters)):
+        fixed_seed = kwargs.pop('seed', None)
+        for iteration in range(iterations):
+            run_seed = fixed_seed if fixed_seed is not None else get_run_seed(seed, parameter_set, iteration)
+            tasks.append((len(tasks), iteration, run_seed, kwargs))
+    return tasks
+
+
+def preload_inputs(parameters):
+    """Load the flood maps that are used in an experiment, so that the workers inherit them instead of reading them again."""
+    for kwargs in _make_model_kwargs(parameters):
+        load_flood_map(kwargs.get('flood_map_choice', 'harvey'))
+
+
+def run_task(task, max_steps, agent_data = False):
+    """
+    Run a single run of an experiment, with the seed of the run as the seed of the model. Like mesa.batch_run, the model is run
+    until step max_steps.
+
+    Returns
+    -------
+    result: dictionary with the run ('RunId', 'iteration', 'seed' and 'parameters'), a DataFrame with the model-level data of
+            every step ('model'), if agent_data is True, a DataFrame with the agent-level data of every step ('agents'), and
+            the time of the run in seconds ('duration')
+    """
+    run_id, iteration, seed, kwargs = task
+    start = time.perf_counter()
+    model = AdaptationModel(seed=seed, **copy.deepcopy(kwargs))
+    while model.running and model.schedule.steps <= max_steps:
+        model.step()
+    model_data = model.datacollector.get_model_vars_dataframe()
+    model_data.index.name = 'Step'
+    result = {'RunId': run_id, 'iteration': iteration, 'seed': seed, 'parameters': kwargs, 'model': model_data, 'agents': None}
+    if agent_data:
+        result['agents'] = model.datacollector.get_agent_vars_dataframe()
+    result['duration'] = time.perf_counter() - start
+    return result
+
+
+def get_rows(run_id, iteration, seed, kwargs, data):
+    """Returns the data of a run as a DataFrame in the layout of mesa.batch_run (RunId, iteration, Step, parameters, data)."""
+    data = data.reset_index()
+    columns = {'RunId': run_id, 'iteration': iteration, 'seed': seed}
+    columns.update({name: [value] * len(data) if isinstance(value, (list, tuple)) else value for name, value in kwargs.items()})
+    return pd.concat([pd.DataFrame(columns, index=data.index), data], axis=1)
+
+
+def iter_runs(parameters, iterations = 1, max_steps = 120, number_processes = None, chunksize = 1, seed = 0,
+              agent_data = False, ordered = False, max_pending = None, cache = None, cost_model = None, context = None):
+    """
+    Run an experiment on a pool of worker processes, and yield the result of every run (see run_task) as soon as it is completed.
+    At most max_pending runs (by default twice the number of processes) are submitted or waiting to be consumed at any time,
+    so the results of the whole experiment are never held in memory at once. If ordered, the completed runs that wait for a
+    run with a lower id count as well; when they fill the bound, only the chunk with the next run id is submitted.
+
+    Parameters
+    ----------
+    parameters: parameters of the AdaptationModel, a list of values is varied (like mesa.batch_run)
+    iterations: number of runs per parameter set
+    max_steps: the model is run until this step
+    number_processes: number of worker processes, defaults to the number of cores
+    chunksize: number of runs that is sent to a worker at once
+    seed: seed of the experiment, from which the seed of every run is derived
+    agent_data: if True, the results also contain the agent-level data
+    ordered: if True, the results are yielded in the order of the run ids instead of in the order of completion
+    cache: RunCache (see run_cache.py) or its directory. Runs that are in the cache are loaded instead of run, and the
+           results of the other runs are added to the cache
+    cost_model: CostModel (see scheduling.py). If given, the runs are started in order of decreasing estimated time, in
+                chunks of at most chunksize runs that are combined by their estimated time, and the measured times are
+                added to the history of the cost model
+    context: multiprocessing context of the pool of worker processes, by default the fork context where available, so the
+             workers inherit the loaded inputs. Processes with threads that may hold locks (e.g. the simulation server,
+             see daemon.py) pass a forkserver or spawn context, in which the workers load the inputs themselves
+    """
+    tasks = make_tasks(parameters, iterations, seed)
+    cached = {} # runs that are in the cache, by run id
+    if cache is not None:
+        if isinstance(cache, str):
+            from run_cache import RunCache
+            cache = RunCache(cache)
+        keys = {task[0]: cache.key(task[3], task[2], max_steps) for task in tasks}
+        cached = {task[0]: task for task in tasks if cache.contains(keys[task[0]], agent_data)}
+        tasks = [task for task in tasks if task[0] not in cached]
+        if not ordered:
+            for task in cached.values():
+                yield load_cached(cache, keys[task[0]], task, agent_data)
+    preload_inputs(parameters)
+    number_processes = number_processes or os.cpu_count()
+    max_pending = max(max_pending or 2 * number_processes, chunksize)
+    if cost_model is not None:
+        chunks = cost_model.make_chunks(tasks, max_steps, number_processes, chunksize)
+    else:
+        chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+    completed = queue.Queue()
+    context = context or mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+    with context.Pool(number_processes) as pool:
+        pending = 0
+        waiting = {} # completed runs that wait for a run with a lower id, if ordered
+        next_run = 0
+        while True:
+            # submit chunks until the maximum number of pending and waiting runs is reached
+            while chunks:
+                if pending + len(waiting) < max_pending:
+                    chunk = chunks.pop(0)
+                elif pending == 0:
+                    # all waiting runs wait for the next run id, which has not been submitted yet
+                    chunk = chunks.pop(next(i for i, chunk in enumerate(chunks) if any(task[0] == next_run for task in chunk)))
+                else:
+                    break
+                pool.apply_async(run_chunk, (chunk, max_steps, agent_data), callback=completed.put, error_callback=completed.put)
+                pending += len(chunk)
+            if pending == 0:
+                break
+            # wait for a chunk to complete before more chunks are submitted
+            results = completed.get()
+            if isinstance(results, BaseException):
+                raise results
+            pending -= len(results)
+            for result in results:
+                if cache is not None:
+                    cache.save(keys[result['RunId']], result)
+                if cost_model is not None:
+                    cost_model.record(result['parameters'], max_steps, result['duration'])
+                if not ordered:
+                    yield result
+                    continue
+                waiting[result['RunId']] = result
+                while next_run in waiting or next_run in cached:
+                    if next_run in waiting:
+                        yield waiting.pop(next_run)
+                    else:
+                        yield load_cached(cache, keys[next_run], cached.pop(next_run), agent_data)
+                    next_run += 1
+    if cost_model is not None:
+        cost_model.save()
+    # the cached runs after the last run that was run, if ordered
+    for run_id in sorted(cached) if ordered else []:
+        yield load_cached(cache, keys[run_id], cached[run_id], agent_data)
+
+
+def load_cached(cache, key, task, agent_data):
+    """Returns the result of a run (see run_task) from the cache."""
+    run_id, iteration, seed, kwargs = task
+    data = cache.load(key, agent_data)
+    if data is None:
+        raise RuntimeError(f"Run {run_id} was removed from the cache while the experiment was running")
+    return {'RunId': run_id, 'iteration': iteration, 'seed': seed, 'parameters': kwargs, **data}
+
+
+def run_chunk(tasks, max_steps, agent_data):
+    """Run a chunk of runs in a worker process."""
+    return [run_task(task, max_steps, agent_data) for task in tasks]
+
+
+def run_experiment(parameters, iterations = 1, max_steps = 120, number_processes = None, output = None, chunksize = 1, seed = 0,
+                   agent_output = None, store = None, experiment = 'default', agent_data = False, cache = None, cost_model = None,
+                   overwrite = False):
+    """
+    Run an experiment on a pool of worker processes, and write the results of every run to disk as soon as it is completed.
+
+    Parameters
+    ----------
+    parameters, iterations, max_steps, number_processes, chunksize, seed: see iter_runs
+    output: CSV file to which the model-level data of every run is appended
+    agent_output: CSV file to which the agent-level data of every run is appended, None to not collect agent-level data
+    store: ResultsStore (see results_store.py) to which the results of every run are written, as the given experiment
+    experiment: name of the experiment in the store
+    agent_data: if True, the agent-level data is also written to the store
+    cache: RunCache or its directory, see iter_runs
+    cost_model: CostModel, see iter_runs
+    overwrite: if True, existing output and agent_output files are replaced, otherwise an existing file raises a FileExistsError
+
+    Returns
+    -------
+    runs: DataFrame with the run id, iteration, seed and parameters of every run, in the order of the run ids
+    """
+    for path in (output, agent_output):
+        if path is not None and os.path.exists(path):
+            if not overwrite:
+                raise FileExistsError(f"The output file '{path}' already exists, pass overwrite=True to replace it")
+            os.remove(path)
+    runs = []
+    agent_data = agent_output is not None or (store is not None and agent_data)
+    for result in iter_runs(parameters, iterations, max_steps, number_processes, chunksize, seed, agent_data=agent_data,
+                            cache=cache, cost_model=cost_model):
+        run = (result['RunId'], result['iteration'], result['seed'], result['parameters'])
+        if store is not None:
+            store.write_run(experiment, result)
+        if output is not None:
+            get_rows(*run, result['model']).to_csv(output, mode='a', index=False, header=not os.path.exists(output))
+        if agent_output is not None:
+            get_rows(*run, result['agents']).to_csv(agent_output, mode='a', index=False, header=not os.path.exists(agent_output))
+        runs.append({'RunId': result['RunId'], 'iteration': result['iteration'], 'seed': result['seed'], **result['parameters']})
+    return pd.DataFrame(runs).sort_values('RunId').reset_index(drop=True)
@@ -0,0 +1,160 @@
+"""
+Fork server for runs that only differ in parameters that do not determine the population (e.g. the government parameters,
+thresholds or the flood probability). One AdaptationModel is initialised per population and seed, and a child process is
+forked (os.fork) from it for every parameter variant. The children share the initialised households, network and flood map
+with the parent through copy-on-write memory, apply their own parameters (AdaptationModel.apply_parameters) and run.
+All variants of a population start from the same random state, so they are compared with common random numbers.
+Only available on platforms with os.fork (Linux and macOS).
+"""
+import os
+import gc
+import pickle
+import selectors
+import traceback
+
+from model import AdaptationModel, POPULATION_PARAMETERS
+
+
+class ForkServer():
+    """
+    Keeps one initialised model, from which parameter variants are forked. The initialised objects are frozen for the
+    garbage collector until the server is closed.
+
+    Usage:
+        with ForkServer({'number_of_households': 1000}, seed=42) as server:
+            results = server.run([{'gov_structure': 'centralised'}, {'gov_structure': 'decentralised'}], max_steps=80)
+    """
+    def __init__(self, parameters = None, seed = None):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError("The fork server needs os.fork, which is not available on this platform")
+        parameters = dict(parameters or {})
+        self.seed = seed
+        self.parameters = parameters
+        self.model = AdaptationModel(seed=seed, **parameters)
+        self.random_state = self.model.random.getstate()
+        # the initialised objects are moved out of reach of the garbage collector, so it does not touch (and copy) their pages
+        gc.freeze()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Release the model and unfreeze the objects that were frozen for the garbage collector."""
+        if self.closed:
+            return
+        self.closed = True
+        self.model = None
+        gc.unfreeze()
+
+    def run_variant(self, variant, max_steps, agent_data = False):
+        """Apply the parameters of a variant to the model and run it. This is called in the forked child process."""
+        model = self.model
+        model.apply_parameters(**variant)
+        model.random.setstate(self.random_state)
+        for i in range(max_steps):
+            model.step()
+        result = {'model': model.datacollector.get_model_vars_dataframe()}
+        if agent_data:
+            result['agents'] = model.datacollector.get_agent_vars_dataframe()
+        return result
+
+    def fork(self, variant, max_steps, agent_data):
+        """Fork a child process that runs a variant. Returns the process id and the file descriptor of the result pipe."""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # child process: run the variant, send back the pickled result and exit without running the parent's cleanup.
+            # The child always exits here, also on KeyboardInterrupt or SystemExit, so it never continues in the parent's loop
+            status = 1
+            try:
+                os.close(read_fd)
+                try:
+                    result = ('ok', self.run_variant(variant, max_steps, agent_data))
+                    status = 0
+                except BaseException:
+                    result = ('error', traceback.format_exc())
+                with os.fdopen(write_fd, 'wb') as f:
+                    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        return pid, read_fd
+
+    def run(self, variants, max_steps, number_processes = None, agent_data = False):
+        """
+        Run every variant (a dictionary of parameters) in its own forked child process, at most number_processes at a time.
+
+        Returns
+        -------
+        results: list with, for every variant, a dictionary with the model-level data ('model') and,
+                 if agent_data is True, the agent-level data ('agents') of the data collector
+        """
+        if self.closed:
+            raise RuntimeError("The fork server is closed")
+        for variant in variants:
+            for name in variant:
+                if name in POPULATION_PARAMETERS:
+                    raise ValueError(f"Parameter '{name}' determines the population and can not be varied by the fork server")
+        number_processes = number_processes or os.cpu_count()
+        results = [None] * len(variants)
+        errors = []
+        buffers = {}
+        selector = selectors.DefaultSelector()
+        pending = list(enumerate(variants))
+        running = 0
+        while pending or running:
+            while pending and running < number_processes:
+                i, variant = pending.pop(0)
+                pid, fd = self.fork(variant, max_steps, agent_data)
+                buffers[fd] = (i, pid, [])
+                selector.register(fd, selectors.EVENT_READ)
+                running += 1
+            # the pipes are read while the children run, so a child never blocks on a full pipe
+            for key, _ in selector.select():
+                fd = key.fd
+                i, pid, chunks = buffers[fd]
+                data = os.read(fd, 1 << 20)
+                if data:
+                    chunks.append(data)
+                    continue
+                selector.unregister(fd)
+                os.close(fd)
+                os.waitpid(pid, 0)
+                running -= 1
+                del buffers[fd]
+                if not chunks:
+                    errors.append((i, 'the child process exited without a result'))
+                    continue
+                status, result = pickle.loads(b''.join(chunks))
+                if status == 'ok':
+                    results[i] = result
+                else:
+                    errors.append((i, result))
+        selector.close()
+        if errors:
+            i, message = errors[0]
+            raise RuntimeError(f"Variant {i} ({variants[i]}) failed:\n{message}")
+        return results
+
+
+def fork_batch_run(parameters, variants, seeds, max_steps, number_processes = None):
+    """
+    Run all variants for all seeds with a fork server per seed.
+    Returns a list of dictionaries with one row per run and step, like mesa.batch_run with data_collection_period=1.
+    """
+    rows = []
+    run_id = 0
+    for iteration, seed in enumerate(seeds):
+        # the frozen objects of this population are released again when the server is closed
+        with ForkServer(parameters, seed=seed) as server:
+            results = server.run(variants, max_steps, number_processes=number_processes)
+        for variant, result in zip(variants, results):
+            for step, metrics in result['model'].iterrows():
+                rows.append({'RunId': run_id, 'iteration': iteration, 'Step': step, 'seed': seed,
+                             **parameters, **variant, **metrics.to_dict()})
+            run_id += 1
+    return rows
@@ -5,14 +5,15 @@
 Functions that are used in the model_file.py and agent.py for the running of the Flood Adaptation Model.
 Functions get called by the Model and Agent class.
 """
-import random
 import numpy as np
 import math
 from shapely import contains_xy
 from shapely import prepare
+from shapely import STRtree
+from shapely.geometry import Polygon
 import geopandas as gpd
 
-def set_initial_values(input_data, parameter, seed):
+def set_initial_values(input_data, parameter, rng):
     """
     Function to set the values based on the distribution shown in the input data for each parameter.
     The input data contains which percentage of households has a certain initial value.
@@ -21,7 +22,7 @@ def set_initial_values(input_data, parameter, seed):
     ----------
     input_data: the dataframe containing the distribution of paramters
     parameter: parameter name that is to be set
-    seed: agent's seed
+    rng: random generator (random.Random) of the model, e.g. agent.random
     
     Returns
     -------
@@ -30,8 +31,7 @@ def set_initial_values(input_data, parameter, seed):
     parameter_set = 0
     parameter_data = input_data.loc[(input_data.parameter == parameter)] # get the distribution of values for the specified parameter
     parameter_data = parameter_data.reset_index()
-    random.seed(seed)
-    random_parameter = random.randint(0,100) 
+    random_parameter = rng.randint(0,100) 
     for i in range(len(parameter_data)):
         if i == 0:
             if random_parameter < parameter_data['value_for_input'][i]:
@@ -83,22 +83,81 @@ floodplain_geoseries = floodplain_gdf['geometry']
 floodplain_multipolygon = floodplain_geoseries[0]  # The geoseries contains only one multipolygon
 prepare(floodplain_multipolygon)
 
-def generate_random_location_within_map_domain():
+def generate_random_location_within_map_domain(rng):
     """
     Generate random location coordinates within the map domain polygon.
 
+    Parameters
+    ----------
+    rng: random generator (random.Random) of the model, e.g. model.random
+
     Returns
     -------
     x, y: lists of location coordinates, longitude and latitude
     """
     while True:
         # generate random location coordinates within square area of map domain
-        x = random.uniform(map_minx, map_maxx)
-        y = random.uniform(map_miny, map_maxy)
+        x = rng.uniform(map_minx, map_maxx)
+        y = rng.uniform(map_miny, map_maxy)
         # check if the point is within the polygon, if so, return the coordinates
         if contains_xy(map_domain_polygon, x, y):
             return x, y
 
+def get_protection_footprint(protection_level, area=None, iterations=30):
+    """
+    Derive the spatial footprint of a large infrastructure (e.g. a dyke or wetland) in the floodplain.
+    The footprint is the part of the floodplain within a buffer around a point of the floodplain,
+    where the buffer radius is chosen such that the footprint covers the protection level as a share of the floodplain area.
+
+    Parameters
+    ----------
+    protection_level: share of the floodplain area (between 0 and 1) that is protected by the infrastructure
+    area: (multi)polygon that is protected, defaults to the floodplain
+    iterations: number of bisection steps used to find the buffer radius
+
+    Returns
+    -------
+    footprint: (multi)polygon of the protected area
+    """
+    if area is None:
+        area = floodplain_multipolygon
+    if protection_level <= 0:
+        return Polygon()  # empty footprint
+    if protection_level >= 1:
+        return area
+    center = area.representative_point()
+    minx, miny, maxx, maxy = area.bounds
+    # the buffer around the center covers the whole area once its radius reaches the farthest corner of the bounding box
+    low, high = 0, math.hypot(max(center.x - minx, maxx - center.x), max(center.y - miny, maxy - center.y))
+    for i in range(iterations):
+        radius = (low + high) / 2
+        if area.intersection(center.buffer(radius)).area < protection_level * area.area:
+            low = radius
+        else:
+            high = radius
+    footprint = area.intersection(center.buffer(high))
+    return footprint
+
+def get_locations_within(footprint, locations, tree=None):
+    """
+    Get which locations are within a footprint, using a spatial index over the locations.
+
+    Parameters
+    ----------
+    footprint: (multi)polygon to query
+    locations: list of Shapely Points, e.g. the household locations
+    tree: STRtree built over the locations, built here if it is not given
+
+    Returns
+    -------
+    mask: boolean array, True for every location within the footprint
+    """
+    if tree is None:
+        tree = STRtree(locations)
+    mask = np.zeros(len(locations), dtype=bool)
+    mask[tree.query(footprint, predicate='contains')] = True
+    return mask
+
 def get_flood_depth(corresponding_map, location, band):
     """ 
     To get the flood depth of a specific location within the model domain.
@@ -119,7 +178,7 @@ def get_flood_depth(corresponding_map, location, band):
     return depth
     
 
-def get_position_flood(bound_l, bound_r, bound_t, bound_b, img, seed):
+def get_position_flood(bound_l, bound_r, bound_t, bound_b, img, rng):
     """ 
     To generater the position on flood map for a household.
     Households are placed randomly on the map, so the distribution does not follow reality.
@@ -127,16 +186,15 @@ def get_position_flood(bound_l, bound_r, bound_t, bound_b, img, seed):
     Parameters
     ----------
     bound_l, bound_r, bound_t, bound_b, img: characteristics of the flood map data (.tif file)
-    seed: seed to generate the location on the map
+    rng: random generator (random.Random) of the model, e.g. model.random
 
     Returns
     -------
     x, y: location on the map
     row, col: location within the tif-file
     """
-    random.seed(seed)
-    x = random.randint(round(bound_l, 0), round(bound_r, 0))
-    y = random.randint(round(bound_b, 0), round(bound_t, 0))
+    x = rng.randint(round(bound_l, 0), round(bound_r, 0))
+    y = rng.randint(round(bound_b, 0), round(bound_t, 0))
     row, col = img.index(x, y)
     return x, y, row, col
 
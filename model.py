@@ -1,14 +1,16 @@
 # Importing necessary libraries
 import networkx as nx
 from mesa import Model, Agent
-from mesa.time import RandomActivation
 from mesa.space import NetworkGrid
 from mesa.datacollection import DataCollector
 import geopandas as gpd
 import rasterio as rs
 import matplotlib.pyplot as plt
 import numpy as np
-import random
+import copy
+import itertools
+import contextlib
+import hashlib
 #import the RBB
 from rbb import OrganizationInstrument
 from rbb import RBBGovernment
@@ -17,14 +19,76 @@ from rbb import GovernmentStructure
 # Import the agent class(es) from agents.py
 from agents import Households
 from agents import Government
+# Import the scheduler from scheduler.py
+from scheduler import HouseholdActivation
+# Import the CSR network generators from network.py
+from network import generate_csr_network, CSRNetworkGrid, CSRGraph, NetworkCache, get_network_parameters
+from network import DynamicGraph, rewire_by_homophily, add_flood_experience_ties
 # Import functions from functions.py
 from functions import get_flood_map_data, calculate_basic_flood_damage
 from functions import map_domain_gdf, floodplain_gdf
+from functions import get_protection_footprint, get_locations_within
+from functions import generate_random_location_within_map_domain
+# Import the checkpoint functions from checkpoint.py
+from checkpoint import get_columns, set_columns, network_to_arrays, network_from_arrays, write_checkpoint, read_checkpoint
+
+# model attributes that are not stored in a checkpoint, since they are rebuilt when the checkpoint is loaded
+CHECKPOINT_SKIP = ('G', 'grid', 'schedule', 'households', 'floodplain_pop', 'government', 'datacollector',
+                   'flood_map', 'band_flood_img', '_agents', '_agents_by_type', '_all_agents', 'profiler')
+# context manager that is used for the phases of a step when no profiler is attached
+NO_PROFILE = contextlib.nullcontext()
+
+# parameters that determine the initialised population (households, network and flood map), which can not be changed after initialisation
+POPULATION_PARAMETERS = ('seed', 'number_of_households', 'flood_map_choice', 'network', 'probability_of_network_connection',
+                         'number_of_edges', 'number_of_nearest_neighbours', 'network_distance', 'distance_decay',
+                         'network_backend', 'network_cache', 'network_dynamics', 'activation', 'skip_dormant_households')
+# parameters that are copied by the government agent at initialisation
+GOVERNMENT_PARAMETERS = ('flood_risk_threshold', 'public_concern_threshold', 'damage_threshold', 'high_risk_bound', 'lower_risk_bound')
 
 dyke = OrganizationInstrument(name = 'Dyke', cost = 8, completion_time = 5, protection_level = 0.7, status = 1)
 wetland = OrganizationInstrument(name = 'Wetland', cost = 5,  completion_time = 2, protection_level = 0.5, status = 1)  
 options_list = [dyke, wetland]
 
+# Define paths to flood maps
+flood_map_paths = {
+    'harvey': r'../input_data/floodmaps/Harvey_depth_meters.tif',
+    '100yr': r'../input_data/floodmaps/100yr_storm_depth_meters.tif',
+    '500yr': r'../input_data/floodmaps/500yr_storm_depth_meters.tif'  # Example path for 500yr flood map
+}
+# flood maps that have been read, by path: the opened map, the band and its bounds
+flood_map_cache = {}
+
+def load_flood_map(flood_map_choice):
+    """
+    Returns the flood map, its band and its bounds (left, right, top, bottom) for a flood map choice.
+    The flood map is read from its file once, after which it is taken from the cache. The band is made read-only, since it is
+    shared by all models (and, after loading the flood maps in a parent process, with forked child processes).
+    """
+    # Throw a ValueError if the flood map choice is not in the dictionary
+    if flood_map_choice not in flood_map_paths.keys():
+        raise ValueError(f"Unknown flood map choice: '{flood_map_choice}'. "
+                         f"Currently implemented choices are: {list(flood_map_paths.keys())}")
+
+    # Choose the appropriate flood map based on the input choice
+    flood_map_path = flood_map_paths[flood_map_choice]
+
+    # Loading and setting up the flood map
+    if flood_map_path not in flood_map_cache:
+        flood_map = rs.open(flood_map_path)
+        band, bound_left, bound_right, bound_top, bound_bottom = get_flood_map_data(flood_map)
+        band.setflags(write=False)
+        flood_map_cache[flood_map_path] = (flood_map, band, bound_left, bound_right, bound_top, bound_bottom)
+    return flood_map_cache[flood_map_path]
+
+def get_entropy(seed):
+    """
+    Returns the seed of a model as a non-negative integer for np.random.SeedSequence. Mesa draws a float seed when no seed is
+    given (see mesa.Model.__new__), so the seed is hashed unless it already is a non-negative integer.
+    """
+    if isinstance(seed, (int, np.integer)) and not isinstance(seed, bool) and seed >= 0:
+        return int(seed)
+    return int.from_bytes(hashlib.sha256(repr(seed).encode()).digest()[:16], 'little')
+
 # Define the AdaptationModel class
 class AdaptationModel(Model):
     """
@@ -40,14 +104,27 @@ class AdaptationModel(Model):
                  flood_map_choice='harvey',
                  # ### network related parameters ###
                  # The social network structure that is used.
-                 # Can currently be "erdos_renyi", "barabasi_albert", "watts_strogatz", or "no_network"
+                 # Can currently be "erdos_renyi", "barabasi_albert", "watts_strogatz", "spatial_knn", "spatial_radius" or "no_network"
                  network = 'watts_strogatz',
                  # likeliness of edge being created between two nodes
                  probability_of_network_connection = 0.4,
                  # number of edges for BA network
                  number_of_edges = 3,
-                 # number of nearest neighbours for WS social network
+                 # number of nearest neighbours for WS and spatial_knn social network
                  number_of_nearest_neighbours = 5,
+                 # maximum distance (in meters) between connected households for spatial_radius social network
+                 network_distance = 1000,
+                 # distance (in meters) over which the influence of a tie in a spatial network decays by a factor e, None for equal influence
+                 distance_decay = None,
+                 # how the social network is stored. Can be "networkx" or "csr" (NumPy generators, for large populations)
+                 network_backend = 'networkx',
+                 # directory (or NetworkCache) in which generated networks are cached for a given seed, None to disable caching
+                 network_cache = None,
+                 # how the social network changes during the run. Can be None (fixed network), "homophily" (ties are rewired
+                 # towards households with a similar AM), "flood_experience" (households that are flooded together form ties) or "both"
+                 network_dynamics = None,
+                 # share of the households that rewire a tie (homophily) or form a tie after a flood (flood_experience) per step
+                 rewiring_rate = 0.05,
                  
                  # Probability of flood occurence
                  flood_probability = 0.05, #basecase, based on calculation that there have been 12 floods in the past 41 years in Houston (https://www.understandinghouston.org/topic/disasters/disaster-risks#history_of_disasters)
@@ -86,7 +163,12 @@ class AdaptationModel(Model):
                 lower_risk_bound = 1.9,
                 
                 gov_detector = 0,
-                gov_structure = 'centralised' #government structure can be centralised or decentralised
+                gov_structure = 'centralised', #government structure can be centralised or decentralised
+
+                # activation of the households, can be "random" or "simultaneous" (all households read the AM of the previous step)
+                activation = 'random',
+                # if True, households for which choosing a measure is a no-op are advanced in bulk instead of running their full step
+                skip_dormant_households = False
                  ):
         
         super().__init__(seed = seed)
@@ -102,6 +184,19 @@ class AdaptationModel(Model):
         self.probability_of_network_connection = probability_of_network_connection
         self.number_of_edges = number_of_edges
         self.number_of_nearest_neighbours = number_of_nearest_neighbours
+        self.network_distance = network_distance
+        self.distance_decay = distance_decay
+        self.network_backend = network_backend
+        self.network_cache = NetworkCache(network_cache) if isinstance(network_cache, str) else network_cache
+        if network_dynamics not in (None, 'homophily', 'flood_experience', 'both'):
+            raise ValueError(f"Unknown network dynamics: '{network_dynamics}'. "
+                             f"Currently implemented network dynamics are: None, 'homophily', 'flood_experience' and 'both'")
+        self.network_dynamics = network_dynamics
+        self.rewiring_rate = rewiring_rate
+        # independent random streams for the scheduler and the network dynamics, both derived from the seed of the model
+        self.seed_sequence = np.random.SeedSequence(get_entropy(self._seed))
+        scheduler_seed, network_seed = self.seed_sequence.spawn(2)
+        self.network_rng = np.random.default_rng(network_seed)
         
         self.flood_probability = flood_probability
         self.economic_status = economic_status
@@ -133,8 +228,11 @@ class AdaptationModel(Model):
         self.avg_flood_damage = 0
         self.last_flood = 0
         self.avg_public_concern = 0
-        self.options_list = options_list
+        # the instruments change during a run (status, completion time), so every model has its own copies
+        self.options_list = copy.deepcopy(options_list)
         self.infrastructure = False
+        self.protected_mask = None # boolean mask of the protected households, computed once the infrastructure is implemented
+        self.profiler = None # StepProfiler (see profiling.py) that times the phases of every step, None when not profiling
 
         self.gov_detector = gov_detector
         
@@ -150,29 +248,129 @@ class AdaptationModel(Model):
         self.high_risk_bound = high_risk_bound
         self.lower_risk_bound = lower_risk_bound
 
+        # spatial networks are built from the household locations, so these are drawn before the network is generated
+        self.household_locations = None
+        if self.network in ('spatial_knn', 'spatial_radius'):
+            self.household_locations = [generate_random_location_within_map_domain(self.random) for i in range(self.number_of_households)]
+
         # generating the graph according to the network used and the network parameters specified
         self.G = self.initialize_network()
+        # a changing network is stored as a DynamicGraph, so ties can be added and removed without rebuilding the graph
+        if self.network_dynamics is not None:
+            self.G = DynamicGraph.from_csr(self.G) if isinstance(self.G, CSRGraph) else DynamicGraph.from_networkx(self.G)
         # create grid out of network graph
-        self.grid = NetworkGrid(self.G)
+        self.initialize_grid()
 
         # Initialize maps
+        self.flood_map_choice = flood_map_choice
         self.initialize_maps(flood_map_choice)
 
         # set schedule for agents
-        self.schedule = RandomActivation(self)  # Schedule for activating agents
+        self.activation = activation
+        self.schedule = HouseholdActivation(self, mode=activation, rng=np.random.default_rng(scheduler_seed), skip_dormant=skip_dormant_households)  # Schedule for activating households, followed by the government
 
         # create households through initiating a household on each node of the network graph
+        self.households = []
         for i, node in enumerate(self.G.nodes(), start = 1):
-            household = Households(unique_id=i, model=self)
+            location = None if self.household_locations is None else self.household_locations[i - 1]
+            household = Households(unique_id=i, model=self, location=location)
             self.schedule.add(household)
             self.grid.place_agent(agent=household, node_id=node)
+            self.households.append(household)
+
+        # floodplain membership is fixed at initialisation, so the index of floodplain households is built only once
+        self.floodplain_idx = np.flatnonzero([household.in_floodplain for household in self.households])
+        self.floodplain_pop = [self.households[i] for i in self.floodplain_idx]
 
-        
         #create government agent
-        government = Government(unique_id=0, model=self,structure=self.structure, detector=gov_detector)
+        self.government = Government(unique_id=0, model=self,structure=self.structure, detector=gov_detector)
         #government.decision = dyke
-        self.schedule.add(government)
+        self.schedule.add(self.government)
         # Data collection setup to collect data
+        self.initialize_datacollector()
+
+    def initialize_network(self):
+        """
+        Initialize and return the social network graph. If a network cache is used, a network that has been generated before
+        with the same network type, parameters and seed is loaded from the cache instead of generated again.
+        """
+        if self.network_cache is None:
+            return self.generate_network()
+        parameters = get_network_parameters(self.network, self.number_of_households, self.number_of_nearest_neighbours,
+                                            self.probability_of_network_connection, self.number_of_edges,
+                                            self.household_locations, self.network_distance, self.distance_decay)
+        key = self.network_cache.key(self.network_backend, self.network, parameters, self.seed)
+        G = self.network_cache.load(key)
+        if G is None:
+            G = self.generate_network()
+            self.network_cache.save(key, G if self.network_backend == 'csr' else CSRGraph.from_networkx(G))
+        elif self.network_backend != 'csr':
+            G = G.to_networkx()
+        return G
+
+    def generate_network(self):
+        """
+        Generate and return the social network graph based on the provided network type using pattern matching.
+        With the "csr" network backend, the graph is generated with NumPy in CSR format (see network.py).
+        """
+        if self.network_backend == 'csr' or self.network in ('spatial_knn', 'spatial_radius'):
+            G = generate_csr_network(self.network, self.number_of_households, self.number_of_nearest_neighbours,
+                                     self.probability_of_network_connection, self.number_of_edges, seed=self.seed,
+                                     locations=self.household_locations, network_distance=self.network_distance,
+                                     distance_decay=self.distance_decay)
+            # spatial networks are always built with a KD-tree, and exported to networkx for the networkx backend
+            return G if self.network_backend == 'csr' else G.to_networkx()
+        elif self.network_backend != 'networkx':
+            raise ValueError(f"Unknown network backend: '{self.network_backend}'. "
+                             f"Currently implemented network backends are: 'networkx' and 'csr'")
+        if self.network == 'erdos_renyi':
+            return nx.erdos_renyi_graph(n=self.number_of_households,
+                                        p=self.number_of_nearest_neighbours / self.number_of_households,
+                                        seed=self.seed)
+        elif self.network == 'barabasi_albert':
+            return nx.barabasi_albert_graph(n=self.number_of_households,
+                                            m=self.number_of_edges,
+                                            seed=self.seed)
+        elif self.network == 'watts_strogatz':
+            return nx.watts_strogatz_graph(n=self.number_of_households,
+                                        k=self.number_of_nearest_neighbours,
+                                        p=self.probability_of_network_connection,
+                                        seed=self.seed)
+        elif self.network == 'no_network':
+            G = nx.Graph()
+            G.add_nodes_from(range(self.number_of_households))
+            return G
+        else:
+            raise ValueError(f"Unknown network type: '{self.network}'. "
+                            f"Currently implemented network types are: "
+                            f"'erdos_renyi', 'barabasi_albert', 'watts_strogatz', 'spatial_knn', 'spatial_radius', and 'no_network'")
+
+
+    def get_neighbor_weights(self, node, neighbor_nodes):
+        """Returns the weights of the ties from a node to its neighbouring nodes, 1 for ties without a weight."""
+        if isinstance(self.G, (CSRGraph, DynamicGraph)):
+            return self.G.neighbor_weights(node, neighbor_nodes)
+        return [self.G.edges[node, neighbor].get('weight', 1) for neighbor in neighbor_nodes]
+
+    def update_network(self):
+        """Changes the ties of the social network, according to the network dynamics of the model."""
+        if self.network_dynamics in ('homophily', 'both'):
+            AM = np.zeros(self.G.number_of_nodes())
+            AM[[household.pos for household in self.households]] = [household.AM for household in self.households]
+            rewire_by_homophily(self.G, AM, self.rewiring_rate, self.network_rng)
+        if self.network_dynamics in ('flood_experience', 'both') and self.flood:
+            flooded = [household.pos for household in self.floodplain_pop if not household.is_protected]
+            add_flood_experience_ties(self.G, flooded, self.rewiring_rate, self.network_rng)
+
+    def initialize_grid(self):
+        """Create the grid out of the network graph, on which the households are placed."""
+        if self.network_backend == 'csr' or self.network_dynamics is not None:
+            self.grid = CSRNetworkGrid(self.G)
+        else:
+            self.grid = NetworkGrid(self.G)
+
+    def initialize_datacollector(self):
+        """Set up the data collector with the model-level and agent-level metrics."""
         model_metrics = {
                         "total_adapted_households": self.total_adapted_households,
                         "total_decisions_to_adapt": self.total_decision_to_adapt,
@@ -199,58 +397,131 @@ class AdaptationModel(Model):
                         }
         #set up the data collector 
         self.datacollector = DataCollector(model_reporters=model_metrics , agent_reporters=agent_metrics)
-            
 
-    def initialize_network(self):
+    def initialize_maps(self, flood_map_choice):
         """
-        Initialize and return the social network graph based on the provided network type using pattern matching.
+        Initialize and set up the flood map related data based on the provided flood map choice.
+        The flood map is read only once per process (see load_flood_map), and shared by all models that use it.
         """
-        if self.network == 'erdos_renyi':
-            return nx.erdos_renyi_graph(n=self.number_of_households,
-                                        p=self.number_of_nearest_neighbours / self.number_of_households,
-                                        seed=self.seed)
-        elif self.network == 'barabasi_albert':
-            return nx.barabasi_albert_graph(n=self.number_of_households,
-                                            m=self.number_of_edges,
-                                            seed=self.seed)
-        elif self.network == 'watts_strogatz':
-            return nx.watts_strogatz_graph(n=self.number_of_households,
-                                        k=self.number_of_nearest_neighbours,
-                                        p=self.probability_of_network_connection,
-                                        seed=self.seed)
-        elif self.network == 'no_network':
-            G = nx.Graph()
-            G.add_nodes_from(range(self.number_of_households))
-            return G
-        else:
-            raise ValueError(f"Unknown network type: '{self.network}'. "
-                            f"Currently implemented network types are: "
-                            f"'erdos_renyi', 'barabasi_albert', 'watts_strogatz', and 'no_network'")
+        self.flood_map, self.band_flood_img, self.bound_left, self.bound_right, self.bound_top, self.bound_bottom = \
+            load_flood_map(flood_map_choice)
 
+    def apply_parameters(self, **parameters):
+        """
+        Change parameters of an initialised model, before it is run. Only parameters that do not determine the population
+        can be changed (see POPULATION_PARAMETERS), such as the thresholds, costs, flood probability and the government parameters.
+        """
+        if self.schedule.steps > 0:
+            raise ValueError(f"Parameters can only be applied before the model is run, the model is at step {self.schedule.steps}")
+        for name, value in parameters.items():
+            if name in POPULATION_PARAMETERS:
+                raise ValueError(f"Parameter '{name}' determines the population and can not be changed after initialisation")
+            elif name == 'gov_structure':
+                if value == 'centralised':
+                    self.structure = GovernmentStructure.CENTRALISED
+                elif value == 'decentralised':
+                    self.structure = GovernmentStructure.DECENTRALISED
+            elif name == 'gov_detector':
+                self.gov_detector = value
+                self.government.detector = value
+            elif name == 'options_list':
+                self.options_list = copy.deepcopy(value)
+            elif name in GOVERNMENT_PARAMETERS:
+                setattr(self, name, value)
+                setattr(self.government, name, value)
+            elif hasattr(self, name):
+                setattr(self, name, value)
+            else:
+                raise ValueError(f"Unknown parameter: '{name}'")
 
-    def initialize_maps(self, flood_map_choice):
+    def save_checkpoint(self, path):
         """
-        Initialize and set up the flood map related data based on the provided flood map choice.
+        Save the full state of the model to a checkpoint file (see checkpoint.py), so that the run can be continued later
+        with load_checkpoint. The flood map is not copied into the checkpoint, but loaded again from its file.
         """
-        # Define paths to flood maps
-        flood_map_paths = {
-            'harvey': r'../input_data/floodmaps/Harvey_depth_meters.tif',
-            '100yr': r'../input_data/floodmaps/100yr_storm_depth_meters.tif',
-            '500yr': r'../input_data/floodmaps/500yr_storm_depth_meters.tif'  # Example path for 500yr flood map
+        arrays = {}
+        # the call counters of an attached profiler hide methods of the households, but are not part of their state
+        skip = {'model'}
+        if self.profiler is not None:
+            skip.update(name for names in self.profiler.wrapped.values() for name in names)
+        household_columns = get_columns(self.households, 'households', arrays, skip=skip)
+        network_kind = network_to_arrays(self.G, arrays)
+        schedule = self.schedule
+        calendar = schedule.calendar
+        # events of households are stored by the index of the household, events of organisation instruments with the instrument
+        events = [(step, sequence, ('household', target.idx) if isinstance(target, Households) else ('target', target), event)
+                  for step, sequence, target, event in calendar.queue]
+        metadata = {
+            'model': {name: value for name, value in vars(self).items() if name not in CHECKPOINT_SKIP},
+            'households': household_columns,
+            'network': network_kind,
+            'government': {name: value for name, value in vars(self.government).items() if name != 'model'},
+            'schedule': {'mode': schedule.mode, 'skip_dormant': schedule.skip_dormant, 'rng': schedule.rng,
+                         'steps': schedule.steps, 'time': schedule.time, 'previous_AM': schedule.previous_AM,
+                         'active_fraction': schedule.active_fraction},
+            'calendar': {'events': events, 'log': calendar.log},
+            'datacollector': {'model_vars': self.datacollector.model_vars,
+                              'agent_records': self.datacollector._agent_records},
+            # the random generator of the model (the households, the government and the flood draws)
+            'random': self.random.getstate(),
         }
+        write_checkpoint(path, arrays, metadata)
 
-        # Throw a ValueError if the flood map choice is not in the dictionary
-        if flood_map_choice not in flood_map_paths.keys():
-            raise ValueError(f"Unknown flood map choice: '{flood_map_choice}'. "
-                             f"Currently implemented choices are: {list(flood_map_paths.keys())}")
+    @classmethod
+    def load_checkpoint(cls, path):
+        """
+        Load a model from a checkpoint file that was saved with save_checkpoint. The households and the network are restored
+        from arrays instead of being initialised again, and the run continues exactly as it would have without the checkpoint.
+        """
+        arrays, metadata = read_checkpoint(path)
+        model_state = metadata['model']
+        model = cls.__new__(cls, seed=model_state['seed'])
+        Model.__init__(model, seed=model_state['seed'])
+        model.__dict__.update(model_state)
+        model.profiler = None
+
+        model.G = network_from_arrays(arrays, metadata['network'])
+        model.initialize_grid()
+        model.initialize_maps(model.flood_map_choice)
+
+        schedule_state = metadata['schedule']
+        model.schedule = HouseholdActivation(model, mode=schedule_state['mode'], skip_dormant=schedule_state['skip_dormant'])
+        for name in ('rng', 'steps', 'time', 'previous_AM', 'active_fraction'):
+            setattr(model.schedule, name, schedule_state[name])
+
+        # households are created without their (expensive) initialisation, and get their attributes from the checkpoint
+        household_columns = metadata['households']
+        number_of_households = len(arrays['households/unique_id'])
+        unique_ids = arrays['households/unique_id'].tolist()
+        model.households = []
+        for i in range(number_of_households):
+            household = Households.__new__(Households)
+            Agent.__init__(household, unique_ids[i], model)
+            model.households.append(household)
+        set_columns(model.households, 'households', arrays, household_columns)
+        for household in model.households:
+            node, household.pos = household.pos, None
+            model.schedule.add(household)
+            model.grid.place_agent(agent=household, node_id=node)
+        model.floodplain_pop = [model.households[i] for i in model.floodplain_idx]
 
-        # Choose the appropriate flood map based on the input choice
-        flood_map_path = flood_map_paths[flood_map_choice]
+        government_state = metadata['government']
+        model.government = Government.__new__(Government)
+        Agent.__init__(model.government, government_state['unique_id'], model)
+        model.government.__dict__.update(government_state)
+        model.schedule.add(model.government)
 
-        # Loading and setting up the flood map
-        self.flood_map = rs.open(flood_map_path)
-        self.band_flood_img, self.bound_left, self.bound_right, self.bound_top, self.bound_bottom = get_flood_map_data(
-            self.flood_map)
+        calendar = model.schedule.calendar
+        calendar.queue = [(step, sequence, model.households[target] if kind == 'household' else target, event)
+                          for step, sequence, (kind, target), event in metadata['calendar']['events']]
+        calendar.counter = itertools.count(max((sequence for _, sequence, _, _ in calendar.queue), default=-1) + 1)
+        calendar.log = metadata['calendar']['log']
+
+        model.initialize_datacollector()
+        model.datacollector.model_vars = metadata['datacollector']['model_vars']
+        model.datacollector._agent_records = metadata['datacollector']['agent_records']
+        model.random.setstate(metadata['random'])
+        return model
 
     def total_adapted_households(self):
         """Return the total number of households that have adapted."""
@@ -315,36 +586,34 @@ class AdaptationModel(Model):
         return avg_var
 
     def get_floodplain_pop(self):
-        """Returns a list of the unique id's of all the households that are located in a floodplain. """
-        
-        floodplain_pop = []
-        for agent in self.schedule.agents:
-            if agent.unique_id != 0:
-                if agent.in_floodplain: 
-                    floodplain_pop.append(agent)
-        #print(type(floodplain_pop))   #printtest 
+        """Returns a list of all the households that are located in a floodplain. 
+        The list is built once at initialisation, since households do not move."""
         #return the list of agents that is in the floodplain
-        return floodplain_pop
+        return self.floodplain_pop
     
     
     def get_protected_pop(self):
         """Returns a list of the protected households in the floodplain, 
-        based on the large infrastructure"""
-        #first, determine which households are in the floodplain:
-        floodplain_pop = self.get_floodplain_pop()
-        #access the government agent
-        gov = [agent for agent in self.schedule.agents if agent.unique_id==0][0]
-        #determine the sample size to be drawn from the floodplain population = protection level * size of floodplain population 
-        sample_size = int(gov.decision.protection_level * len(floodplain_pop))
-        #create a list of the population in the floodplain that is protected by the infrastructure. 
-        protected_pop = random.sample(floodplain_pop, sample_size)
+        based on the spatial footprint of the large infrastructure"""
+        if self.protected_mask is None:
+            #access the government agent
+            gov = self.government
+            #the footprint of the infrastructure is either given or derived from its protection level
+            footprint = gov.decision.footprint
+            if footprint is None:
+                footprint = get_protection_footprint(gov.decision.protection_level)
+            #query the household locations within the footprint, only households in the floodplain can be protected
+            in_footprint = get_locations_within(footprint, [household.location for household in self.households])
+            self.protected_mask = np.zeros(len(self.households), dtype=bool)
+            self.protected_mask[self.floodplain_idx] = in_footprint[self.floodplain_idx]
         #return the list of agents that is protected
-        return protected_pop
+        return [self.households[i] for i in np.flatnonzero(self.protected_mask)]
             
     
     def assign_protection(self):
         """Assigns a protected status to households in the floodplain 
-        if they are within the protection range of a certain infrastructure"""
+        if they are within the protection range of a certain infrastructure.
+        The protected households are only determined once, since the infrastructure does not move."""
         
         #get the list of households objects that are protected
         protected_pop = self.get_protected_pop()
@@ -357,6 +626,12 @@ class AdaptationModel(Model):
         return
       
             
+    def profile(self, phase):
+        """Returns a context manager that times a phase of the step, if a profiler is attached (see profiling.py)."""
+        if self.profiler is None:
+            return NO_PROFILE
+        return self.profiler.phase(phase)
+
     def step(self):
         """
         introducing a shock: 
@@ -367,70 +642,82 @@ class AdaptationModel(Model):
         assume local flooding instead of global flooding). The actual flood depth can be 
         estimated differently
         """
+        if self.profiler is not None:
+            self.profiler.start_step(self.schedule.steps)
         self.flood = False
         #if there is infrastructure:
 
-        if self.infrastructure:        
-            self.assign_protection()  #first, assign protection to households in the floodplain
+        if self.infrastructure and self.protected_mask is None:        
+            with self.profile('assign_protection'):
+                self.assign_protection()  #first, assign protection to households in the floodplain, once the infrastructure is implemented
         
             
         if self.schedule.steps >= 5:
             # Check if flood occurs
 
-            if random.random() <= self.flood_probability:
-                self.flood = True
-                flood_damages = []
-                # A Flood occurs
-                self.last_flood = self.schedule.steps
-                # print('A flood has occurred in step: ', self.last_flood)
-                
-                for agent in self.schedule.agents:
-                    if agent.unique_id != 0: #if the agent in the scheduler is not the government
-                        if agent.in_floodplain:
-                            #check if the agent is protected:
-                            if agent.is_protected == False:
-                                #Agent experiences a food
-                                
-                                # Calculate the actual flood depth as a random number between 0.5 and 1.2 times the estimated flood depth
-                                agent.flood_depth_actual = random.uniform(0.5, 1.2) * agent.flood_depth_estimated
-                                # calculate the actual flood damage given the actual flood depth
-                                agent.flood_damage_actual = calculate_basic_flood_damage(agent.flood_depth_actual)
-                                
-                                if agent.elevation == 3:
-                                    agent.check_elevation_protection()
-                                    
-                                if agent.dry_proofing == 3 and agent.wet_proofing == 3:
-                                    agent.check_wet_and_dry_proofing_protection()
-                                        
-                                elif agent.dry_proofing == 3:
-                                    agent.check_dry_proofing_protection()
-                                    
-                                elif agent.wet_proofing == 3:
-                                    agent.check_wet_proofing_protection()
-                                    
-                                flood_damages.append(agent.flood_damage_actual)
-                                
-                                damage_costs = self.max_damage_costs * agent.flood_damage_actual
-                                agent.budget -= damage_costs
-                                agent.financial_loss += damage_costs
-                            else:
-                                pass
-                    else:
-                        
-                        pass
-                    
-                if not flood_damages :
-                    self.avg_flood_damage = 0
-                else:
-                    flood_pop = len(self.get_floodplain_pop())
-                    self.avg_flood_damage = sum(flood_damages)/flood_pop
-                 
+            if self.random.random() <= self.flood_probability:
+                self.flood_step()
+
+       #change the ties of the social network, if it is dynamic
+        if self.network_dynamics is not None:
+            with self.profile('update_network'):
+                self.update_network()
        #calculate the average public concern of the households in the model
-        self.calculate_public_concern()       
+        with self.profile('calculate_public_concern'):
+            self.calculate_public_concern()
         self.flood_recency = 1 - ((self.schedule.steps - self.last_flood) / 20)
         # Collect data and advance the model by one step
-        self.datacollector.collect(self)
+        with self.profile('datacollector'):
+            self.datacollector.collect(self)
         self.schedule.step()
+        if self.profiler is not None:
+            self.profiler.end_step()
+
+    def flood_step(self):
+        """A flood occurs: the households in the floodplain that are not protected experience flood damage."""
+        with self.profile('flood'):
+            self.flood = True
+            flood_damages = []
+            # A Flood occurs
+            self.last_flood = self.schedule.steps
+            # print('A flood has occurred in step: ', self.last_flood)
+            
+            #only households in the floodplain can experience the flood
+            for agent in self.get_floodplain_pop():
+                #check if the agent is protected:
+                if agent.is_protected == False:
+                    #Agent experiences a food
+                    
+                    # Calculate the actual flood depth as a random number between 0.5 and 1.2 times the estimated flood depth
+                    agent.flood_depth_actual = self.random.uniform(0.5, 1.2) * agent.flood_depth_estimated
+                    # calculate the actual flood damage given the actual flood depth
+                    agent.flood_damage_actual = calculate_basic_flood_damage(agent.flood_depth_actual)
+                    
+                    if agent.elevation == 3:
+                        agent.check_elevation_protection()
+                        
+                    if agent.dry_proofing == 3 and agent.wet_proofing == 3:
+                        agent.check_wet_and_dry_proofing_protection()
+                            
+                    elif agent.dry_proofing == 3:
+                        agent.check_dry_proofing_protection()
+                        
+                    elif agent.wet_proofing == 3:
+                        agent.check_wet_proofing_protection()
+                        
+                    flood_damages.append(agent.flood_damage_actual)
+                    
+                    damage_costs = self.max_damage_costs * agent.flood_damage_actual
+                    agent.budget -= damage_costs
+                    agent.financial_loss += damage_costs
+                else:
+                    pass
+                
+            if not flood_damages :
+                self.avg_flood_damage = 0
+            else:
+                flood_pop = len(self.floodplain_idx)
+                self.avg_flood_damage = sum(flood_damages)/flood_pop
        
         
     # def run_model(self):
@@ -0,0 +1,680 @@
+"""
+Social network generators that are used in model.py as an alternative to the networkx graphs.
+The generators build the same four network types with NumPy and store them directly in CSR format
+(compressed sparse rows: the neighbours of node i are indices[indptr[i]:indptr[i+1]]), which is
+much faster and smaller than a networkx graph for large populations.
+"""
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import numpy as np
+import networkx as nx
+from scipy.spatial import cKDTree
+
+
+class CSRGraph():
+    """
+    An undirected graph with nodes 0, ..., n-1 stored in CSR format.
+    It has the parts of the networkx graph interface that are used by the model (nodes, neighbors, degree).
+    Edges can have a weight (e.g. a distance decay), stored in an array aligned with indices.
+    """
+    def __init__(self, number_of_nodes, indptr, indices, weights=None):
+        self.n = number_of_nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @classmethod
+    def from_edges(cls, number_of_nodes, source, target, weights=None):
+        """Build a graph from arrays with the two end nodes (and optionally the weight) of every undirected edge (each edge given once)."""
+        source = np.asarray(source, dtype=np.int64)
+        target = np.asarray(target, dtype=np.int64)
+        rows = np.concatenate([source, target])
+        cols = np.concatenate([target, source])
+        # sort by row and then by column, so the neighbours of every node are sorted
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(number_of_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=number_of_nodes), out=indptr[1:])
+        if weights is not None:
+            weights = np.concatenate([weights, weights])[order]
+        return cls(number_of_nodes, indptr, cols[order], weights)
+
+    @classmethod
+    def from_networkx(cls, G):
+        """Build a graph from a networkx graph with nodes 0, ..., n-1. The 'weight' edge attribute is kept if all edges have it."""
+        edges = list(G.edges(data='weight'))
+        source = np.array([u for u, v, w in edges], dtype=np.int64)
+        target = np.array([v for u, v, w in edges], dtype=np.int64)
+        weights = None
+        if edges and all(w is not None for u, v, w in edges):
+            weights = np.array([w for u, v, w in edges], dtype=float)
+        return cls.from_edges(G.number_of_nodes(), source, target, weights)
+
+    def nodes(self):
+        return range(self.n)
+
+    def neighbors(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def number_of_nodes(self):
+        return self.n
+
+    def number_of_edges(self):
+        return len(self.indices) // 2
+
+    def edges(self):
+        """Returns the arrays (source, target) with every undirected edge once, with source < target."""
+        rows = np.repeat(np.arange(self.n, dtype=np.int64), self.degree())
+        upper = rows < self.indices
+        return rows[upper], self.indices[upper]
+
+    def edge_weights(self):
+        """Returns the weights of the edges in the order of edges(), or None if the graph has no weights."""
+        if self.weights is None:
+            return None
+        rows = np.repeat(np.arange(self.n, dtype=np.int64), self.degree())
+        return self.weights[rows < self.indices]
+
+    def neighbor_weights(self, node, neighbors):
+        """Returns the weights of the edges from a node to the given neighbouring nodes (1 for every edge if the graph has no weights)."""
+        if self.weights is None:
+            return np.ones(len(neighbors))
+        start = self.indptr[node]
+        # the neighbours of every node are sorted, so the edges can be found with a binary search
+        return self.weights[start + np.searchsorted(self.neighbors(node), neighbors)]
+
+    def to_networkx(self):
+        """Export the graph to networkx, e.g. for analysis of the network structure. Weights are stored in the 'weight' edge attribute."""
+        G = nx.Graph()
+        G.add_nodes_from(range(self.n))
+        source, target = (part.tolist() for part in self.edges())
+        if self.weights is None:
+            G.add_edges_from(zip(source, target))
+        else:
+            G.add_weighted_edges_from(zip(source, target, self.edge_weights().tolist()))
+        return G
+
+
+class CSRNetworkGrid():
+    """
+    A lightweight replacement for mesa's NetworkGrid on top of a CSRGraph (or DynamicGraph), with one agent per node.
+    """
+    def __init__(self, G):
+        self.G = G
+        self.node_agents = np.empty(G.number_of_nodes(), dtype=object)
+
+    def place_agent(self, agent, node_id):
+        """Place an agent on a node."""
+        self.node_agents[node_id] = agent
+        agent.pos = node_id
+
+    def remove_agent(self, agent):
+        self.node_agents[agent.pos] = None
+        agent.pos = None
+
+    def get_neighborhood(self, node_id, include_center=False, radius=1):
+        """Returns the neighbouring nodes of a node (only a radius of 1 is supported)."""
+        if radius != 1:
+            raise ValueError("CSRNetworkGrid only supports a neighbourhood radius of 1")
+        neighborhood = list(self.G.neighbors(node_id))
+        if include_center:
+            neighborhood.append(node_id)
+        return neighborhood
+
+    def get_neighbors(self, node_id, include_center=False, radius=1):
+        """Returns the agents on the neighbouring nodes of a node."""
+        return self.get_cell_list_contents(self.get_neighborhood(node_id, include_center, radius))
+
+    def get_cell_list_contents(self, cell_list):
+        return [agent for agent in self.node_agents[cell_list] if agent is not None]
+
+    def is_cell_empty(self, node_id):
+        return self.node_agents[node_id] is None
+
+
+class DynamicGraph():
+    """
+    An undirected graph with nodes 0, ..., n-1 of which the ties can change during a run.
+    Every node keeps a set of its neighbours, and every tie is also stored in two slots (one per direction) of flat arrays with
+    the node that owns the slot, the neighbour and the weight of the tie. A batch of tie changes fills and clears slots in place,
+    and cleared slots are reused by later ties, so the graph is never rebuilt. The degree and the weighted degree of every node
+    are updated with the changes of every batch, and neighbour sums are taken directly over the slots (see neighbor_sums),
+    so users of the graph do not need a CSR snapshot that is invalidated by every change.
+    """
+    def __init__(self, number_of_nodes, weights=False):
+        self.n = number_of_nodes
+        self.adjacency = [set() for i in range(number_of_nodes)]
+        self.weights = {} if weights else None # weight of every tie, keyed by (smallest node, largest node)
+        self.edge_count = 0
+        self.version = 0
+        self.csr = None
+        self.csr_version = -1
+        self.slot_node = np.zeros(0, dtype=np.int64) # node that owns the slot
+        self.slot_neighbor = np.zeros(0, dtype=np.int64)
+        self.slot_weight = np.zeros(0) # weight of the tie, 0 for a cleared slot
+        self.slot_active = np.zeros(0) # 1 for a slot that holds a tie, 0 for a cleared slot
+        self.slots_used = 0 # number of slots that hold a tie or were cleared, the other slots are spare capacity
+        self.free_slots = [] # cleared slots, which are reused first
+        self.slot_of = {} # slot of every tie, keyed by (node, neighbour)
+        self.node_degree = np.zeros(number_of_nodes, dtype=np.int64)
+        self.weighted_degree = np.zeros(number_of_nodes)
+
+    @classmethod
+    def from_csr(cls, G):
+        """Build a dynamic graph from a CSRGraph."""
+        dynamic = cls(G.n, weights=G.weights is not None)
+        indptr = G.indptr.tolist()
+        indices = G.indices.tolist()
+        for node in range(G.n):
+            dynamic.adjacency[node].update(indices[indptr[node]:indptr[node + 1]])
+        dynamic.edge_count = G.number_of_edges()
+        if G.weights is not None:
+            source, target = G.edges()
+            dynamic.weights = dict(zip(zip(source.tolist(), target.tolist()), G.edge_weights().tolist()))
+        rows = np.repeat(np.arange(G.n, dtype=np.int64), np.diff(G.indptr))
+        dynamic.set_slots(rows, G.indices, G.weights)
+        return dynamic
+
+    @classmethod
+    def from_networkx(cls, G):
+        """Build a dynamic graph from a networkx graph with nodes 0, ..., n-1."""
+        return cls.from_csr(CSRGraph.from_networkx(G))
+
+    def set_slots(self, nodes, neighbors, weights=None, active=None, free_slots=()):
+        """
+        Fill the slot arrays, e.g. after the neighbour sets were filled. Every tie needs a slot for both directions.
+        active and free_slots restore the cleared slots of a graph (see checkpoint.py), by default all slots hold a tie.
+        """
+        self.slot_node = np.array(nodes, dtype=np.int64)
+        self.slot_neighbor = np.array(neighbors, dtype=np.int64)
+        self.slots_used = len(self.slot_node)
+        self.slot_active = np.ones(self.slots_used) if active is None else np.array(active, dtype=float)
+        self.slot_weight = self.slot_active.copy() if weights is None else np.array(weights, dtype=float) * self.slot_active
+        self.free_slots = list(free_slots)
+        filled = np.flatnonzero(self.slot_active)
+        self.slot_of = dict(zip(zip(self.slot_node[filled].tolist(), self.slot_neighbor[filled].tolist()), filled.tolist()))
+        self.node_degree = np.bincount(self.slot_node[filled], minlength=self.n).astype(np.int64)
+        self.weighted_degree = np.bincount(self.slot_node, weights=self.slot_weight, minlength=self.n)
+
+    def allocate_slots(self, count):
+        """Returns count empty slots: cleared slots first, then spare capacity, of which there is made more if needed."""
+        slots = [self.free_slots.pop() for i in range(min(count, len(self.free_slots)))]
+        new = count - len(slots)
+        if self.slots_used + new > len(self.slot_node):
+            capacity = max(2 * len(self.slot_node), self.slots_used + new, 16)
+            for name in ('slot_node', 'slot_neighbor', 'slot_weight', 'slot_active'):
+                array = getattr(self, name)
+                grown = np.zeros(capacity, dtype=array.dtype)
+                grown[:len(array)] = array
+                setattr(self, name, grown)
+        slots.extend(range(self.slots_used, self.slots_used + new))
+        self.slots_used += new
+        return np.array(slots, dtype=np.int64)
+
+    def nodes(self):
+        return range(self.n)
+
+    def neighbors(self, node):
+        return self.adjacency[node]
+
+    def has_edge(self, u, v):
+        return v in self.adjacency[u]
+
+    def degree(self):
+        return self.node_degree.copy()
+
+    def number_of_nodes(self):
+        return self.n
+
+    def number_of_edges(self):
+        return self.edge_count
+
+    def add_edges(self, source, target, weights=None):
+        """Add a batch of ties. Self loops and ties that already exist are skipped. Returns the number of added ties."""
+        nodes, neighbors, tie_weights = [], [], []
+        if weights is None:
+            weights = itertools.repeat(1.0)
+        for u, v, weight in zip(source, target, weights):
+            u, v = int(u), int(v)
+            if u == v or v in self.adjacency[u]:
+                continue
+            self.adjacency[u].add(v)
+            self.adjacency[v].add(u)
+            if self.weights is not None:
+                self.weights[min(u, v), max(u, v)] = weight
+            nodes.append(u)
+            neighbors.append(v)
+            tie_weights.append(weight if self.weights is not None else 1.0)
+        added = len(nodes)
+        if added:
+            # a slot for both directions of every tie
+            slots = self.allocate_slots(2 * added)
+            slot_nodes = np.array(nodes + neighbors, dtype=np.int64)
+            slot_neighbors = np.array(neighbors + nodes, dtype=np.int64)
+            slot_weights = np.array(tie_weights + tie_weights, dtype=float)
+            self.slot_node[slots] = slot_nodes
+            self.slot_neighbor[slots] = slot_neighbors
+            self.slot_weight[slots] = slot_weights
+            self.slot_active[slots] = 1
+            self.slot_of.update(zip(zip(slot_nodes.tolist(), slot_neighbors.tolist()), slots.tolist()))
+            np.add.at(self.node_degree, slot_nodes, 1)
+            np.add.at(self.weighted_degree, slot_nodes, slot_weights)
+            self.edge_count += added
+            self.version += 1
+        return added
+
+    def remove_edges(self, source, target):
+        """Remove a batch of ties. Ties that do not exist are skipped. Returns the number of removed ties."""
+        slots = []
+        for u, v in zip(source, target):
+            u, v = int(u), int(v)
+            if v not in self.adjacency[u]:
+                continue
+            self.adjacency[u].discard(v)
+            self.adjacency[v].discard(u)
+            if self.weights is not None:
+                self.weights.pop((min(u, v), max(u, v)), None)
+            slots.append(self.slot_of.pop((u, v)))
+            slots.append(self.slot_of.pop((v, u)))
+        removed = len(slots) // 2
+        if removed:
+            slots = np.array(slots, dtype=np.int64)
+            np.subtract.at(self.node_degree, self.slot_node[slots], 1)
+            np.subtract.at(self.weighted_degree, self.slot_node[slots], self.slot_weight[slots])
+            self.slot_weight[slots] = 0
+            self.slot_active[slots] = 0
+            self.free_slots.extend(slots.tolist())
+            self.edge_count -= removed
+            self.version += 1
+        return removed
+
+    def neighbor_weights(self, node, neighbors):
+        """Returns the weights of the ties from a node to the given neighbouring nodes (1 for every tie if the graph has no weights)."""
+        if self.weights is None:
+            return np.ones(len(neighbors))
+        return np.array([self.weights.get((min(node, neighbor), max(node, neighbor)), 1.0) for neighbor in neighbors])
+
+    def neighbor_sums(self, values, weighted=False):
+        """
+        Returns the (weighted) sum of the values of the neighbours of every node, and the (weighted) number of neighbours of
+        every node, taken over the slots of the ties. Cleared slots have weight 0, so they do not count.
+        """
+        used = self.slots_used
+        slot_weights = (self.slot_weight if weighted else self.slot_active)[:used]
+        sums = np.bincount(self.slot_node[:used], weights=values[self.slot_neighbor[:used]] * slot_weights, minlength=self.n)
+        return sums, self.weighted_degree if weighted else self.node_degree
+
+    def to_csr(self):
+        """Returns a CSRGraph snapshot of the current ties, which is only rebuilt after the graph has changed."""
+        if self.csr_version != self.version:
+            filled = np.flatnonzero(self.slot_active[:self.slots_used])
+            nodes = self.slot_node[filled]
+            neighbors = self.slot_neighbor[filled]
+            order = np.lexsort((neighbors, nodes))
+            indptr = np.zeros(self.n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(nodes, minlength=self.n), out=indptr[1:])
+            weights = self.slot_weight[filled][order] if self.weights is not None else None
+            self.csr = CSRGraph(self.n, indptr, neighbors[order], weights)
+            self.csr_version = self.version
+        return self.csr
+
+    def to_networkx(self):
+        """Export the current ties to networkx, e.g. for analysis of the network structure."""
+        return self.to_csr().to_networkx()
+
+
+def rewire_by_homophily(G, AM, rate, rng, candidates=5):
+    """
+    Homophily rewiring of a DynamicGraph: every node drops, with probability rate, its tie to the neighbour whose AM differs most
+    from its own, and forms a tie with the node with the most similar AM out of a few random candidates.
+
+    Parameters
+    ----------
+    G: DynamicGraph
+    AM: array with the adaptation motivation of every node
+    rate: probability that a node rewires one of its ties in this step
+    rng: NumPy random generator
+    candidates: number of random candidates for a new tie
+
+    Returns
+    -------
+    removed, added: number of removed and added ties
+    """
+    nodes = np.flatnonzero(rng.random(G.n) < rate)
+    drawn_candidates = rng.integers(0, G.n, size=(len(nodes), candidates))
+    remove_source, remove_target, add_source, add_target = [], [], [], []
+    for node, node_candidates in zip(nodes.tolist(), drawn_candidates.tolist()):
+        neighbors = list(G.neighbors(node))
+        if neighbors:
+            remove_source.append(node)
+            remove_target.append(neighbors[int(np.argmax(np.abs(AM[neighbors] - AM[node])))])
+        node_candidates = [candidate for candidate in node_candidates if candidate != node and not G.has_edge(node, candidate)]
+        if node_candidates:
+            add_source.append(node)
+            add_target.append(min(node_candidates, key=lambda candidate: abs(AM[candidate] - AM[node])))
+    removed = G.remove_edges(remove_source, remove_target)
+    added = G.add_edges(add_source, add_target)
+    return removed, added
+
+
+def add_flood_experience_ties(G, flooded_nodes, rate, rng):
+    """
+    Ties formed after a shared flood experience: a share (rate) of the nodes that were flooded in this step is paired at random,
+    and every pair forms a tie.
+
+    Returns
+    -------
+    added: number of added ties
+    """
+    flooded_nodes = rng.permutation(np.asarray(flooded_nodes, dtype=np.int64))
+    number_of_pairs = int(round(rate * len(flooded_nodes))) // 2
+    paired = flooded_nodes[:2 * number_of_pairs]
+    return G.add_edges(paired[0::2], paired[1::2])
+
+
+def erdos_renyi_csr(n, p, seed=None):
+    """
+    Erdos-Renyi G(n, p) graph, generated by geometric edge skipping (Batagelj & Brandes, 2005):
+    instead of testing all n(n-1)/2 node pairs, the gaps between consecutive edges are drawn from a geometric distribution.
+    """
+    rng = np.random.default_rng(seed)
+    number_of_pairs = n * (n - 1) // 2
+    if p <= 0 or number_of_pairs == 0:
+        return CSRGraph.from_edges(n, [], [])
+    if p >= 1:
+        pairs = np.arange(number_of_pairs, dtype=np.int64)
+    else:
+        batches = []
+        position = -1
+        while position < number_of_pairs:
+            # draw the gaps in batches that are a bit larger than the expected number of remaining edges
+            batch_size = int((number_of_pairs - position) * p * 1.05) + 100
+            positions = position + np.cumsum(rng.geometric(p, size=batch_size))
+            batches.append(positions)
+            position = positions[-1]
+        pairs = np.concatenate(batches)
+        pairs = pairs[pairs < number_of_pairs]
+    # map the index of a pair to (v, w) with w < v, where the index is v(v-1)/2 + w
+    v = ((1 + np.sqrt(1 + 8 * pairs.astype(float))) // 2).astype(np.int64)
+    # correct rounding errors of the square root for large indices
+    v -= (v * (v - 1) // 2 > pairs)
+    v += ((v + 1) * v // 2 <= pairs)
+    w = pairs - v * (v - 1) // 2
+    return CSRGraph.from_edges(n, v, w)
+
+
+def watts_strogatz_csr(n, k, p, seed=None, max_rounds=10):
+    """
+    Watts-Strogatz small-world graph: a ring lattice in which every node is connected to its k // 2 neighbours on
+    each side, after which the far end of every lattice edge is rewired with probability p to a random node.
+    Rewiring is vectorized: all rewired edges draw a new end at once, and draws that would create a self loop or
+    a duplicate edge are drawn again for a few rounds. Edges that still conflict keep their lattice end.
+    """
+    if k > n:
+        raise nx.NetworkXError("k>n, choose smaller k or larger n")
+    rng = np.random.default_rng(seed)
+    if k == n:
+        source, target = np.triu_indices(n, 1)
+        return CSRGraph.from_edges(n, source, target)
+    half = k // 2
+    source = np.repeat(np.arange(n, dtype=np.int64), half)
+    target = (source + np.tile(np.arange(1, half + 1, dtype=np.int64), n)) % n
+    rewire = np.flatnonzero(rng.random(len(source)) < p)
+    keys = np.minimum(source, target) * n + np.maximum(source, target)
+    for i in range(max_rounds):
+        if len(rewire) == 0:
+            break
+        new_target = rng.integers(0, n, size=len(rewire))
+        new_keys = np.minimum(source[rewire], new_target) * n + np.maximum(source[rewire], new_target)
+        # a new edge is valid if it is not a self loop, does not exist yet and is not drawn twice in this round
+        unique_keys, first, counts = np.unique(new_keys, return_index=True, return_counts=True)
+        drawn_once = np.zeros(len(rewire), dtype=bool)
+        drawn_once[first[counts == 1]] = True
+        valid = (new_target != source[rewire]) & ~np.isin(new_keys, keys) & drawn_once
+        target[rewire[valid]] = new_target[valid]
+        keys[rewire[valid]] = new_keys[valid]
+        rewire = rewire[~valid]
+    return CSRGraph.from_edges(n, source, target)
+
+
+def barabasi_albert_csr(n, m, seed=None, max_rounds=100):
+    """
+    Barabasi-Albert preferential attachment graph, starting from a star graph with m + 1 nodes like networkx.
+    Every new node draws its m targets uniformly from the repeated-nodes array, in which every node appears once for
+    each of its edges. The array is laid out in advance, with a block of m target slots followed by m slots of the new node
+    itself for every new node, so every target slot points to an earlier slot of the array. All slots are resolved at once
+    by pointer jumping, and nodes that drew the same target twice draw again until all targets of every node are distinct.
+    """
+    if m < 1 or m >= n:
+        raise nx.NetworkXError(f"Barabási–Albert network must have m >= 1 and m < n, m = {m}, n = {n}")
+    rng = np.random.default_rng(seed)
+    new_nodes = np.arange(m + 1, n, dtype=np.int64)
+    # the repeated-nodes array of the star graph: the hub m times, followed by the leaves
+    size = 2 * m + 2 * m * len(new_nodes)
+    values = np.full(size, -1, dtype=np.int64)
+    values[:m] = 0
+    values[m:2 * m] = np.arange(1, m + 1)
+    block_start = 2 * m + 2 * m * np.arange(len(new_nodes), dtype=np.int64)
+    target_slots = (block_start[:, None] + np.arange(m)).ravel()
+    source_slots = (block_start[:, None] + m + np.arange(m)).ravel()
+    values[source_slots] = np.repeat(new_nodes, m)
+    # the number of filled slots when a new node draws its targets is the start of its block
+    filled = np.repeat(block_start, m)
+    pointers = np.arange(size, dtype=np.int64)
+    redraw = np.ones(len(target_slots), dtype=bool)
+    targets = np.zeros((len(new_nodes), m), dtype=np.int64)
+    for i in range(max_rounds):
+        pointers[target_slots[redraw]] = (rng.random(redraw.sum()) * filled[redraw]).astype(np.int64)
+        # pointer jumping: every target slot takes the value of the slot it points to, which is always an earlier slot
+        resolved = values.copy()
+        jumps = pointers.copy()
+        unresolved = resolved < 0
+        while unresolved.any():
+            resolved[unresolved] = resolved[jumps[unresolved]]
+            jumps[unresolved] = jumps[jumps[unresolved]]
+            unresolved = resolved < 0
+        targets = resolved[target_slots].reshape(len(new_nodes), m)
+        # targets of a node have to be distinct, nodes with a duplicate target draw their duplicate slots again
+        sorted_targets = np.sort(targets, axis=1)
+        duplicate_nodes = (sorted_targets[:, 1:] == sorted_targets[:, :-1]).any(axis=1)
+        if not duplicate_nodes.any():
+            break
+        redraw = np.zeros(targets.shape, dtype=bool)
+        for row in np.flatnonzero(duplicate_nodes):
+            seen = set()
+            for j, target in enumerate(targets[row]):
+                if target in seen:
+                    redraw[row, j] = True
+                seen.add(target)
+        redraw = redraw.ravel()
+    else:
+        raise RuntimeError("Could not draw distinct targets for every node in the Barabasi-Albert network")
+    source = np.concatenate([np.zeros(m, dtype=np.int64), np.repeat(new_nodes, m)])
+    target = np.concatenate([np.arange(1, m + 1, dtype=np.int64), targets.ravel()])
+    return CSRGraph.from_edges(n, source, target)
+
+
+def get_distance_weights(distances, distance_decay):
+    """Returns the weight of edges with the given lengths, decaying exponentially with the distance. No decay (None) gives no weights."""
+    if distance_decay is None:
+        return None
+    return np.exp(-np.asarray(distances, dtype=float) / distance_decay)
+
+
+def spatial_knn_csr(locations, k, distance_decay=None):
+    """
+    Spatial k-nearest-neighbour graph: every household is connected to the k households that are closest to its location.
+    Ties are undirected, so a household can have more than k neighbours. The nearest neighbours are found with a KD-tree,
+    so the construction takes O(N log N).
+
+    Parameters
+    ----------
+    locations: array of shape (N, 2) with the x, y coordinates of the households
+    k: number of nearest neighbours
+    distance_decay: length (in map units) over which the weight of a tie decays by a factor e, None for unweighted ties
+    """
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+    n = len(locations)
+    k = min(k, n - 1)
+    if k < 1:
+        return CSRGraph.from_edges(n, [], [])
+    # the nearest location of every household is the household itself, so k + 1 neighbours are queried
+    distances, neighbors = cKDTree(locations).query(locations, k=k + 1)
+    source = np.repeat(np.arange(n, dtype=np.int64), k + 1)
+    target = neighbors.ravel()
+    distances = distances.ravel()
+    not_self = source != target
+    source, target, distances = source[not_self], target[not_self], distances[not_self]
+    # keep every undirected tie once
+    u, v = np.minimum(source, target), np.maximum(source, target)
+    keys, first = np.unique(u * n + v, return_index=True)
+    return CSRGraph.from_edges(n, u[first], v[first], get_distance_weights(distances[first], distance_decay))
+
+
+def spatial_radius_csr(locations, distance, distance_decay=None):
+    """
+    Spatial distance-threshold graph: every household is connected to all households within the given distance.
+    The pairs are found with a KD-tree, so the construction takes O(N log N + number of ties).
+
+    Parameters
+    ----------
+    locations: array of shape (N, 2) with the x, y coordinates of the households
+    distance: maximum distance (in map units) between two connected households
+    distance_decay: length (in map units) over which the weight of a tie decays by a factor e, None for unweighted ties
+    """
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+    pairs = cKDTree(locations).query_pairs(distance, output_type='ndarray')
+    source, target = pairs[:, 0], pairs[:, 1]
+    distances = np.linalg.norm(locations[source] - locations[target], axis=1)
+    return CSRGraph.from_edges(len(locations), source, target, get_distance_weights(distances, distance_decay))
+
+
+def generate_csr_network(network, number_of_households, number_of_nearest_neighbours, probability_of_network_connection,
+                         number_of_edges, seed=None, locations=None, network_distance=None, distance_decay=None):
+    """
+    Generate a social network in CSR format, with the same network types and parameters as AdaptationModel.initialize_network.
+    The spatial network types ('spatial_knn' and 'spatial_radius') are built from the household locations.
+
+    Returns
+    -------
+    G: CSRGraph with a node for every household
+    """
+    if network == 'spatial_knn':
+        return spatial_knn_csr(locations, number_of_nearest_neighbours, distance_decay)
+    elif network == 'spatial_radius':
+        return spatial_radius_csr(locations, network_distance, distance_decay)
+    if network == 'erdos_renyi':
+        return erdos_renyi_csr(number_of_households, number_of_nearest_neighbours / number_of_households, seed=seed)
+    elif network == 'barabasi_albert':
+        return barabasi_albert_csr(number_of_households, number_of_edges, seed=seed)
+    elif network == 'watts_strogatz':
+        return watts_strogatz_csr(number_of_households, number_of_nearest_neighbours, probability_of_network_connection, seed=seed)
+    elif network == 'no_network':
+        return CSRGraph.from_edges(number_of_households, [], [])
+    else:
+        raise ValueError(f"Unknown network type: '{network}'. "
+                         f"Currently implemented network types are: "
+                         f"'erdos_renyi', 'barabasi_albert', 'watts_strogatz', 'spatial_knn', 'spatial_radius', and 'no_network'")
+
+
+def get_network_parameters(network, number_of_households, number_of_nearest_neighbours, probability_of_network_connection,
+                           number_of_edges, locations=None, network_distance=None, distance_decay=None):
+    """Returns the parameters that are used by the generator of a network type, so that unused parameters do not change a cache key.
+    Spatial networks depend on the household locations, which are included as a hash."""
+    if network in ('spatial_knn', 'spatial_radius'):
+        parameters = {'n': number_of_households, 'decay': distance_decay,
+                      'locations': hashlib.sha256(np.ascontiguousarray(locations, dtype=float).tobytes()).hexdigest()}
+        if network == 'spatial_knn':
+            parameters['k'] = number_of_nearest_neighbours
+        else:
+            parameters['distance'] = network_distance
+        return parameters
+    if network == 'erdos_renyi':
+        return {'n': number_of_households, 'k': number_of_nearest_neighbours}
+    elif network == 'barabasi_albert':
+        return {'n': number_of_households, 'm': number_of_edges}
+    elif network == 'watts_strogatz':
+        return {'n': number_of_households, 'k': number_of_nearest_neighbours, 'p': probability_of_network_connection}
+    return {'n': number_of_households}
+
+
+class NetworkCache():
+    """
+    A content-addressed cache of generated social networks on disk. Every network is stored as a compressed
+    CSR .npz file, named after a hash of its generator, network type, generator parameters and seed.
+    When the files in the cache exceed max_bytes, the least recently used files are removed.
+    """
+    version = 1 # increase when the generators change, so that old networks are not loaded anymore
+
+    def __init__(self, directory, max_bytes = 512 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, backend, network, parameters, seed):
+        """Returns the cache key of a network. Networks without a seed are not reproducible, so they have no key (None)."""
+        if seed is None:
+            return None
+        description = {'version': self.version, 'backend': backend, 'network': network, 'parameters': parameters, 'seed': seed}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def load(self, key):
+        """Returns the cached network for a key as a CSRGraph, or None if it is not in the cache."""
+        if key is None:
+            return None
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                weights = data['weights'] if 'weights' in data.files else None
+                G = CSRGraph(int(data['n']), data['indptr'].astype(np.int64), data['indices'].astype(np.int64), weights)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        try:
+            os.utime(path) # mark the file as recently used
+        except FileNotFoundError:
+            pass # evicted by another process after it was read
+        return G
+
+    def save(self, key, G):
+        """Store a CSRGraph in the cache and evict old networks if the cache is too large."""
+        if key is None:
+            return
+        dtype = np.int32 if len(G.indices) < 2**31 else np.int64
+        # write to a temporary file first, so that other processes never load a partially written network
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            arrays = {'n': G.n, 'indptr': G.indptr.astype(dtype), 'indices': G.indices.astype(dtype)}
+            if G.weights is not None:
+                arrays['weights'] = G.weights
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used networks until the cache is not larger than max_bytes."""
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
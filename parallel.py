@@ -0,0 +1,285 @@
+"""
+Domain-decomposed stepping of a single large AdaptationModel on multiple cores.
+The households are partitioned (by spatial tile or by network community) over worker processes. The household state is kept
+in arrays in multiprocessing.shared_memory (see vectorized.py), so every worker steps its own partition in place.
+Every step is synchronous: the coordinator copies the AM of all households into a shared buffer, from which the workers read
+the AM of their neighbours, also across partitions (the boundary exchange). The flood draw, the government step and the
+aggregates are done on the coordinator. Results are reproducible for a given seed and number of partitions.
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import threading
+import heapq
+import numpy as np
+import pandas as pd
+
+from agents import Households
+from model import get_entropy
+from vectorized import (get_state_layout, get_household_parameters, export_household_state, import_household_state,
+                        flood_households, step_households)
+
+# commands from the coordinator to the workers
+FLOOD, STEP, STOP = 0, 1, 2
+# layout of the control array: command, step, flood, flood recency, last flood
+CONTROL_SIZE = 5
+
+
+class SharedArrays():
+    """A dictionary of NumPy arrays in shared memory, which can be attached to by name from other processes."""
+    def __init__(self, layout, names=None):
+        self.layout = layout
+        self.blocks = {}
+        self.arrays = {}
+        for name, (shape, dtype) in layout.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            if names is None:
+                block = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                block = shared_memory.SharedMemory(name=names[name])
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def names(self):
+        return {name: block.name for name, block in self.blocks.items()}
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+
+    def unlink(self):
+        for block in self.blocks.values():
+            block.unlink()
+
+
+def partition_spatial(locations, number_of_partitions):
+    """
+    Partition households into spatial tiles with (nearly) equal numbers of households, by recursive coordinate bisection:
+    the households are split along the longest side of their bounding box until there are enough parts.
+    """
+    locations = np.asarray(locations, dtype=float)
+
+    def bisect(idx, parts):
+        if parts == 1:
+            return [idx]
+        points = locations[idx]
+        axis = np.argmax(points.max(axis=0) - points.min(axis=0)) if len(idx) else 0
+        order = idx[np.argsort(points[:, axis], kind='stable')]
+        left_parts = parts // 2
+        split = len(idx) * left_parts // parts
+        return bisect(order[:split], left_parts) + bisect(order[split:], parts - left_parts)
+
+    return [np.sort(part) for part in bisect(np.arange(len(locations)), number_of_partitions)]
+
+
+def partition_community(G, number_of_partitions, seed=None):
+    """
+    Partition households by network community: the Louvain communities of the social network are packed into partitions,
+    largest first, always into the partition with the fewest households. G is a networkx graph or has to_networkx.
+    """
+    import networkx as nx
+    if hasattr(G, 'to_networkx'):
+        G = G.to_networkx()
+    communities = sorted(nx.community.louvain_communities(G, seed=seed), key=lambda community: (-len(community), min(community)))
+    parts = [[] for i in range(number_of_partitions)]
+    for community in communities:
+        smallest = min(range(number_of_partitions), key=lambda i: len(parts[i]))
+        parts[smallest].extend(community)
+    return [np.sort(np.array(part, dtype=np.int64)) for part in parts]
+
+
+def worker(partition_id, names, layout, partition, network_names, network_layout, parameters, seed, number_of_partitions,
+           control_name, partials_name, barrier):
+    """Worker process that steps the households of one partition, on commands from the coordinator."""
+    shared = SharedArrays(layout, names)
+    network = SharedArrays(network_layout, network_names)
+    control_block = shared_memory.SharedMemory(name=control_name)
+    partials_block = shared_memory.SharedMemory(name=partials_name)
+    control = np.ndarray((CONTROL_SIZE,), dtype=np.float64, buffer=control_block.buf)
+    partials = np.ndarray((number_of_partitions, 2), dtype=np.float64, buffer=partials_block.buf)
+    # every partition has its own random stream, so results only depend on the seed and the number of partitions
+    rng = np.random.default_rng([seed, number_of_partitions, partition_id])
+    state = shared.arrays
+    csr = (network.arrays['indptr'], network.arrays['indices'], network.arrays.get('weights'))
+    try:
+        while True:
+            barrier.wait()
+            command, step, flood, flood_recency, last_flood = control
+            if command == STOP:
+                break
+            elif command == FLOOD:
+                partials[partition_id] = flood_households(state, partition, parameters, rng)
+            elif command == STEP:
+                step_households(state, partition, parameters, int(step), state['previous_AM'], csr,
+                                bool(flood), flood_recency, last_flood, rng)
+            barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    except Exception:
+        # break the barrier, so the coordinator and the other workers do not wait forever
+        barrier.abort()
+        raise
+    finally:
+        del state, csr, control, partials
+        shared.close()
+        network.close()
+        control_block.close()
+        partials_block.close()
+
+
+class PartitionedRun():
+    """
+    Steps the households of an AdaptationModel in parallel over partitions, see the module docstring.
+    Only networks that do not change during the run are supported. The household state is copied back into the Households
+    agents of the model when the run is closed, and model-level results are returned as a DataFrame per step.
+
+    Usage:
+        with PartitionedRun(model, number_of_partitions=4) as run:
+            results = run.run(steps=120)
+    """
+    def __init__(self, model, number_of_partitions = None, partition = 'spatial', seed = None):
+        if getattr(model, 'network_dynamics', None) is not None:
+            raise ValueError("Partitioned stepping does not support a dynamic social network")
+        self.model = model
+        self.number_of_partitions = number_of_partitions or mp.cpu_count()
+        # without a seed, the run is seeded from the seed of the model, which mesa draws if the model has no seed either
+        self.seed = get_entropy(model._seed if seed is None else seed)
+        n = len(model.households)
+
+        # partition the households
+        if partition == 'spatial':
+            locations = [(household.location.x, household.location.y) for household in model.households]
+            self.partitions = partition_spatial(locations, self.number_of_partitions)
+        elif partition == 'community':
+            self.partitions = partition_community(model.G, self.number_of_partitions, seed=self.seed)
+            # the network nodes are mapped to the household indices
+            node_to_idx = {household.pos: household.idx for household in model.households}
+            self.partitions = [np.sort(np.array([node_to_idx[node] for node in part], dtype=np.int64)) for part in self.partitions]
+        else:
+            raise ValueError(f"Unknown partition: '{partition}'. Currently implemented partitions are: 'spatial' and 'community'")
+
+        # household state and the AM buffer that is read for the neighbours in shared memory
+        layout = get_state_layout(n)
+        layout['previous_AM'] = ((n,), np.float64)
+        self.shared = SharedArrays(layout)
+        self.state = self.shared.arrays
+        export_household_state(model, self.state)
+        # the completion of household measures is kept in the state, only the instruments remain in the event calendar
+        calendar = model.schedule.calendar
+        calendar.queue = [event for event in calendar.queue if not isinstance(event[2], Households)]
+        heapq.heapify(calendar.queue)
+
+        # social network in CSR format in the order of the households
+        schedule = model.schedule
+        schedule.build_neighbor_index()
+        network_layout = {'indptr': (schedule.neighbor_indptr.shape, np.int64), 'indices': (schedule.neighbor_indices.shape, np.int64),
+                          'weights': (schedule.neighbor_weights.shape, np.float64)}
+        self.network = SharedArrays(network_layout)
+        self.network.arrays['indptr'][:] = schedule.neighbor_indptr
+        self.network.arrays['indices'][:] = schedule.neighbor_indices
+        self.network.arrays['weights'][:] = schedule.neighbor_weights
+
+        self.control_block = shared_memory.SharedMemory(create=True, size=CONTROL_SIZE * 8)
+        self.partials_block = shared_memory.SharedMemory(create=True, size=self.number_of_partitions * 2 * 8)
+        self.control = np.ndarray((CONTROL_SIZE,), dtype=np.float64, buffer=self.control_block.buf)
+        self.partials = np.ndarray((self.number_of_partitions, 2), dtype=np.float64, buffer=self.partials_block.buf)
+
+        # the flood draw of the coordinator has its own random stream
+        self.rng = np.random.default_rng([self.seed, self.number_of_partitions])
+        context = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+        self.barrier = context.Barrier(self.number_of_partitions + 1)
+        parameters = get_household_parameters(model)
+        self.workers = [context.Process(target=worker, daemon=True,
+                                        args=(i, self.shared.names(), layout, self.partitions[i], self.network.names(),
+                                              network_layout, parameters, self.seed, self.number_of_partitions,
+                                              self.control_block.name, self.partials_block.name, self.barrier))
+                        for i in range(self.number_of_partitions)]
+        for process in self.workers:
+            process.start()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def command(self, command):
+        """Let all workers execute a command on their partition and wait until they are done."""
+        model = self.model
+        self.control[:] = [command, model.schedule.steps, model.flood, getattr(model, 'flood_recency', 0), model.last_flood]
+        try:
+            self.barrier.wait()
+            if command != STOP:
+                self.barrier.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A worker of the partitioned run failed") from None
+
+    def get_model_metrics(self):
+        """Returns the model-level metrics of the current step, like the data collector of the model."""
+        state = self.state
+        model = self.model
+        return {"Step": model.schedule.steps,
+                "total_adapted_households": int(state['is_adapted_cumulatief'].sum()),
+                "total_decisions_to_adapt": int(state['is_adapted'].sum()),
+                "Infrastructure": model.infrastructure,
+                "Average flood damage": model.avg_flood_damage,
+                "Average public concern": model.avg_public_concern,
+                "Average Adaptation Motivation": float(state['AM'].mean()),
+                "Average External Influence": float(state['threat_appraisal'].mean()),
+                "Flood": model.flood}
+
+    def step(self):
+        """Advance the model by one step, following AdaptationModel.step."""
+        model = self.model
+        state = self.state
+        model.flood = False
+        if model.infrastructure and model.protected_mask is None:
+            model.get_protected_pop()
+            state['is_protected'][model.protected_mask] = True
+
+        if model.schedule.steps >= 5 and self.rng.random() <= model.flood_probability:
+            model.flood = True
+            model.last_flood = model.schedule.steps
+            self.command(FLOOD)
+            total_damage, number_flooded = self.partials.sum(axis=0)
+            model.avg_flood_damage = total_damage / len(model.floodplain_idx) if number_flooded else 0
+
+        model.avg_public_concern = float(state['threat_appraisal'].mean())
+        model.flood_recency = 1 - ((model.schedule.steps - model.last_flood) / 20)
+        metrics = self.get_model_metrics()
+
+        # households read the AM of their neighbours, also in other partitions, from the previous step
+        state['previous_AM'][:] = state['AM']
+        model.schedule.calendar.process(model.schedule.steps)
+        self.command(STEP)
+        model.government.step()
+        model.schedule.steps += 1
+        model.schedule.time += 1
+        return metrics
+
+    def run(self, steps):
+        """Run the model for a number of steps. Returns a DataFrame with the model-level metrics of every step."""
+        return pd.DataFrame([self.step() for i in range(steps)]).set_index("Step")
+
+    def close(self):
+        """Stop the workers, copy the household state back into the model and release the shared memory."""
+        if self.closed:
+            return
+        self.closed = True
+        if all(process.is_alive() for process in self.workers) and not self.barrier.broken:
+            self.command(STOP)
+        for process in self.workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        import_household_state(self.model, self.state)
+        self.state = None
+        self.control = None
+        self.partials = None
+        for shared in (self.shared, self.network):
+            shared.close()
+            shared.unlink()
+        for block in (self.control_block, self.partials_block):
+            block.close()
+            block.unlink()
@@ -0,0 +1,119 @@
+"""
+Opt-in profiling of the phases of AdaptationModel.step. When no profiler is attached, the model only does a None check per phase.
+
+Usage:
+    profiler = StepProfiler()
+    profiler.attach(model)
+    for i in range(40):
+        model.step()
+    profiler.detach()
+    profiler.to_csv('timings.csv')
+
+Every row of the timing table is one step, with the time in seconds spent in every phase (assign_protection, flood,
+update_network, calculate_public_concern, datacollector, calendar, households and government) and the number of calls
+to the counted methods of the households (by default the check_* and update_* methods).
+"""
+import time
+import functools
+import pandas as pd
+
+from agents import Households
+
+
+class Phase():
+    """Context manager that adds the time spent in a phase to the current row of the profiler."""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        row = self.profiler.row
+        row[self.name] = row.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+class StepProfiler():
+    """Records the time per phase of every step and counts the calls to the hot methods of the households."""
+    def __init__(self, counted_prefixes = ('check_', 'update_')):
+        self.counted_prefixes = counted_prefixes
+        self.rows = []
+        self.row = {}
+        self.calls = {}
+        self.step_start = None
+        self.model = None
+        self.wrapped = {}
+
+    def attach(self, model):
+        """
+        Start profiling a model. The counted methods of the households of this model are wrapped with a call counter on every
+        household, so other models in the process (e.g. runs in other threads) are not counted.
+        """
+        if self.model is not None:
+            raise ValueError("The profiler is already attached to a model")
+        if getattr(model, 'profiler', None) is not None:
+            raise ValueError("The model is already profiled by another profiler")
+        self.model = model
+        model.profiler = self
+        names = [name for name in dir(Households) if name.startswith(self.counted_prefixes) and callable(getattr(Households, name))]
+        for household in model.households:
+            for name in names:
+                setattr(household, name, self.count_calls(name, getattr(household, name)))
+            self.wrapped[household] = names
+
+    def detach(self):
+        """Stop profiling and restore the counted methods of the households."""
+        for household, names in self.wrapped.items():
+            for name in names:
+                # the wrapper is an attribute of the household, which hides the method of the class
+                delattr(household, name)
+        self.wrapped = {}
+        if self.model is not None:
+            self.model.profiler = None
+            self.model = None
+
+    def count_calls(self, name, method):
+        calls = self.calls
+
+        @functools.wraps(method)
+        def counted(*args, **kwargs):
+            calls[name] = calls.get(name, 0) + 1
+            return method(*args, **kwargs)
+        return counted
+
+    def phase(self, name):
+        """Returns a context manager that times a phase of the current step."""
+        return Phase(self, name)
+
+    def start_step(self, step):
+        self.row = {'Step': step}
+        self.calls.clear()
+        self.step_start = time.perf_counter()
+
+    def end_step(self):
+        self.row['total'] = time.perf_counter() - self.step_start
+        for name, count in self.calls.items():
+            self.row[f'calls_{name}'] = count
+        self.rows.append(self.row)
+        self.row = {}
+
+    def to_dataframe(self):
+        """Returns the timing table with one row per step. Phases that did not occur in a step have a time of 0."""
+        df = pd.DataFrame(self.rows)
+        if df.empty:
+            return df
+        return df.fillna(0).set_index('Step')
+
+    def to_csv(self, path):
+        self.to_dataframe().to_csv(path)
+
+    def to_json(self, path):
+        self.to_dataframe().reset_index().to_json(path, orient='records', indent=1)
+
+    def summary(self):
+        """Returns the total time, the mean time per step and the share of the step time of every phase."""
+        df = self.to_dataframe()
+        times = df[[column for column in df.columns if not column.startswith('calls_')]]
+        return pd.DataFrame({'total': times.sum(), 'mean per step': times.mean(),
+                             'share': times.sum() / times['total'].sum()})
@@ -10,6 +10,7 @@ from mesa import Agent
 from mesa import Model
 from shapely.geometry import Point
 from shapely import contains_xy
+import shapely.wkt
 from enum import Enum
 
 
@@ -113,7 +114,8 @@ class OrganizationInstrument():
         completion_time: int, #due to lengthy government procedures and construction times, the time that it takes to complete
         protection_level: float,
         status: int = 1, #1 = not implemented, 2 = implementing, 3 = implemented-> security is dan 'full'
-        implementation_counter:int = 0 #counter that keeps track of an instrument's implementation duration 
+        implementation_counter:int = 0, #counter that keeps track of an instrument's implementation duration 
+        footprint = None #(multi)polygon of the area protected by the instrument. If None, it is derived from the protection level
         ):
         
         self.name: str = name
@@ -122,6 +124,22 @@ class OrganizationInstrument():
         self.completion_time: int = completion_time
         self.implementation_counter: int  = implementation_counter #time counter per step laten toevoegen, als gelijk aan planning dan status = 2
         self.protection_level: int = protection_level #level of protection: how much it will cover the floodplane
+        self.footprint = footprint
+
+    def to_dict(self):
+        """Returns a serializable (JSON) description of the instrument, from which it can be created again with from_dict."""
+        return {'name': self.name, 'cost': self.cost, 'completion_time': self.completion_time,
+                'protection_level': self.protection_level, 'status': self.status,
+                'implementation_counter': self.implementation_counter,
+                'footprint': None if self.footprint is None else self.footprint.wkt}
+
+    @classmethod
+    def from_dict(cls, description):
+        """Create an instrument from a description that was made with to_dict."""
+        description = dict(description)
+        if description.get('footprint') is not None:
+            description['footprint'] = shapely.wkt.loads(description['footprint'])
+        return cls(**description)
 
 
     def impact_planning(self, structure, centralised_factor = 4, decentralised_factor = 4 ):
@@ -157,6 +175,19 @@ class OrganizationInstrument():
             self.status = 3
         # print("Status of ", self.name, ": ", self.status, "\n implementation counter: ", self.implementation_counter )
         return self.status
+
+    def get_completion_step(self, start_step):
+        """Returns the step at which an instrument that started implementing at start_step is implemented.
+        This is the step at which change_status would set the status to 'implemented'. An instrument with a 
+        completion time below 1 is never implemented, so None is returned."""
+        if self.completion_time < 1:
+            return None
+        return start_step + self.completion_time - self.implementation_counter + 1
+    
+    def complete(self, event = 'implementation'):
+        """Called by the event calendar when the implementation of the instrument is completed."""
+        self.implementation_counter = self.completion_time
+        self.status = 3
     
             
              
@@ -0,0 +1,178 @@
+"""
+Columnar store for the results of experiments, as Parquet files partitioned by experiment, parameter set and seed:
+    <root>/<table>/experiment=<name>/parameter_set=<id>/seed=<seed>/run-<run id>.parquet
+with a table 'model' for the model-level data and 'agents' for the agent-level data of every step.
+All parameters of every parameter set (including a description of the organisation instruments of options_list) are stored
+once in <root>/_parameter_sets/<id>.json, see experiments.describe_parameters.
+
+Queries only read the columns and files that are needed: the columns are projected, filters on the partitions (experiment,
+parameter set, seed) and on the parameters skip whole directories, and other filters are pushed down to the Parquet reader.
+
+Usage:
+    store = ResultsStore('results')
+    run_experiment(parameters, iterations=70, store=store, experiment='basecase')
+    df = store.query(columns=['total_adapted_households'], filter=ds.field('Step') == 120,
+                     parameters={'options_list': 'Dyke'}, with_parameters=['flood_probability'])
+"""
+import os
+import re
+import json
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from experiments import describe_parameters, get_parameter_set_id
+
+TABLES = ('model', 'agents')
+PARTITION_SCHEMA = pa.schema([('experiment', pa.string()), ('parameter_set', pa.string()), ('seed', pa.int64())])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor='hive')
+# columns that identify the run and the step, which keep their integer type; other numbers are stored as floats, so that the
+# schema of all files is the same (e.g. an average flood damage that is 0 in one run and a float in another)
+INDEX_COLUMNS = ('RunId', 'iteration', 'Step', 'AgentID')
+
+
+class ResultsStore():
+    """A partitioned Parquet store of experiment results, see the module docstring."""
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, '_parameter_sets'), exist_ok=True)
+
+    def write_run(self, experiment, result):
+        """Write the result of a run (see experiments.run_task) to the store. Returns the id of its parameter set."""
+        if not re.fullmatch(r'[\w.-]+', experiment):
+            raise ValueError(f"Invalid experiment name: '{experiment}'. Use letters, digits, '_', '.' and '-'")
+        description = describe_parameters(result['parameters'])
+        parameter_set = get_parameter_set_id(description)
+        self.write_parameter_set(parameter_set, description)
+        for table in TABLES:
+            data = result.get(table)
+            if data is None:
+                continue
+            data = data.reset_index()
+            data.insert(0, 'RunId', result['RunId'])
+            data.insert(1, 'iteration', result['iteration'])
+            directory = os.path.join(self.root, table, f'experiment={experiment}', f'parameter_set={parameter_set}',
+                                     f"seed={result['seed']}")
+            self.write_file(get_table(data), os.path.join(directory, f"run-{result['RunId']}.parquet"))
+        return parameter_set
+
+    def write_file(self, table, path):
+        """Write a Parquet file atomically, so a query never reads a partially written file."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the temporary file starts with '.', so it is ignored by queries
+        fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+        os.close(fd)
+        try:
+            pq.write_table(table, temporary_path)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def write_parameter_set(self, parameter_set, description):
+        path = os.path.join(self.root, '_parameter_sets', f'{parameter_set}.json')
+        if os.path.exists(path):
+            return
+        fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(description, f, sort_keys=True)
+        os.replace(temporary_path, path)
+
+    def parameter_sets(self):
+        """Returns a DataFrame with all parameters of every parameter set in the store, indexed by the parameter set id."""
+        directory = os.path.join(self.root, '_parameter_sets')
+        descriptions = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name)) as f:
+                    descriptions[name[:-len('.json')]] = json.load(f)
+        return pd.DataFrame.from_dict(descriptions, orient='index').rename_axis('parameter_set')
+
+    def select_parameter_sets(self, parameters):
+        """
+        Returns the ids of the parameter sets that match the given parameters: a dictionary of parameter names and values,
+        or functions of the value that return True for a match. For options_list, a name matches the parameter sets
+        with an instrument of that name.
+        """
+        selected = []
+        for parameter_set, description in self.parameter_sets().to_dict(orient='index').items():
+            if all(matches(name, description.get(name), value) for name, value in parameters.items()):
+                selected.append(parameter_set)
+        return selected
+
+    def get_dataset(self, table, partition_filter = None):
+        """Returns a dataset of the files of a table that match a filter on the partitions, or None if there are none."""
+        directory = os.path.join(self.root, table)
+        if not os.path.isdir(directory):
+            return None
+        dataset = ds.dataset(directory, format='parquet', partitioning=PARTITIONING)
+        fragments = list(dataset.get_fragments(filter=partition_filter) if partition_filter is not None else dataset.get_fragments())
+        if not fragments:
+            return None
+        # columns that are null in every row of a file (e.g. the decision of the government) get their type from the other files
+        schema = pa.unify_schemas([fragment.physical_schema for fragment in fragments] + [PARTITION_SCHEMA])
+        return ds.dataset([fragment.path for fragment in fragments], schema=schema, format='parquet',
+                          partitioning=PARTITIONING, partition_base_dir=directory)
+
+    def query(self, table = 'model', columns = None, filter = None, experiment = None, parameters = None, with_parameters = None):
+        """
+        Load results from the store as a DataFrame.
+
+        Parameters
+        ----------
+        table: 'model' or 'agents'
+        columns: columns that are loaded, None for all columns
+        filter: pyarrow dataset expression (e.g. ds.field('Step') == 120) or a list of (column, operator, value) tuples
+        experiment: name (or list of names) of the experiments that are loaded, None for all experiments
+        parameters: dictionary of parameters that the runs should have, see select_parameter_sets
+        with_parameters: names of parameters that are added as columns
+        """
+        if table not in TABLES:
+            raise ValueError(f"Unknown table: '{table}'. The tables are: {list(TABLES)}")
+        if isinstance(filter, list):
+            filter = pq.filters_to_expression(filter)
+        partition_filter = None
+        if experiment is not None:
+            experiments = [experiment] if isinstance(experiment, str) else list(experiment)
+            partition_filter = ds.field('experiment').isin(pa.array(experiments, pa.string()))
+        if parameters:
+            selected = ds.field('parameter_set').isin(pa.array(self.select_parameter_sets(parameters), pa.string()))
+            partition_filter = selected if partition_filter is None else partition_filter & selected
+        dataset = self.get_dataset(table, partition_filter)
+        if dataset is None:
+            return pd.DataFrame(columns=columns)
+        if partition_filter is not None:
+            filter = partition_filter if filter is None else filter & partition_filter
+        load_columns = columns
+        if with_parameters and columns is not None and 'parameter_set' not in columns:
+            load_columns = list(columns) + ['parameter_set']
+        df = dataset.to_table(columns=load_columns, filter=filter).to_pandas()
+        if with_parameters:
+            descriptions = self.parameter_sets()
+            for name in with_parameters:
+                values = descriptions[name].map(lambda value: json.dumps(value) if isinstance(value, (list, dict)) else value)
+                df[name] = df['parameter_set'].map(values)
+            if load_columns is not columns:
+                df = df.drop(columns='parameter_set')
+        return df
+
+
+def matches(name, value, condition):
+    """Returns True if the value of a parameter matches a condition (see ResultsStore.select_parameter_sets)."""
+    if callable(condition):
+        return condition(value)
+    if name == 'options_list' and isinstance(condition, str):
+        return value is not None and any(instrument['name'] == condition for instrument in value)
+    return value == condition
+
+
+def get_table(data):
+    """Convert a DataFrame to an Arrow table, with the numbers (other than the index columns) as floats."""
+    for column in data.columns:
+        if column in INDEX_COLUMNS:
+            continue
+        if pd.api.types.is_numeric_dtype(data[column]) and not pd.api.types.is_bool_dtype(data[column]):
+            data[column] = data[column].astype(float)
+    return pa.Table.from_pandas(data, preserve_index=False)
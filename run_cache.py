@@ -0,0 +1,140 @@
+"""
+A content-addressed cache of the results of runs on disk, so that runs that were done before (e.g. the base case that is run in
+several notebooks) are loaded instead of run again. A run is identified by a hash of:
+- all parameters of the AdaptationModel, completed with the defaults, with the specifications of the organisation instruments
+  of options_list (see experiments.describe_parameters);
+- the seed and the number of steps;
+- the contents of the flood map and of the model domain and floodplain shapefiles;
+- the source code of the model (the modules in MODEL_MODULES) and the version of mesa,
+so a changed input or a change in the model never loads an outdated result.
+When the files in the cache exceed max_bytes, the least recently used results are removed (like network.NetworkCache).
+
+Usage:
+    run_experiment(parameters, iterations=70, cache='run_cache')
+"""
+import os
+import sys
+import glob
+import json
+import pickle
+import hashlib
+import tempfile
+import mesa
+
+from experiments import describe_parameters
+from model import flood_map_paths
+from functions import shapefile_path, floodplain_path
+
+# modules of which the source code determines the results of a run
+MODEL_MODULES = ('model', 'agents', 'functions', 'rbb', 'scheduler', 'network', 'checkpoint')
+# hashes of files, by path, with the modification time and size at which they were computed
+file_hashes = {}
+
+
+def get_file_hash(path):
+    """Returns the sha256 hash of the contents of a file. Hashes are kept in memory until the file changes."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+        file_hashes[key] = digest.hexdigest()
+    return file_hashes[key]
+
+
+def get_source_hash():
+    """Returns a hash of the source code of the model and the version of mesa."""
+    digest = hashlib.sha256(mesa.__version__.encode())
+    for name in MODEL_MODULES:
+        digest.update(get_file_hash(sys.modules[name].__file__).encode())
+    return digest.hexdigest()
+
+
+def get_shapefile_hash(path):
+    """Returns a hash of all files of a shapefile (.shp, .shx, .dbf, .prj, ...)."""
+    digest = hashlib.sha256()
+    for part in sorted(glob.glob(os.path.splitext(path)[0] + '.*')):
+        digest.update(get_file_hash(part).encode())
+    return digest.hexdigest()
+
+
+class RunCache():
+    """A content-addressed cache of the results of runs (see experiments.run_task) on disk, see the module docstring."""
+    version = 1 # increase when the layout of the results changes, so that old results are not loaded anymore
+
+    def __init__(self, directory, max_bytes = 4 * 2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.source_hash = get_source_hash()
+
+    def key(self, kwargs, seed, max_steps):
+        """Returns the cache key of a run with the given parameters, seed and number of steps."""
+        description = describe_parameters(kwargs)
+        inputs = {'flood_map': get_file_hash(flood_map_paths[description['flood_map_choice']]),
+                  'domain': get_shapefile_hash(shapefile_path), 'floodplain': get_shapefile_hash(floodplain_path)}
+        description = {'version': self.version, 'parameters': description, 'seed': seed, 'max_steps': max_steps,
+                       'inputs': inputs, 'source': self.source_hash}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key, table = 'model'):
+        return os.path.join(self.directory, f'{key}.pkl' if table == 'model' else f'{key}-{table}.pkl')
+
+    def contains(self, key, agent_data = False):
+        """Returns True if the run is in the cache, with the agent-level data if agent_data is True."""
+        return os.path.exists(self.path(key)) and (not agent_data or os.path.exists(self.path(key, 'agents')))
+
+    def load(self, key, agent_data = False):
+        """
+        Returns the cached data of a run as a dictionary with 'model' and 'agents' DataFrames, or None if it is not in the
+        cache. The agent-level data is only loaded if agent_data is True, and the run is not returned if it was cached
+        without agent-level data.
+        """
+        data = {'model': None, 'agents': None}
+        for table in ('model', 'agents') if agent_data else ('model',):
+            path = self.path(key, table)
+            try:
+                with open(path, 'rb') as f:
+                    data[table] = pickle.load(f)
+            except (FileNotFoundError, OSError, EOFError, pickle.UnpicklingError):
+                return None
+            try:
+                os.utime(path) # mark the file as recently used
+            except FileNotFoundError:
+                pass # evicted by another process after it was read
+        return data
+
+    def save(self, key, result):
+        """Store the data of a run (a result of experiments.run_task) in the cache and evict old runs if the cache is too large."""
+        for table in ('model', 'agents'):
+            if result[table] is None:
+                continue
+            # write to a temporary file first, so that other processes never load a partially written run
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result[table], f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(key, table))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used runs until the cache is not larger than max_bytes."""
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,245 @@
+"""
+Schedulers that are used in model.py for the activation of the households and the government.
+Households are kept as an index range (0, ..., N-1) so that their state can be read from arrays,
+and the government is scheduled separately from the households.
+"""
+import heapq
+import itertools
+import numpy as np
+from mesa.time import BaseScheduler
+
+from agents import Households
+from network import DynamicGraph
+
+
+class EventCalendar():
+    """
+    A calendar of events keyed by the step at which they occur, kept as a binary heap.
+    It is used for the completion of household measures and organisation instruments, so that
+    these are only touched at the step at which their implementation completes instead of polled every step.
+    Every event has a target with a complete(event) method, which is called when the event is processed.
+    """
+    def __init__(self):
+        self.queue = [] # heap of (step, sequence number, target, event)
+        self.counter = itertools.count() # sequence number, so events at the same step are processed in the order they were scheduled
+        self.log = [] # processed events as (step, target, event)
+
+    def schedule(self, step, target, event):
+        """Schedule an event for a target at the given step."""
+        heapq.heappush(self.queue, (step, next(self.counter), target, event))
+
+    def process(self, step):
+        """Process all events that are due at (or before) the given step. Returns the number of processed events."""
+        processed = 0
+        while self.queue and self.queue[0][0] <= step:
+            event_step, _, target, event = heapq.heappop(self.queue)
+            target.complete(event)
+            self.log.append((step, getattr(target, 'unique_id', getattr(target, 'name', None)), event))
+            processed += 1
+        return processed
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class HouseholdActivation(BaseScheduler):
+    """
+    A scheduler that activates every household once per step, followed by the government.
+
+    The activation mode can be:
+    - 'random': households are activated in a permuted order that is drawn each step from the scheduler's
+      own random generator, so the order is reproducible for a given seed.
+    - 'simultaneous': households are activated in index order, but all of them read the adaptation motivation
+      of their neighbours from the previous step (double buffered), so the activation order does not matter.
+
+    If skip_dormant is True, only the active households run their full step. Dormant households, for which
+    choosing a measure can not change anything in this step, are advanced in bulk with array operations (see step_dormant).
+
+    The scheduler draws from its own NumPy random generator rng (a new unseeded generator if None), which the model spawns
+    from its seed independently of the other random streams of the model.
+    """
+    def __init__(self, model, mode = 'random', rng = None, skip_dormant = False):
+        super().__init__(model)
+        if mode not in ('random', 'simultaneous'):
+            raise ValueError(f"Unknown activation mode: '{mode}'. "
+                             f"Currently implemented activation modes are: 'random' and 'simultaneous'")
+        self.mode = mode
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.households = [] # households ordered by their index
+        self.government = None
+        self.previous_AM = np.zeros(0) # adaptation motivation of all households at the start of the step
+        self.skip_dormant = skip_dormant
+        self.active_fraction = 1.0 # fraction of the households that ran their full step in the last step
+        self.neighbor_indptr = None # social network of the households in CSR format, built on first use
+        self.neighbor_indices = None
+        self.neighbor_weights = None # weights of the ties (e.g. distance decay), aligned with neighbor_indices
+        self.calendar = EventCalendar() # completion of household measures and organisation instruments
+
+    def add(self, agent):
+        """Add an agent to the schedule. Households get the next index, any other agent is scheduled as the government."""
+        super().add(agent)
+        if isinstance(agent, Households):
+            agent.idx = len(self.households)
+            self.households.append(agent)
+        else:
+            self.government = agent
+
+    def get_activation_order(self):
+        """Returns the indices of the households in the order in which they are activated this step."""
+        if self.mode == 'random':
+            return self.rng.permutation(len(self.households))
+        return np.arange(len(self.households))
+
+    def get_neighbor_AM(self, neighbors):
+        """Returns the adaptation motivation of the given neighbours, as seen by a household during this step."""
+        if self.mode == 'simultaneous':
+            return self.previous_AM[[neighbor.idx for neighbor in neighbors]]
+        return [neighbor.AM for neighbor in neighbors]
+
+    def get_attribute(self, name, idx=None):
+        """Returns an array with the value of an attribute for all households, or for the households at the given indices."""
+        households = self.households if idx is None else [self.households[i] for i in idx]
+        return np.fromiter((getattr(household, name) for household in households), dtype=float, count=len(households))
+
+    def build_neighbor_index(self):
+        """Builds the social network of the households in CSR format, so that neighbour aggregates can be computed with arrays."""
+        G = self.model.G
+        if hasattr(G, 'to_csr'):
+            G = G.to_csr()
+        positions = np.array([household.pos for household in self.households])
+        if hasattr(G, 'indptr') and np.array_equal(positions, np.arange(len(self.households))):
+            # the network is already in CSR format with the households in node order
+            self.neighbor_indptr = G.indptr
+            self.neighbor_indices = G.indices
+            self.neighbor_weights = G.weights if G.weights is not None else np.ones(len(G.indices))
+            return
+        node_to_idx = {household.pos: household.idx for household in self.households}
+        indptr = [0]
+        indices = []
+        weights = []
+        for household in self.households:
+            neighbors = list(G.neighbors(household.pos))
+            indices.extend(node_to_idx[node] for node in neighbors)
+            weights.extend(self.model.get_neighbor_weights(household.pos, neighbors))
+            indptr.append(len(indices))
+        self.neighbor_indptr = np.array(indptr, dtype=np.int64)
+        self.neighbor_indices = np.array(indices, dtype=np.int64)
+        self.neighbor_weights = np.array(weights, dtype=float)
+
+    def get_dormant_mask(self):
+        """
+        Returns a boolean mask of the households for which choosing a measure is a no-op in this step.
+        A household is dormant if no flood occurred and either its AM is below the low threshold,
+        all its available measures are implemented or being implemented, or it can not afford any measure.
+        """
+        model = self.model
+        n = len(self.households)
+        if model.flood:
+            return np.zeros(n, dtype=bool)
+        elevation = self.get_attribute('elevation')
+        wet_proofing = self.get_attribute('wet_proofing')
+        dry_proofing = self.get_attribute('dry_proofing')
+        detached = self.get_attribute('detached')
+        low_AM = self.get_attribute('AM') < model.low_threshold
+        # measures that are being implemented are completed by the event calendar, so only measures that are not implemented matter
+        # elevation is only available for detached houses
+        all_implemented = (dry_proofing != 1) & (wet_proofing != 1) & ((elevation != 1) | (detached == 0))
+        no_budget = self.get_attribute('budget') < min(model.dry_proofing_cost, model.wet_proofing_cost, model.elevation_cost)
+        return low_AM | all_implemented | no_budget
+
+    def step_dormant(self, idx, AM):
+        """
+        Advance the dormant households at the given indices in bulk. This is equal to the household step without
+        choosing a measure: the memory of undergone measures is shifted, the AM attributes are updated without a flood
+        (threat appraisal decay, coping appraisal, preceding flood engagement and external influence from the given AM of
+        all households) and the income is added. Random draws are taken from the scheduler's random generator.
+        """
+        model = self.model
+        n = len(idx)
+        households = [self.households[i] for i in idx]
+        budget = self.get_attribute('budget', idx)
+
+        # threat appraisal decays if no flood occurs and can not be lower than 0
+        threat_appraisal = np.maximum(self.get_attribute('threat_appraisal', idx) - 0.01, 0)
+
+        # coping appraisal follows the budget and can not be higher than 1
+        coping_appraisal = self.get_attribute('coping_appraisal', idx)
+        coping_appraisal = np.where(budget >= model.upper_budget_threshold, 1.1 * coping_appraisal,
+                                    np.where(budget <= model.lower_budget_threshold, 0.9 * coping_appraisal, coping_appraisal))
+        coping_appraisal = np.minimum(coping_appraisal, 1)
+
+        # preceding flood engagement, see Households.update_preceding_flood_engagement
+        preceding_flood_engagement = self.get_attribute('preceding_flood_engagement', idx)
+        measures_taken = np.fromiter((np.mean(household.undergone_measures[1:] + [0]) for household in households), dtype=float, count=n) >= self.rng.random(n)
+        recent_flood = model.flood_recency >= self.rng.random(n)
+        if model.last_flood != 0:
+            measures_factor = np.where(recent_flood, 1.1, 1)
+        else:
+            measures_factor = np.full(n, 1.05)
+        preceding_flood_engagement = preceding_flood_engagement * np.where(measures_taken, measures_factor, np.where(recent_flood, 1.05, 0.9))
+
+        # external influence grows if the neighbours have a higher AM on average (weighted by distance decay, if used)
+        weighted = getattr(model, 'distance_decay', None) is not None
+        if isinstance(model.G, DynamicGraph):
+            # the ties of a dynamic network are changed in place, so the sums are taken over its tie slots (household i is node i)
+            neighbor_sums, counts = model.G.neighbor_sums(AM, weighted)
+        else:
+            if self.neighbor_indptr is None:
+                self.build_neighbor_index()
+            rows = np.repeat(np.arange(len(self.neighbor_indptr) - 1), np.diff(self.neighbor_indptr))
+            weights = self.neighbor_weights if weighted else np.ones(len(self.neighbor_indices))
+            neighbor_sums = np.bincount(rows, weights=AM[self.neighbor_indices] * weights, minlength=len(self.neighbor_indptr) - 1)
+            counts = np.bincount(rows, weights=weights, minlength=len(self.neighbor_indptr) - 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_neighbor_AM = (neighbor_sums / counts)[idx] # households without neighbours get nan, like np.mean of an empty list
+        external_influence = self.get_attribute('external_influence', idx)
+        external_influence = external_influence * np.where(AM[idx] < avg_neighbor_AM, 1.1, 0.9)
+
+        # the income depends on the economic circumstances
+        income_range = {'growth': (500, 700), 'recession': (0, 200), 'neutral': (200, 500)}.get(model.economic_status)
+        if income_range is not None:
+            budget = budget + self.rng.integers(income_range[0], income_range[1] + 1, size=n)
+
+        for i, household in enumerate(households):
+            household.is_adapted = False
+            if household.elevation == 1 and household.dry_proofing == 1 and household.wet_proofing == 1:
+                household.is_adapted_cumulatief = False
+            household.undergone_measures.pop(0)
+            household.undergone_measures.append(0)
+            household.threat_appraisal = threat_appraisal[i]
+            household.coping_appraisal = coping_appraisal[i]
+            household.preceding_flood_engagement = preceding_flood_engagement[i]
+            household.external_influence = external_influence[i]
+            household.budget = budget[i]
+            household.determine_AM()
+
+    def step_households(self):
+        """Activate every household once."""
+        if self.mode == 'simultaneous' or self.skip_dormant:
+            # store the adaptation motivation of the previous step, which is read by all households during this step
+            self.previous_AM = self.get_attribute('AM')
+        households = self.households
+        order = self.get_activation_order()
+        if self.skip_dormant:
+            dormant = self.get_dormant_mask()
+            self.active_fraction = 1 - dormant.mean() if len(dormant) else 1.0
+            order = order[~dormant[order]]
+            self.step_dormant(np.flatnonzero(dormant), self.previous_AM)
+        for i in order:
+            households[i].step()
+
+    def step_government(self):
+        """Activate the government, after all households have been activated."""
+        if self.government is not None:
+            self.government.step()
+
+    def step(self):
+        # complete the measures and instruments of which the implementation is finished in this step
+        with self.model.profile('calendar'):
+            self.calendar.process(self.steps)
+        with self.model.profile('households'):
+            self.step_households()
+        with self.model.profile('government'):
+            self.step_government()
+        self.steps += 1
+        self.time += 1
@@ -0,0 +1,119 @@
+"""
+Cost model of the runs of an experiment, to schedule the most expensive runs first.
+The time of a run mostly depends on the number of households, the number of steps, the density of the social network and
+the flood probability (a flood triggers the damage calculation of all households). The cost model estimates the time of a run
+from these features, with default coefficients at first, and with coefficients that are fitted (non-negative least squares)
+on the measured times of earlier runs as soon as there are enough of them. The history of measured times is kept in a JSON
+file, so the estimates improve over experiments.
+
+The runners (experiments.iter_runs, sweep.run_sweep) start the runs in order of decreasing estimated time, and every idle
+worker takes the next run from the shared queue. The long runs are started first and the short runs fill the gaps at the end,
+so all workers finish at about the same time instead of a few long runs at the end keeping one worker busy.
+"""
+import os
+import json
+import inspect
+import tempfile
+import numpy as np
+from scipy.optimize import nnls
+
+from model import AdaptationModel
+
+FEATURES = ('runs', 'households', 'household_steps', 'edge_steps', 'flood_household_steps')
+# seconds per unit of every feature, used until enough runs have been measured
+DEFAULT_COEFFICIENTS = (0.05, 2e-4, 2e-5, 2e-6, 2e-4)
+DEFAULTS = {name: parameter.default for name, parameter in inspect.signature(AdaptationModel.__init__).parameters.items()
+            if name != 'self'}
+
+
+def get_degree(kwargs):
+    """Returns the expected number of neighbours of a household in the social network of a run."""
+    network = kwargs['network']
+    if network == 'no_network':
+        return 0
+    if network == 'barabasi_albert':
+        return 2 * kwargs['number_of_edges']
+    return kwargs['number_of_nearest_neighbours']
+
+
+def get_features(kwargs, max_steps):
+    """Returns the features of the cost model (FEATURES) of a run with the given parameters and number of steps."""
+    kwargs = {**DEFAULTS, **kwargs}
+    households = kwargs['number_of_households']
+    steps = max_steps + 1 # the model is run until step max_steps
+    return np.array([1, households, households * steps, households * get_degree(kwargs) * steps,
+                     households * max(steps - 5, 0) * kwargs['flood_probability']], dtype=float) # floods occur from step 5
+
+
+class CostModel():
+    """
+    Estimates the time of a run from its parameters, see the module docstring.
+
+    Parameters
+    ----------
+    path: JSON file with the history of measured times, None to not keep the history
+    min_runs: number of measured runs from which the coefficients are fitted
+    max_history: maximum number of measured runs that are kept, the oldest runs are removed
+    """
+    def __init__(self, path = None, min_runs = 2 * len(FEATURES), max_history = 10000):
+        self.path = path
+        self.min_runs = min_runs
+        self.max_history = max_history
+        self.history = [] # features and measured time of every run
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.history = json.load(f)['history']
+        self.coefficients = np.array(DEFAULT_COEFFICIENTS)
+        self.fit()
+
+    def fit(self):
+        """Fit the coefficients on the measured runs, if there are enough of them."""
+        if len(self.history) < self.min_runs:
+            return
+        data = np.array(self.history, dtype=float)
+        coefficients, _ = nnls(data[:, :-1], data[:, -1])
+        if coefficients.any():
+            self.coefficients = coefficients
+
+    def estimate(self, kwargs, max_steps):
+        """Returns the estimated time of a run in seconds."""
+        return float(get_features(kwargs, max_steps) @ self.coefficients)
+
+    def record(self, kwargs, max_steps, duration):
+        """Add the measured time of a run to the history. The coefficients are fitted again by fit or save."""
+        self.history.append(get_features(kwargs, max_steps).tolist() + [duration])
+        del self.history[:-self.max_history]
+
+    def save(self):
+        """Fit the coefficients and write the history to the JSON file."""
+        self.fit()
+        if self.path is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'features': FEATURES, 'coefficients': self.coefficients.tolist(), 'history': self.history}, f)
+        os.replace(tmp_path, self.path)
+
+    def schedule(self, tasks, max_steps):
+        """Returns the tasks (see experiments.make_tasks) in order of decreasing estimated time."""
+        return sorted(tasks, key=lambda task: self.estimate(task[3], max_steps), reverse=True)
+
+    def make_chunks(self, tasks, max_steps, number_processes, max_chunksize = None):
+        """
+        Returns the tasks in order of decreasing estimated time, in chunks that are sent to a worker at once. Long runs are sent
+        on their own, short runs are combined into chunks of about 1/(4 * number_processes) of the total estimated time,
+        which reduces the overhead of short runs without leaving a large chunk for the end.
+        """
+        estimates = [self.estimate(task[3], max_steps) for task in tasks]
+        target = sum(estimates) / (4 * number_processes)
+        chunks, chunk, chunk_cost = [], [], 0
+        for estimate, task in sorted(zip(estimates, tasks), key=lambda item: item[0], reverse=True):
+            chunk.append(task)
+            chunk_cost += estimate
+            if chunk_cost >= target or (max_chunksize is not None and len(chunk) >= max_chunksize):
+                chunks.append(chunk)
+                chunk, chunk_cost = [], 0
+        if chunk:
+            chunks.append(chunk)
+        return chunks
@@ -0,0 +1,235 @@
+"""
+Fault-tolerant, resumable execution of large experiments (sweeps) of the AdaptationModel.
+Every run is executed in its own worker process, so a run that raises an error, crashes the interpreter or hangs does not
+affect the other runs: it is retried (up to a number of retries), and a run that takes longer than the timeout is stopped.
+When a run of a parameter set keeps failing, the other runs of that parameter set are skipped, so a bad parameter
+combination does not take the time of the whole sweep.
+
+The state of every run is appended to a manifest in the directory of the sweep (manifest.jsonl), and the result of every
+completed run is written to that directory as soon as it is completed. When a sweep is interrupted (a crash or a kernel
+restart), calling run_sweep again with the same arguments resumes it: completed runs are never run again.
+
+Usage:
+    runs = run_sweep({'number_of_households': 100, 'flood_probability': [0.05, 0.1]}, 'sweeps/flood_probability',
+                     iterations=70, timeout=600, retries=1)
+    model_data = {result['RunId']: result['model'] for result in load_results('sweeps/flood_probability')}
+"""
+import os
+import json
+import time
+import pickle
+import tempfile
+import traceback
+import collections
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import pandas as pd
+
+from experiments import make_tasks, preload_inputs, run_task, describe_parameters, get_parameter_set_id
+
+# states of a run in the manifest
+PENDING, RUNNING, DONE, RETRY, FAILED, SKIPPED = 'pending', 'running', 'done', 'retry', 'failed', 'skipped'
+
+
+class SweepManifest():
+    """
+    Persistent state of the runs of a sweep: a file with a JSON record per line. The first record describes the sweep, every
+    other record is a change of the state of a run. Records are only appended, so an interrupted sweep loses at most the
+    record that was being written.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.runs = {} # latest record of every run, by run id
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # a record that was not completely written
+                    if 'sweep' in record:
+                        self.header = record['sweep']
+                    else:
+                        self.runs[record['RunId']] = record
+
+    def check(self, sweep):
+        """Write the description of a new sweep, or check that a sweep that is resumed has the same description."""
+        if self.header is None:
+            self.header = sweep
+            self.append({'sweep': sweep})
+        elif self.header != sweep:
+            raise ValueError(f"The sweep in '{self.path}' has different parameters, iterations, seed or max_steps. "
+                             f"Use a new directory for a new sweep")
+
+    def append(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def update(self, run_id, status, **values):
+        record = {**self.runs.get(run_id, {}), 'RunId': run_id, 'status': status, 'time': time.time(), **values}
+        self.runs[run_id] = record
+        self.append(record)
+
+    def status(self, run_id):
+        return self.runs.get(run_id, {}).get('status', PENDING)
+
+    def to_dataframe(self):
+        return pd.DataFrame(list(self.runs.values())).sort_values('RunId').reset_index(drop=True)
+
+
+def run_in_process(task, max_steps, agent_data, connection):
+    """Run a run in a worker process, and send ('ok', result) or ('error', traceback) to the parent process."""
+    try:
+        message = ('ok', run_task(task, max_steps, agent_data))
+    except BaseException:
+        message = ('error', traceback.format_exc())
+    connection.send(message)
+    connection.close()
+
+
+def get_result_path(directory, run_id):
+    return os.path.join(directory, 'results', f'run-{run_id}.pkl')
+
+
+def save_result(directory, result):
+    """Write the result of a run to the directory of the sweep, atomically, so a partially written result is never loaded."""
+    path = get_result_path(directory, result['RunId'])
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_results(directory):
+    """Yield the results (see experiments.run_task) of the completed runs of a sweep, in the order of the run ids."""
+    manifest = SweepManifest(os.path.join(directory, 'manifest.jsonl'))
+    for run_id in sorted(manifest.runs):
+        if manifest.status(run_id) == DONE:
+            with open(get_result_path(directory, run_id), 'rb') as f:
+                yield pickle.load(f)
+
+
+def run_sweep(parameters, directory, iterations = 1, max_steps = 120, number_processes = None, seed = 0, timeout = None,
+              retries = 1, skip_failed_parameter_sets = True, retry_failed = False, agent_data = False, store = None,
+              experiment = 'default', cost_model = None):
+    """
+    Run a sweep, or resume an interrupted sweep in the same directory. See the module docstring.
+
+    Parameters
+    ----------
+    parameters, iterations, max_steps, number_processes, seed: see experiments.iter_runs
+    directory: directory of the sweep, with the manifest and the results of the completed runs
+    timeout: maximum time of a run in seconds, None for no maximum
+    retries: number of times a run is run again after it failed (an error, a crash or a timeout)
+    skip_failed_parameter_sets: if True, the remaining runs of a parameter set are skipped when one of its runs failed
+    retry_failed: if True, runs that failed or were skipped in an earlier call are run again when the sweep is resumed
+    agent_data: if True, the agent-level data is also collected
+    store, experiment: ResultsStore (see results_store.py) to which the result of every run is also written, and the name of the
+                       experiment in the store
+    cost_model: CostModel (see scheduling.py). If given, the runs are started in order of decreasing estimated time, and
+                the measured times are added to the history of the cost model
+
+    Returns
+    -------
+    runs: DataFrame with the latest state of every run in the manifest: the status ('done', 'failed' or 'skipped'), the number
+          of attempts, the duration of the last attempt and the error of the last failed attempt
+    """
+    os.makedirs(os.path.join(directory, 'results'), exist_ok=True)
+    tasks = make_tasks(parameters, iterations, seed)
+    parameter_sets = {task[0]: get_parameter_set_id(describe_parameters(task[3])) for task in tasks}
+    manifest = SweepManifest(os.path.join(directory, 'manifest.jsonl'))
+    manifest.check({'runs': [[task[0], task[1], task[2], parameter_sets[task[0]]] for task in tasks], 'max_steps': max_steps,
+                    'agent_data': agent_data})
+
+    for task in tasks:
+        # a run of which the result was written just before the sweep was interrupted
+        if manifest.status(task[0]) != DONE and os.path.exists(get_result_path(directory, task[0])):
+            manifest.update(task[0], DONE, error=None)
+    finished = (DONE,) if retry_failed else (DONE, FAILED, SKIPPED)
+    todo = collections.deque(task for task in tasks if manifest.status(task[0]) not in finished)
+    # parameter sets with a run that failed in an earlier call, unless the failed runs are run again
+    failed_parameter_sets = set() if retry_failed else {parameter_sets[task[0]] for task in tasks if manifest.status(task[0]) == FAILED}
+    for task in todo:
+        if manifest.status(task[0]) in (FAILED, SKIPPED):
+            manifest.runs[task[0]].pop('attempts', None) # failed runs that are run again get all their retries again
+        elif manifest.status(task[0]) == RUNNING:
+            manifest.runs[task[0]]['attempts'] -= 1 # the run was interrupted, which is not a failed attempt
+    if not todo:
+        return manifest.to_dataframe()
+    if cost_model is not None:
+        todo = collections.deque(cost_model.schedule(todo, max_steps))
+
+    preload_inputs(parameters)
+    number_processes = number_processes or os.cpu_count()
+    context = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+    running = {} # connection -> (task, process, start time)
+    try:
+        while todo or running:
+            # start runs until all workers are busy
+            while todo and len(running) < number_processes:
+                task = todo.popleft()
+                run_id, iteration, run_seed, kwargs = task
+                if skip_failed_parameter_sets and parameter_sets[run_id] in failed_parameter_sets:
+                    manifest.update(run_id, SKIPPED, error=f'a run of parameter set {parameter_sets[run_id]} failed')
+                    continue
+                attempts = manifest.runs.get(run_id, {}).get('attempts', 0) + 1
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=run_in_process, args=(task, max_steps, agent_data, sender), daemon=True)
+                process.start()
+                sender.close() # so the receiver gets an EOF when the worker dies without sending a result
+                running[receiver] = (task, process, time.time())
+                manifest.update(run_id, RUNNING, iteration=iteration, seed=run_seed, parameter_set=parameter_sets[run_id],
+                                attempts=attempts)
+
+            if not running:
+                continue # the remaining runs were skipped
+
+            # wait until a run is completed or the first timeout
+            wait_time = None
+            if timeout is not None:
+                wait_time = max(min(start for _, _, start in running.values()) + timeout - time.time(), 0)
+            ready = wait(list(running), wait_time)
+
+            now = time.time()
+            for receiver, (task, process, start) in list(running.items()):
+                run_id = task[0]
+                if receiver in ready:
+                    try:
+                        status, message = receiver.recv()
+                    except EOFError:
+                        process.join()
+                        status, message = 'error', f'the worker process stopped with exit code {process.exitcode}'
+                elif timeout is not None and now - start >= timeout:
+                    process.terminate()
+                    status, message = 'error', f'timeout after {timeout} s'
+                else:
+                    continue
+                del running[receiver]
+                receiver.close()
+                process.join()
+                duration = now - start
+                if status == 'ok':
+                    save_result(directory, message)
+                    if store is not None:
+                        store.write_run(experiment, message)
+                    manifest.update(run_id, DONE, duration=duration, error=None)
+                    if cost_model is not None:
+                        cost_model.record(task[3], max_steps, message['duration'])
+                elif manifest.runs[run_id]['attempts'] <= retries:
+                    manifest.update(run_id, RETRY, duration=duration, error=message)
+                    todo.append(task) # at the end, so that a failing run does not hold up the other runs
+                else:
+                    manifest.update(run_id, FAILED, duration=duration, error=message)
+                    failed_parameter_sets.add(parameter_sets[run_id])
+    finally:
+        # the sweep was interrupted: stop the workers, their runs are run again when the sweep is resumed
+        for receiver, (task, process, start) in running.items():
+            process.terminate()
+            process.join()
+            manifest.update(task[0], PENDING, attempts=manifest.runs[task[0]]['attempts'] - 1)
+        if cost_model is not None:
+            cost_model.save()
+    return manifest.to_dataframe()
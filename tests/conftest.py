@@ -0,0 +1,21 @@
+"""
+Shared fixtures of the tests. The models run on the small synthetic inputs of the benchmarks (see benchmarks/fixtures.py),
+which need geopandas and rasterio.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+
+@pytest.fixture(scope='session')
+def model_inputs(tmp_path_factory):
+    """Makes the models read the synthetic inputs, and restores the working directory afterwards."""
+    pytest.importorskip('geopandas')
+    pytest.importorskip('rasterio')
+    from fixtures import use_fixtures
+    directory = os.getcwd()
+    use_fixtures(str(tmp_path_factory.mktemp('fixtures')))
+    yield
+    os.chdir(directory)
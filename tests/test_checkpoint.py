@@ -0,0 +1,63 @@
+"""
+Tests of the checkpoints of the AdaptationModel (model.save_checkpoint and model.load_checkpoint, see checkpoint.py).
+"""
+import pytest
+import numpy as np
+import pandas as pd
+
+
+@pytest.fixture(scope='module')
+def model_class(model_inputs):
+    from model import AdaptationModel
+    return AdaptationModel
+
+
+@pytest.mark.parametrize('parameters', [{'network_backend': 'networkx'},
+                                        {'network_backend': 'csr', 'network_dynamics': 'both'}])
+def test_restored_run_continues(model_class, tmp_path, parameters):
+    model = model_class(seed=3, number_of_households=30, flood_probability=0.3, **parameters)
+    for i in range(8):
+        model.step()
+    model.save_checkpoint(tmp_path / 'checkpoint')
+    restored = model_class.load_checkpoint(tmp_path / 'checkpoint')
+    version = getattr(model.G, 'version', None)
+    # the model that was checkpointed continues without interruption, the restored model must do exactly the same
+    for i in range(12):
+        model.step()
+        restored.step()
+    if parameters.get('network_dynamics') is not None:
+        assert model.G.version != version # ties changed after the checkpoint
+    expected = model.datacollector.get_model_vars_dataframe()
+    assert expected['Flood'].any()
+    pd.testing.assert_frame_equal(restored.datacollector.get_model_vars_dataframe(), expected)
+    pd.testing.assert_frame_equal(restored.datacollector.get_agent_vars_dataframe(),
+                                  model.datacollector.get_agent_vars_dataframe())
+    assert restored.schedule.calendar.log == model.schedule.calendar.log
+    if parameters.get('network_dynamics') is None:
+        assert sorted(restored.G.edges()) == sorted(model.G.edges())
+    else:
+        # the ties that were changed by the network dynamics
+        ties, restored_ties = model.G.to_csr(), restored.G.to_csr()
+        np.testing.assert_array_equal(restored_ties.indptr, ties.indptr)
+        np.testing.assert_array_equal(restored_ties.indices, ties.indices)
+
+
+def test_checkpoint_while_profiling(model_class, tmp_path):
+    from profiling import StepProfiler
+    model = model_class(seed=3, number_of_households=10)
+    profiler = StepProfiler()
+    profiler.attach(model)
+    for i in range(3):
+        model.step()
+    model.save_checkpoint(tmp_path / 'checkpoint')
+    restored = model_class.load_checkpoint(tmp_path / 'checkpoint')
+    # the call counters are not restored, the households use the methods of their class again
+    assert restored.profiler is None
+    assert all(not any(name in vars(household) for name in profiler.wrapped[model.households[0]])
+               for household in restored.households)
+    profiler.detach()
+    for i in range(3):
+        model.step()
+        restored.step()
+    pd.testing.assert_frame_equal(restored.datacollector.get_model_vars_dataframe(),
+                                  model.datacollector.get_model_vars_dataframe())
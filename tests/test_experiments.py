@@ -0,0 +1,57 @@
+"""
+Tests of the experiment runner (experiments.py) with a run cache.
+"""
+import pytest
+import pandas as pd
+
+PARAMETERS = {'number_of_households': 10}
+
+
+@pytest.fixture(scope='module')
+def experiments(model_inputs):
+    import experiments
+    return experiments
+
+
+class MemoryCache():
+    """A run cache in memory (see run_cache.RunCache) with the given runs, keyed by the seed of the run."""
+    def __init__(self, runs = None):
+        self.runs = dict(runs or {})
+
+    def key(self, kwargs, seed, max_steps):
+        return seed
+
+    def contains(self, key, agent_data = False):
+        return key in self.runs
+
+    def load(self, key, agent_data = False):
+        return {'model': self.runs[key].copy(), 'agents': None} if key in self.runs else None
+
+    def save(self, key, result):
+        self.runs[key] = result['model']
+
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_all_runs_cached(experiments, ordered):
+    tasks = experiments.make_tasks(PARAMETERS, 4)
+    cache = MemoryCache({task[2]: pd.DataFrame({'RunId': [task[0]]}) for task in tasks})
+    results = list(experiments.iter_runs(PARAMETERS, iterations=4, max_steps=2, number_processes=1, ordered=ordered,
+                                         cache=cache))
+    run_ids = [result['RunId'] for result in results]
+    assert sorted(run_ids) == [0, 1, 2, 3]
+    if ordered:
+        assert run_ids == [0, 1, 2, 3]
+    assert all(result['model']['RunId'].iloc[0] == result['RunId'] for result in results)
+
+
+def test_ordered_with_cache(experiments):
+    expected = {result['RunId']: result for result in experiments.iter_runs(PARAMETERS, iterations=6, max_steps=2,
+                                                                            number_processes=1)}
+    # the first and the last runs are cached, so cached runs are yielded before and after the runs that are run
+    cache = MemoryCache({expected[run_id]['seed']: expected[run_id]['model'] for run_id in (0, 4, 5)})
+    results = list(experiments.iter_runs(PARAMETERS, iterations=6, max_steps=2, number_processes=2, ordered=True,
+                                         cache=cache))
+    assert [result['RunId'] for result in results] == list(range(6))
+    for result in results:
+        pd.testing.assert_frame_equal(result['model'], expected[result['RunId']]['model'])
+    assert len(cache.runs) == 6
@@ -0,0 +1,26 @@
+"""
+Tests of the AdaptationModel (model.py).
+"""
+import pytest
+import numpy as np
+
+
+@pytest.fixture(scope='module')
+def model_class(model_inputs):
+    from model import AdaptationModel
+    return AdaptationModel
+
+
+@pytest.mark.parametrize('seed', [5, None])
+def test_independent_random_streams(model_class, seed):
+    from model import get_entropy
+    model = model_class(seed=seed, number_of_households=10)
+    # the streams of the scheduler and the network dynamics are spawned from the seed of the model, and differ
+    assert model.seed_sequence.entropy == get_entropy(model._seed)
+    assert not np.array_equal(model.schedule.rng.random(4), model.network_rng.random(4))
+
+
+def test_random_streams_reproducible(model_class):
+    model, other = (model_class(seed=5, number_of_households=10) for i in range(2))
+    assert np.array_equal(model.schedule.rng.random(4), other.schedule.rng.random(4))
+    assert np.array_equal(model.network_rng.random(4), other.network_rng.random(4))
@@ -0,0 +1,28 @@
+"""
+Tests of the partitioned stepping of a model (parallel.py).
+"""
+import pytest
+
+
+@pytest.fixture(scope='module')
+def model_class(model_inputs):
+    from model import AdaptationModel
+    return AdaptationModel
+
+
+def test_household_events_not_fired_twice(model_class):
+    from agents import Households
+    from parallel import PartitionedRun
+    model = model_class(seed=2, number_of_households=60, flood_probability=0.5)
+    calendar = model.schedule.calendar
+    # step until measures of households are being implemented
+    while not any(isinstance(target, Households) for _, _, target, _ in calendar.queue):
+        model.step()
+    log = list(calendar.log)
+    with PartitionedRun(model, number_of_partitions=2) as run:
+        # the completion of household measures is done by the workers, the calendar only completes the instruments
+        run.run(3)
+        assert not any(isinstance(target, Households) for _, _, target, _ in calendar.queue)
+        assert calendar.log == log
+    # the measures that are still being implemented are scheduled again when the run is closed
+    assert all(step >= model.schedule.steps for step, _, target, _ in calendar.queue if isinstance(target, Households))
@@ -0,0 +1,30 @@
+"""
+Tests of the schedulers (scheduler.py).
+"""
+import pytest
+
+
+@pytest.fixture(scope='module')
+def model_class(model_inputs):
+    from model import AdaptationModel
+    return AdaptationModel
+
+
+@pytest.mark.parametrize('implementation_time', [0, 1, 3])
+def test_measure_completion(model_class, implementation_time):
+    model = model_class(seed=1, number_of_households=10, flood_probability=0)
+    for i in range(2):
+        model.step()
+    # a household starts implementing dry-proofing at step s
+    start = model.schedule.steps
+    household = model.households[0]
+    household.dry_proofing = 2
+    household.schedule_completion('dry_proofing', implementation_time)
+    completed = None
+    for i in range(6):
+        step = model.schedule.steps
+        model.step()
+        if completed is None and household.dry_proofing == 3:
+            completed = step
+    assert completed == start + max(implementation_time, 1)
+    assert (completed, household.unique_id, 'dry_proofing') in model.schedule.calendar.log
@@ -0,0 +1,60 @@
+"""
+Tests of the work queue (workqueue.py) with a coordinator and workers in local processes.
+"""
+import os
+import signal
+import socket
+import multiprocessing as mp
+import pytest
+
+PARAMETERS = {'number_of_households': 10}
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, 'SIGSTOP') or 'fork' not in mp.get_all_start_methods(),
+                                reason='the workers are stalled with SIGSTOP, and inherit the failing runs with fork')
+
+
+@pytest.fixture(scope='module')
+def workqueue(model_inputs):
+    import workqueue
+    return workqueue
+
+
+def test_stalled_and_failing_workers(workqueue, tmp_path, monkeypatch):
+    from results_store import ResultsStore
+    run_task = workqueue.run_task
+    stalled = tmp_path / 'stalled'
+
+    def stall_or_fail(task, max_steps, agent_data):
+        if task[0] == 3:
+            raise RuntimeError('run 3 always fails')
+        try:
+            # the first worker that gets a run stops itself (also its heartbeats), so its lease expires
+            with open(stalled, 'x') as f:
+                f.write(f'{task[0]} {os.getpid()}')
+            os.kill(os.getpid(), signal.SIGSTOP)
+        except FileExistsError:
+            pass
+        return run_task(task, max_steps, agent_data)
+
+    # the forked workers inherit the failing runs
+    monkeypatch.setattr(workqueue, 'run_task', stall_or_fail)
+    coordinator = workqueue.Coordinator(PARAMETERS, ResultsStore(str(tmp_path / 'store')), iterations=4, max_steps=2,
+                                        lease_time=1, max_attempts=2)
+    workers = workqueue.start_local_workers(coordinator.address, coordinator.authkey, 3)
+    try:
+        runs = coordinator.run().set_index('RunId')
+    finally:
+        for process in workers:
+            process.kill()
+            process.join()
+
+    stalled_run, pid = map(int, stalled.read_text().split())
+    # the stalled run was handed out again, and completed by another worker
+    assert runs.loc[stalled_run, 'status'] == 'done'
+    assert runs.loc[stalled_run, 'attempts'] == 2
+    assert runs.loc[stalled_run, 'worker'] != f'{socket.gethostname()}-{pid}'
+    # the failing run was handed out max_attempts times
+    assert runs.loc[3, 'status'] == 'failed'
+    assert runs.loc[3, 'attempts'] == 2
+    assert 'run 3 always fails' in runs.loc[3, 'error']
+    assert (runs.drop(index=3)['status'] == 'done').all()
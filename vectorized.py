@@ -0,0 +1,313 @@
+"""
+Array version of the household behaviour in agents.py, used to step many households at once (see parallel.py and ensemble.py).
+The state of all households is kept in a dictionary of NumPy arrays (one entry per household), which can be exported from
+and imported into the Households agents of a model. The step follows Households.step with simultaneous activation:
+all households read the adaptation motivation of their neighbours from the previous step.
+"""
+import numpy as np
+
+# attributes of the Households agents that are kept as arrays, with their data type
+HOUSEHOLD_ARRAYS = {
+    'background': np.float64,
+    'threat_appraisal': np.float64,
+    'coping_appraisal': np.float64,
+    'climate_related_beliefs': np.float64,
+    'preceding_flood_engagement': np.float64,
+    'external_influence': np.float64,
+    'AM': np.float64,
+    'budget': np.float64,
+    'financial_loss': np.float64,
+    'detached': np.int8,
+    'elevation': np.int8,
+    'wet_proofing': np.int8,
+    'dry_proofing': np.int8,
+    'is_adapted': np.bool_,
+    'is_adapted_cumulatief': np.bool_,
+    'in_floodplain': np.bool_,
+    'is_protected': np.bool_,
+    'flood_depth_estimated': np.float64,
+    'flood_depth_actual': np.float64,
+    'flood_damage_actual': np.float64,
+}
+MEASURES = ['elevation', 'wet_proofing', 'dry_proofing']
+MEMORY_LENGTH = 8 # number of steps that a household remembers its undergone measures
+INCOME_RANGES = {'growth': (500, 700), 'recession': (0, 200), 'neutral': (200, 500)}
+
+
+def get_state_layout(number_of_households):
+    """Returns the shape and data type of every array of the household state."""
+    layout = {name: ((number_of_households,), dtype) for name, dtype in HOUSEHOLD_ARRAYS.items()}
+    layout['undergone_measures'] = ((number_of_households, MEMORY_LENGTH), np.int8)
+    # step at which a measure that is being implemented is completed, -1 if no measure is being implemented
+    for measure in MEASURES:
+        layout[f'{measure}_completion'] = ((number_of_households,), np.int64)
+    return layout
+
+
+def get_household_parameters(model):
+    """Returns the model parameters that are used by the households."""
+    names = ['intention_action_gap', 'low_threshold', 'medium_threshold', 'high_threshold',
+             'upper_budget_threshold', 'lower_budget_threshold', 'max_damage_costs', 'economic_status']
+    for measure in MEASURES:
+        names += [f'{measure}_time', f'{measure}_cost', f'{measure}_effectiveness']
+    names += ['elevation_protection', 'wet_proofing_protection', 'dry_proofing_protection']
+    parameters = {name: getattr(model, name) for name in names}
+    parameters['use_weights'] = getattr(model, 'distance_decay', None) is not None
+    return parameters
+
+
+def export_household_state(model, state=None):
+    """
+    Copy the state of the households of a model (in the order of model.households) into arrays.
+    If state is given, the arrays are filled in place (e.g. arrays in shared memory).
+    Measures that are being implemented are taken from the event calendar of the scheduler.
+    """
+    households = model.households
+    n = len(households)
+    if state is None:
+        state = {name: np.zeros(shape, dtype) for name, (shape, dtype) in get_state_layout(n).items()}
+    for name in HOUSEHOLD_ARRAYS:
+        state[name][:] = [getattr(household, name) for household in households]
+    state['undergone_measures'][:] = [household.undergone_measures for household in households]
+    for measure in MEASURES:
+        state[f'{measure}_completion'][:] = -1
+    position = {id(household): i for i, household in enumerate(households)}
+    for step, _, target, event in model.schedule.calendar.queue:
+        if id(target) in position:
+            state[f'{event}_completion'][position[id(target)]] = step
+    return state
+
+
+def import_household_state(model, state):
+    """
+    Copy the arrays of the household state back into the households of a model (in the order of model.households).
+    The completion of measures that are being implemented is scheduled again in the event calendar of the scheduler.
+    """
+    households = model.households
+    for name, dtype in HOUSEHOLD_ARRAYS.items():
+        values = state[name].tolist()
+        for household, value in zip(households, values):
+            setattr(household, name, value)
+    for household, memory in zip(households, state['undergone_measures'].tolist()):
+        household.undergone_measures = memory
+    # replace the household events in the calendar by the completion steps in the arrays
+    calendar = model.schedule.calendar
+    position = {id(household): i for i, household in enumerate(households)}
+    instrument_events = [(step, target, event) for step, _, target, event in calendar.queue if id(target) not in position]
+    calendar.queue.clear()
+    for step, target, event in instrument_events:
+        calendar.schedule(step, target, event)
+    for measure in MEASURES:
+        for i in np.flatnonzero(state[f'{measure}_completion'] >= 0):
+            calendar.schedule(int(state[f'{measure}_completion'][i]), households[i], measure)
+
+
+def get_generator(rng, idx):
+    """
+    Returns the random generator from which the values for the households at the given indices (in increasing order) are drawn:
+    rng itself, or for an ensemble of replications (see ensemble.py) a generator that draws the values of every replication
+    from the random stream of that replication.
+    """
+    return rng.at(idx) if hasattr(rng, 'at') else rng
+
+
+def calculate_flood_damage(flood_depth):
+    """Array version of functions.calculate_basic_flood_damage."""
+    flood_depth = np.asarray(flood_depth, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        damage = 0.1746 * np.log(flood_depth) + 0.6483
+    return np.where(flood_depth >= 6, 1.0, np.where(flood_depth < 0.025, 0.0, damage))
+
+
+def determine_AM(state, idx):
+    """Array version of Households.determine_AM for the households at the given indices."""
+    AM = (state['background'][idx] + state['threat_appraisal'][idx] + state['coping_appraisal'][idx]
+          + state['climate_related_beliefs'][idx] + state['preceding_flood_engagement'][idx] + state['external_influence'][idx]) / 6
+    AM = np.clip(AM, 0, 1)
+    state['AM'][idx] = AM
+    return AM
+
+
+def complete_measures(state, idx, step):
+    """Complete the measures of which the implementation is finished at this step, like the event calendar does."""
+    for measure in MEASURES:
+        completion = state[f'{measure}_completion'][idx]
+        done = idx[(completion >= 0) & (completion <= step)]
+        state[measure][done] = 3
+        state[f'{measure}_completion'][done] = -1
+
+
+def flood_households(state, idx, parameters, rng):
+    """
+    Array version of the flood in AdaptationModel.step for the households at the given indices:
+    unprotected households in the floodplain get an actual flood depth and damage, reduced by their implemented measures.
+
+    Returns
+    -------
+    total_damage, number_flooded: sum of the flood damage factors and number of flooded households
+    """
+    idx = idx[state['in_floodplain'][idx] & ~state['is_protected'][idx]]
+    if len(idx) == 0:
+        return 0.0, 0
+    p = parameters
+    depth = get_generator(rng, idx).uniform(0.5, 1.2, size=len(idx)) * state['flood_depth_estimated'][idx]
+    damage = calculate_flood_damage(depth)
+    elevation = state['elevation'][idx]
+    wet_proofing = state['wet_proofing'][idx]
+    dry_proofing = state['dry_proofing'][idx]
+
+    # elevation protects if the flood is not deeper than its protection level, otherwise it is destroyed
+    elevated = elevation == 3
+    damage = np.where(elevated & (depth <= p['elevation_protection']), damage * (1 - p['elevation_effectiveness']), damage)
+    elevation = np.where(elevated & (depth > p['elevation_protection']), 1, elevation)
+
+    both = (dry_proofing == 3) & (wet_proofing == 3)
+    dry_only = (dry_proofing == 3) & ~both
+    wet_only = (wet_proofing == 3) & ~both
+    dry_holds = depth <= p['dry_proofing_protection']
+    wet_holds = depth <= p['wet_proofing_protection']
+    dry_factor = 1 - p['dry_proofing_effectiveness']
+    wet_factor = 1 - p['wet_proofing_effectiveness']
+    # wet and dry proofing together, see Households.check_wet_and_dry_proofing_protection
+    damage = np.where(both & dry_holds, damage * dry_factor * wet_factor,
+                      np.where(both & ~dry_holds & wet_holds, damage * wet_factor, damage))
+    dry_proofing = np.where(both & ~dry_holds, 1, dry_proofing)
+    wet_proofing = np.where(both & ~dry_holds & ~wet_holds, 1, wet_proofing)
+    # only dry proofing or only wet proofing
+    damage = np.where(dry_only & dry_holds, damage * dry_factor, damage)
+    dry_proofing = np.where(dry_only & ~dry_holds, 1, dry_proofing)
+    damage = np.where(wet_only & wet_holds, damage * wet_factor, damage)
+    wet_proofing = np.where(wet_only & ~wet_holds, 1, wet_proofing)
+
+    state['flood_depth_actual'][idx] = depth
+    state['flood_damage_actual'][idx] = damage
+    state['elevation'][idx] = elevation
+    state['wet_proofing'][idx] = wet_proofing
+    state['dry_proofing'][idx] = dry_proofing
+    damage_costs = p['max_damage_costs'] * damage
+    state['budget'][idx] -= damage_costs
+    state['financial_loss'][idx] += damage_costs
+    return float(damage.sum()), len(idx)
+
+
+def check_measure(state, idx, measure, parameters, step, rng):
+    """Array version of Households.check_elevation, check_wet_proofing and check_dry_proofing for the households at the given indices."""
+    p = parameters
+    can_start = (state[measure][idx] == 1) & (state['budget'][idx] >= p[f'{measure}_cost'])
+    if measure == 'elevation':
+        can_start &= state['detached'][idx] == 1
+    # only a share of the households acts on its intention
+    start = idx[can_start & (get_generator(rng, idx).random(len(idx)) >= 1 - p['intention_action_gap'])]
+    state[measure][start] = 2
+    state['budget'][start] -= p[f'{measure}_cost']
+    state[f'{measure}_completion'][start] = step + max(p[f'{measure}_time'], 1)
+    state['is_adapted'][start] = True
+    state['is_adapted_cumulatief'][start] = True
+
+
+def choose_measures(state, idx, parameters, step, rng):
+    """
+    Array version of Households.choose_measure: depending on its AM, every household checks the available measures in a random order.
+    The order matters, because a measure that is started reduces the budget for the next ones.
+    """
+    p = parameters
+    AM = state['AM'][idx]
+    high = AM >= p['high_threshold']
+    medium = ~high & (AM >= p['medium_threshold'])
+    low = ~high & ~medium & (AM >= p['low_threshold'])
+    # random order of the measures, with unavailable measures sorted last
+    keys = get_generator(rng, idx).random((len(idx), len(MEASURES)))
+    available = np.column_stack([high, high | medium, high | medium | low])
+    keys[~available] = np.inf
+    order = np.argsort(keys, axis=1)
+    rows = np.arange(len(idx))
+    for slot in range(len(MEASURES)):
+        measure_index = order[:, slot]
+        slot_available = available[rows, measure_index]
+        for m, measure in enumerate(MEASURES):
+            selected = idx[slot_available & (measure_index == m)]
+            if len(selected):
+                check_measure(state, selected, measure, p, step, rng)
+
+
+def get_neighbor_average(AM, idx, indptr, indices, weights=None):
+    """Returns the (weighted) average AM of the neighbours of the households at the given indices, nan for households without neighbours."""
+    starts, ends = indptr[idx], indptr[idx + 1]
+    counts = ends - starts
+    rows = np.repeat(np.arange(len(idx)), counts)
+    # positions of the neighbours of the selected households in the indices array
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+    neighbors = indices[positions]
+    tie_weights = np.ones(len(neighbors)) if weights is None else weights[positions]
+    sums = np.bincount(rows, weights=AM[neighbors] * tie_weights, minlength=len(idx))
+    totals = np.bincount(rows, weights=tie_weights, minlength=len(idx))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / totals
+
+
+def step_households(state, idx, parameters, step, previous_AM, network, flood, flood_recency, last_flood, rng):
+    """
+    Array version of Households.step for the households at the given indices, with simultaneous activation.
+
+    Parameters
+    ----------
+    state: dictionary with the arrays of the household state
+    idx: indices of the households that are stepped
+    parameters: model parameters, see get_household_parameters
+    step: current step of the model
+    previous_AM: AM of all households at the start of the step, read for the neighbours
+    network: (indptr, indices, weights) of the social network in CSR format, weights can be None
+    flood, flood_recency, last_flood: whether a flood occurred this step, the flood recency and the step of the last flood.
+        These can be scalars or arrays with a value per household (e.g. per replication in an ensemble)
+    rng: NumPy random generator, or the random generator of an ensemble (see ensemble.py)
+    """
+    p = parameters
+    n = len(idx)
+    flood = np.broadcast_to(flood, n)
+    flood_recency = np.broadcast_to(flood_recency, n)
+    last_flood = np.broadcast_to(last_flood, n)
+    draws = get_generator(rng, idx)
+    complete_measures(state, idx, step)
+
+    state['is_adapted'][idx] = False
+    no_measures = (state['elevation'][idx] == 1) & (state['dry_proofing'][idx] == 1) & (state['wet_proofing'][idx] == 1)
+    state['is_adapted_cumulatief'][idx[no_measures]] = False
+
+    AM = determine_AM(state, idx)
+    choose_measures(state, idx, p, step, rng)
+
+    # shift the memory of undergone measures
+    memory = state['undergone_measures']
+    memory[idx, :-1] = memory[idx, 1:]
+    memory[idx, -1] = state['is_adapted'][idx]
+
+    # threat appraisal, see Households.update_threat_appraisal
+    depth = state['flood_depth_actual'][idx]
+    flood_threat = np.where(depth >= 6, draws.uniform(0.8, 1.0, n), np.where(depth > 2, draws.uniform(0.4, 0.8, n), draws.uniform(0.2, 0.4, n)))
+    threat_appraisal = np.where(flood, flood_threat, state['threat_appraisal'][idx] - 0.01)
+    state['threat_appraisal'][idx] = np.maximum(threat_appraisal, 0)
+
+    # coping appraisal, see Households.update_coping_appraisal
+    budget = state['budget'][idx]
+    coping_appraisal = state['coping_appraisal'][idx]
+    coping_appraisal = np.where(budget >= p['upper_budget_threshold'], 1.1 * coping_appraisal,
+                                np.where(budget <= p['lower_budget_threshold'], 0.9 * coping_appraisal, coping_appraisal))
+    state['coping_appraisal'][idx] = np.minimum(coping_appraisal, 1)
+
+    # preceding flood engagement, see Households.update_preceding_flood_engagement
+    measures_taken = memory[idx].mean(axis=1) >= draws.random(n)
+    recent_flood = flood_recency >= draws.random(n)
+    measures_factor = np.where(last_flood != 0, np.where(recent_flood, 1.1, 1), 1.05)
+    state['preceding_flood_engagement'][idx] *= np.where(measures_taken, measures_factor, np.where(recent_flood, 1.05, 0.9))
+
+    # external influence, see Households.update_external_influence
+    indptr, indices, weights = network
+    avg_neighbor_AM = get_neighbor_average(previous_AM, idx, indptr, indices, weights if p['use_weights'] else None)
+    state['external_influence'][idx] *= np.where(AM < avg_neighbor_AM, 1.1, 0.9)
+
+    determine_AM(state, idx)
+
+    # income, see Households.income
+    income_range = INCOME_RANGES.get(p['economic_status'])
+    if income_range is not None:
+        state['budget'][idx] += draws.integers(income_range[0], income_range[1] + 1, size=n)
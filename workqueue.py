@@ -0,0 +1,278 @@
+"""
+Work queue to run an experiment on workers on several hosts, without an external message broker.
+The coordinator holds the runs of the experiment (see experiments.make_tasks) and listens on a TCP address; workers connect
+to it (multiprocessing.connection, authenticated with a shared key), request runs one at a time and send back the results,
+which the coordinator writes to its ResultsStore.
+
+A run is leased to a worker for lease_time seconds. While the run is executed, the worker sends a heartbeat every
+heartbeat_interval seconds, which renews the lease. When a worker disconnects or its lease expires (a crashed host or a lost
+connection), the run is handed out again, up to max_attempts times. A result that arrives after its lease expired is still
+used if the run was not completed by another worker.
+
+Usage, on the coordinator:
+    coordinator = Coordinator(parameters, ResultsStore('results'), experiment='basecase', iterations=70,
+                              address=('0.0.0.0', 6000), authkey=b'secret')
+    runs = coordinator.run()
+on every worker host (in the model directory):
+    python workqueue.py --address coordinator-host:6000 --authkey secret --workers 8
+On a single machine, start_local_workers(coordinator.address, coordinator.authkey, number_workers) starts workers in
+local processes.
+"""
+import os
+import time
+import socket
+import argparse
+import threading
+import traceback
+import collections
+import multiprocessing as mp
+from multiprocessing.connection import Listener, Client
+import pandas as pd
+
+from experiments import make_tasks, preload_inputs, run_task
+
+
+class Coordinator():
+    """
+    Hands out the runs of an experiment to workers and collects their results in a ResultsStore, see the module docstring.
+
+    Parameters
+    ----------
+    parameters, iterations, max_steps, seed, agent_data: see experiments.iter_runs
+    store: ResultsStore (see results_store.py) to which the results are written
+    experiment: name of the experiment in the store
+    address: (host, port) on which the coordinator listens, port 0 for a free port (see the address attribute)
+    authkey: key (bytes) with which the workers authenticate, a random key if None (see the authkey attribute)
+    lease_time: seconds after the last heartbeat after which a run is handed out again
+    heartbeat_interval: seconds between the heartbeats of a worker, by default a third of the lease time
+    max_attempts: maximum number of times a run is handed out, after which it is marked as failed
+    cost_model: CostModel (see scheduling.py). If given, the runs are handed out in order of decreasing estimated time
+    """
+    def __init__(self, parameters, store, experiment = 'default', iterations = 1, max_steps = 120, seed = 0,
+                 agent_data = False, address = ('localhost', 0), authkey = None, lease_time = 60, heartbeat_interval = None,
+                 max_attempts = 3, cost_model = None):
+        self.store = store
+        self.experiment = experiment
+        self.max_steps = max_steps
+        self.agent_data = agent_data
+        self.lease_time = lease_time
+        self.heartbeat_interval = heartbeat_interval or lease_time / 3
+        self.max_attempts = max_attempts
+        self.cost_model = cost_model
+        tasks = make_tasks(parameters, iterations, seed)
+        if cost_model is not None:
+            tasks = cost_model.schedule(tasks, max_steps)
+        self.tasks = {task[0]: task for task in tasks}
+        self.pending = collections.deque(self.tasks)
+        self.runs = {run_id: {'RunId': run_id, 'status': 'pending', 'attempts': 0, 'worker': None, 'duration': None,
+                              'error': None} for run_id in sorted(self.tasks)}
+        self.leases = {} # run id -> (worker id, expiry time)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.authkey = authkey or os.urandom(16)
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+
+    def run(self):
+        """
+        Serve the workers until all runs are completed or failed.
+
+        Returns
+        -------
+        runs: DataFrame with the status ('done' or 'failed'), the number of attempts, the last worker, the duration and the
+              error of every run
+        """
+        accepting = threading.Thread(target=self.accept, daemon=True)
+        accepting.start()
+        with self.lock:
+            self.check_finished()
+        while not self.finished.wait(self.heartbeat_interval):
+            with self.lock:
+                self.expire_leases()
+        # wake up the thread that accepts connections, so it sees that the experiment is finished
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+        accepting.join()
+        self.listener.close()
+        if self.cost_model is not None:
+            self.cost_model.save()
+        return pd.DataFrame(list(self.runs.values()))
+
+    def accept(self):
+        """Accept connections of workers, and serve every worker in its own thread."""
+        while not self.finished.is_set():
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, mp.AuthenticationError):
+                continue
+            if self.finished.is_set():
+                connection.close()
+                break
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection):
+        """Answer the messages of a worker until it disconnects. The runs of a worker that disconnects are handed out again."""
+        workers = set()
+        try:
+            while True:
+                message = connection.recv()
+                workers.add(message[1])
+                connection.send(self.handle(*message))
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+            with self.lock:
+                for run_id, (worker, expiry) in list(self.leases.items()):
+                    if worker in workers:
+                        self.release(run_id, f'worker {worker} disconnected')
+
+    def handle(self, kind, worker, *arguments):
+        """Returns the answer to a message of a worker: a request for a run, a heartbeat, a result or an error."""
+        if kind == 'result':
+            return self.complete(worker, *arguments)
+        with self.lock:
+            if kind == 'request':
+                self.expire_leases()
+                if self.finished.is_set():
+                    return ('stop',)
+                if not self.pending:
+                    # all runs are leased: wait, since a lease may expire
+                    return ('wait', self.heartbeat_interval)
+                run_id = self.pending.popleft()
+                run = self.runs[run_id]
+                run.update(status='running', worker=worker, attempts=run['attempts'] + 1)
+                self.leases[run_id] = (worker, time.time() + self.lease_time)
+                return ('task', self.tasks[run_id], self.max_steps, self.agent_data, self.heartbeat_interval)
+            elif kind == 'heartbeat':
+                run_id, = arguments
+                if self.leases.get(run_id, (None, 0))[0] == worker:
+                    self.leases[run_id] = (worker, time.time() + self.lease_time)
+                return ('ok',)
+            elif kind == 'error':
+                run_id, error = arguments
+                if self.leases.get(run_id, (None, 0))[0] == worker:
+                    self.release(run_id, error)
+                return ('ok',)
+        raise ValueError(f"Unknown message from worker {worker}: '{kind}'")
+
+    def complete(self, worker, result):
+        """Write the result of a run to the store, unless the run was already completed by another worker."""
+        run_id = result['RunId']
+        with self.lock:
+            if self.runs[run_id]['status'] == 'done':
+                return ('ok',)
+        self.store.write_run(self.experiment, result)
+        with self.lock:
+            self.leases.pop(run_id, None)
+            if run_id in self.pending:
+                self.pending.remove(run_id) # the lease had expired, but the result arrived before the run was handed out again
+            self.runs[run_id].update(status='done', worker=worker, duration=result['duration'], error=None)
+            if self.cost_model is not None:
+                self.cost_model.record(result['parameters'], self.max_steps, result['duration'])
+            self.check_finished()
+        return ('ok',)
+
+    def release(self, run_id, error):
+        """Hand out a leased run again, or mark it as failed after max_attempts. Called with the lock held."""
+        del self.leases[run_id]
+        run = self.runs[run_id]
+        run['error'] = error
+        if run['attempts'] >= self.max_attempts:
+            run['status'] = 'failed'
+            self.check_finished()
+        else:
+            run['status'] = 'pending'
+            self.pending.append(run_id)
+
+    def expire_leases(self):
+        """Hand out the runs of which the lease expired again. Called with the lock held."""
+        now = time.time()
+        for run_id, (worker, expiry) in list(self.leases.items()):
+            if expiry < now:
+                self.release(run_id, f'the lease of worker {worker} expired')
+
+    def check_finished(self):
+        """Set finished when all runs are completed or failed. Called with the lock held."""
+        if all(run['status'] in ('done', 'failed') for run in self.runs.values()):
+            self.finished.set()
+
+
+def send_heartbeats(call, worker, run_id, interval, stop):
+    """Send a heartbeat for a run every interval seconds, until stop is set."""
+    while not stop.wait(interval):
+        call('heartbeat', worker, run_id)
+
+
+def run_worker(address, authkey, worker = None):
+    """
+    Request runs from a coordinator and send back their results, until the coordinator has no runs left.
+    The runs are executed in this process, and a heartbeat is sent from a thread while a run is executed.
+    """
+    worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+    connection = Client(address, authkey=authkey)
+    lock = threading.Lock() # the heartbeat thread and the main thread share the connection
+
+    def call(*message):
+        with lock:
+            connection.send(message)
+            return connection.recv()
+
+    try:
+        while True:
+            answer = call('request', worker)
+            if answer[0] == 'stop':
+                break
+            if answer[0] == 'wait':
+                time.sleep(answer[1])
+                continue
+            _, task, max_steps, agent_data, heartbeat_interval = answer
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=send_heartbeats, args=(call, worker, task[0], heartbeat_interval, stop),
+                                         daemon=True)
+            heartbeat.start()
+            try:
+                message = ('result', worker, run_task(task, max_steps, agent_data))
+            except Exception:
+                message = ('error', worker, task[0], traceback.format_exc())
+            finally:
+                stop.set()
+                heartbeat.join()
+            call(*message)
+    except (EOFError, OSError):
+        pass # the coordinator stopped
+    finally:
+        connection.close()
+
+
+def start_local_workers(address, authkey, number_workers, parameters = None):
+    """
+    Start workers in local processes. If the parameters of the experiment are given, their flood maps are loaded first,
+    so that the workers inherit them (with the fork start method).
+    """
+    if parameters is not None:
+        preload_inputs(parameters)
+    context = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+    workers = []
+    for _ in range(number_workers):
+        process = context.Process(target=run_worker, args=(address, authkey), daemon=True)
+        process.start()
+        workers.append(process)
+    return workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Start workers that run the runs of a coordinator (see workqueue.py).')
+    parser.add_argument('--address', required=True, help='host:port of the coordinator')
+    parser.add_argument('--authkey', required=True, help='key of the coordinator')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    args = parser.parse_args()
+    host, port = args.address.rsplit(':', 1)
+    for process in start_local_workers((host, int(port)), args.authkey.encode(), args.workers):
+        process.join()
+
+
+if __name__ == '__main__':
+    main()